@@ -0,0 +1,338 @@
+import os
+import json
+import queue
+import base64
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import mimetypes
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs, unquote, urlencode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from locations import bbox_condition
+from schema import parse_exif_datetime
+from thumbnails import ThumbnailCache, THUMBNAIL_SIZES, DEFAULT_CACHE_BYTES
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+IMAGE_COLUMNS = """
+    m.id, m.filename, m.file_path, m.taken_at, strftime('%Y-%m-%dT%H:%M:%S', m.taken_at, 'unixepoch'),
+    m.GPSInfo, m.latitude, m.longitude, m.make, m.model, m.cluster_id,
+    (SELECT group_concat(DISTINCT f.cluster_id) FROM face_encodings f WHERE f.media_id = m.id AND f.cluster_id >= 0),
+    m.duplicate_of, (
+        SELECT COUNT(*) FROM media_metadata d WHERE d.duplicate_of = m.id AND d.id != m.id AND d.deleted_at IS NULL
+    )
+"""
+
+class ConnectionPool:
+    """A fixed set of read-only connections shared by the request threads."""
+
+    def __init__(self, db_name, size=8):
+        self.connections = queue.Queue()
+        uri = "file:" + os.path.abspath(db_name) + "?mode=ro"
+        for _ in range(size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only=1;")
+            conn.execute("PRAGMA cache_size=-16384;")
+            self.connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+def database_version(db_name):
+    """
+    Cheap token that changes whenever the database is written: the size and
+    mtime of the database file and of its WAL, if any.
+    """
+    parts = []
+    for path in (db_name, db_name + "-wal"):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append("-")
+    return "/".join(parts)
+
+def make_etag(*parts):
+    return '"' + hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest() + '"'
+
+def encode_cursor(taken_at, image_id):
+    return base64.urlsafe_b64encode(json.dumps([taken_at, image_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        taken_at, image_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return (None if taken_at is None else int(taken_at)), int(image_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+def parse_date(value, end_of_day=False):
+    """Parse 'YYYY-MM-DD' (or a full EXIF/ISO timestamp) to the epoch used by taken_at."""
+    if len(value) == 10:
+        value += " 23:59:59" if end_of_day else " 00:00:00"
+    taken_at = parse_exif_datetime(value.replace("T", " "))
+    if taken_at is None:
+        raise ValueError(f"Invalid date: {value}")
+    return taken_at
+
+def image_filters(params):
+    """Turn query parameters into SQL conditions on media_metadata `m`."""
+    conditions, values = ["m.deleted_at IS NULL"], []
+    if "duplicate_of" in params:  # One near-duplicate group, original included
+        conditions.append("m.duplicate_of = ?")
+        values.append(int(params["duplicate_of"]))
+    elif params.get("duplicates") != "1":  # The wall shows each group once, as its original
+        conditions.append("(m.duplicate_of IS NULL OR m.duplicate_of = m.id)")
+    if "date_from" in params:
+        conditions.append("m.taken_at >= ?")
+        values.append(parse_date(params["date_from"]))
+    if "date_to" in params:
+        conditions.append("m.taken_at <= ?")
+        values.append(parse_date(params["date_to"], end_of_day=True))
+    if "cluster" in params:  # Any face of the photo, not only the one media_metadata.cluster_id keeps
+        conditions.append("m.id IN (SELECT f.media_id FROM face_encodings f WHERE f.cluster_id = ?)")
+        values.append(int(params["cluster"]))
+    for name in ("make", "model"):
+        if name in params:
+            conditions.append(f"m.{name} = ?")
+            values.append(params[name])
+    if "bbox" in params:
+        try:
+            south, west, north, east = (float(v) for v in params["bbox"].split(","))
+        except ValueError:
+            raise ValueError("bbox must be south,west,north,east.")
+        condition, bbox_values = bbox_condition(south, west, north, east)
+        conditions.append(condition)
+        values.extend(bbox_values)
+    return conditions, values
+
+def query_images(conn, params):
+    """
+    Return one page of images, newest first, and the cursor of the next page (or None).
+    Pages are keyed on (taken_at, id): dated photos are read through the
+    taken_at index first, then undated ones by id, so no page needs an OFFSET.
+    """
+    limit = min(int(params.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError("limit must be positive.")
+    conditions, values = image_filters(params)
+    cursor = decode_cursor(params["cursor"]) if "cursor" in params else None
+
+    rows = []
+    if cursor is None or cursor[0] is not None:
+        keyset = ["m.taken_at IS NOT NULL"] + (["(m.taken_at, m.id) < (?, ?)"] if cursor else [])
+        rows = conn.execute(f'''
+            SELECT {IMAGE_COLUMNS} FROM media_metadata m
+            WHERE {" AND ".join(conditions + keyset)}
+            ORDER BY m.taken_at DESC, m.id DESC LIMIT ?
+        ''', values + list(cursor or ()) + [limit + 1]).fetchall()
+    if len(rows) <= limit:
+        keyset = ["m.taken_at IS NULL"] + (["m.id < ?"] if cursor and cursor[0] is None else [])
+        rows += conn.execute(f'''
+            SELECT {IMAGE_COLUMNS} FROM media_metadata m
+            WHERE {" AND ".join(conditions + keyset)}
+            ORDER BY m.id DESC LIMIT ?
+        ''', values + ([cursor[1]] if cursor and cursor[0] is None else []) + [limit + 1 - len(rows)]).fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+    return [image_json(row) for row in rows[:limit]], next_cursor
+
+def image_json(row):
+    """Shape a row like the FE's Media type."""
+    (image_id, filename, file_path, _, date_created, gps, latitude, longitude, make, model, cluster_id, clusters,
+     duplicate_of, duplicate_count) = row
+    src = "/images/" + (filename or "")
+    thumbnail = f"/thumbnails/{image_id}?size={min(THUMBNAIL_SIZES)}"
+    return {
+        "id": str(image_id),
+        "filename": filename,
+        "title": filename,
+        "path": file_path,
+        "src": src,
+        "thumbnail": thumbnail,
+        "type": "image",
+        "tags": [],
+        "dateCreated": date_created,
+        "location": gps or "",
+        "latitude": latitude,
+        "longitude": longitude,
+        "make": make,
+        "model": model,
+        "clusterId": cluster_id,
+        "clusterIds": sorted(int(c) for c in clusters.split(",")) if clusters else [],
+        "duplicateOf": str(duplicate_of) if duplicate_of is not None and duplicate_of != image_id else None,
+        "duplicateCount": duplicate_count,
+    }
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so clients reuse connections
+    disable_nagle_algorithm = True  # Headers and body are separate writes; don't wait for an ACK in between
+    server_version = "DIW"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path).rstrip("/")
+        try:
+            if path == "/images":
+                self.list_images(url)
+            elif path.startswith("/images/"):
+                self.send_image(path[len("/images/"):])
+            elif path.startswith("/thumbnails/"):
+                self.send_thumbnail(path[len("/thumbnails/"):], url)
+            elif path == "/stats":
+                self.send_json(200, {"thumbnails": self.server.thumbnails.stats()})
+            else:
+                self.send_json(404, {"error": "Not found."})
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+        except sqlite3.Error as e:
+            self.send_json(500, {"error": f"Database error: {e}"})
+
+    def list_images(self, url):
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        etag = make_etag(database_version(self.server.db_name), url.query)
+        if self.not_modified(etag):
+            return
+        with self.server.pool.connection() as conn:
+            images, next_cursor = query_images(conn, params)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+            query = urlencode({**{k: v for k, v in params.items() if k != "cursor"}, "cursor": next_cursor})
+            headers["Link"] = f'</images?{query}>; rel="next"'
+        self.send_json(200, images, headers)
+
+    def send_image(self, filename):
+        with self.server.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT file_path FROM media_metadata WHERE filename = ? AND deleted_at IS NULL ORDER BY id LIMIT 1",
+                (filename,),
+            ).fetchone()
+        try:
+            stat = os.stat(row[0]) if row else None
+        except OSError:
+            stat = None
+        if stat is None:
+            self.send_json(404, {"error": "Image not found."})
+            return
+        etag = make_etag(row[0], stat.st_size, stat.st_mtime_ns)
+        if self.not_modified(etag):
+            return
+        with open(row[0], "rb") as f:
+            content_type = mimetypes.guess_type(row[0])[0] or "application/octet-stream"
+            self.send_file(f, stat.st_size, content_type, etag, "max-age=3600")
+
+    def send_thumbnail(self, image_id, url):
+        """Serve a cached thumbnail, rendering it on the first request."""
+        params = parse_qs(url.query)
+        size = int(params.get("size", [min(THUMBNAIL_SIZES)])[-1])
+        with self.server.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT file_path FROM media_metadata WHERE id = ? AND deleted_at IS NULL", (int(image_id),)
+            ).fetchone()
+        cache = self.server.thumbnails
+        for _ in range(2):  # The thumbnail may be evicted by another request before it is opened
+            try:
+                thumbnail_path, digest = cache.get(row[0], size) if row else (None, None)
+                if thumbnail_path is None:
+                    break
+                # Content-addressed: a given source version always yields the same thumbnail
+                etag = make_etag(digest, size, cache.fmt)
+                if self.not_modified(etag):
+                    return
+                with open(thumbnail_path, "rb") as f:
+                    self.send_file(f, os.fstat(f.fileno()).st_size, cache.content_type, etag, "max-age=86400")
+                return
+            except FileNotFoundError:
+                continue
+            except OSError:
+                break
+        self.send_json(404, {"error": "Image not found."})
+
+    def send_file(self, f, length, content_type, etag, cache_control):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        shutil.copyfileobj(f, self.wfile)
+
+    def not_modified(self, etag):
+        """Answer 304 when the client already has this version."""
+        if etag not in (self.headers.get("If-None-Match") or ""):
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        return True
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Expose-Headers", "ETag, Link, X-Next-Cursor")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, db_name, pool_size=8, verbose=False, thumbnails=None):
+        super().__init__(address, ApiHandler)
+        self.db_name = db_name
+        self.pool = ConnectionPool(db_name, pool_size)
+        self.verbose = verbose
+        self.thumbnails = thumbnails or ThumbnailCache("thumbnails")
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        self.thumbnails.close()
+
+def serve(db_name, host="127.0.0.1", port=5000, pool_size=8, verbose=False,
+          thumbnail_dir="thumbnails", thumbnail_bytes=DEFAULT_CACHE_BYTES):
+    """Serve the API until interrupted."""
+    thumbnails = ThumbnailCache(thumbnail_dir, thumbnail_bytes)
+    server = ApiServer((host, port), db_name, pool_size, verbose, thumbnails)
+    print(f"✅ Serving {db_name} on http://{host}:{port}/images")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("⚠️ Server stopped by user.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve media_metadata.db over HTTP.")
+    parser.add_argument("--db", default="media_metadata.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    parser.add_argument("--thumbnail-dir", default="thumbnails")
+    parser.add_argument("--thumbnail-mb", type=int, default=DEFAULT_CACHE_BYTES // 1024 ** 2, help="Thumbnail cache cap")
+    args = parser.parse_args()
+    serve(args.db, args.host, args.port, args.pool_size, args.verbose, args.thumbnail_dir, args.thumbnail_mb * 1024 ** 2)
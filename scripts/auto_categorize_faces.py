@@ -1,15 +1,12 @@
-import os
 import sqlite3
-import dlib
-import math
-import shutil
+import numpy as np
 from PIL import Image
 from collections import defaultdict
-
-# Load Dlib's face detector and face recognition model
-face_detector = dlib.get_frontal_face_detector()
-shape_predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
-face_recognition_model = dlib.face_recognition_model_v1("dlib_face_recognition_resnet_model_v1.dat")
+from face_distance import as_matrix, nearest_neighbors
+from face_store import create_face_store, pending_images, load_encodings, update_face_labels
+from face_detection import detect_and_store
+from cluster_folders import materialize_clusters
+from metrics import metrics
 
 def get_image_paths_from_database(db_name, table_name):
     """Retrieve image file paths from the database."""
@@ -26,103 +23,100 @@ def get_image_paths_from_database(db_name, table_name):
         print(f"❌ Database error: {e}")
         return []
 
-def extract_face_encodings(image_data):
-    """Extract facial encodings from all images."""
-    encodings = []
-    image_ids = []
-
-    for image_id, file_path in image_data:
-        if file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-            try:
-                print(f"Processing {file_path}...")
-                image = dlib.load_rgb_image(file_path)
-                faces = face_detector(image, 1)  # Detect faces
-
-                if len(faces) > 0:
-                    for face in faces:
-                        shape = shape_predictor(image, face)
-                        encoding = face_recognition_model.compute_face_descriptor(image, shape)
-                        encodings.append(list(encoding))  # Convert to list for compatibility
-                        image_ids.append(image_id)
-                else:
-                    print(f"⚠️ No faces detected in {file_path}.")
-            except Exception as e:
-                print(f"❌ Error processing {file_path}: {e}")
-
-    if not encodings:
-        print("⚠️ No facial encodings extracted from the images.")
-    return encodings, image_ids
+def extract_face_encodings(db_name, image_data, workers=None, save_every=100, max_side=None):
+    """
+    Extract facial encodings from images that are new or changed since the last run,
+    then return every stored encoding with the id of its face.
+    Detection runs in `workers` processes (one per CPU by default). With
+    `max_side`, images are decoded downscaled for detection (see face_detection).
+    """
+    create_face_store(db_name)
+    image_data = [(i, p) for i, p in image_data if p.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    pending = pending_images(db_name, image_data)
+    print(f"{len(pending)} of {len(image_data)} images need face detection.")
+
+    detect_and_store(db_name, pending, "dlib", workers, save_every, max_side)
 
-def euclidean_distance(vec1, vec2):
-    """Calculate the Euclidean distance between two vectors."""
-    return math.sqrt(sum((a - b) ** 2 for a, b in zip(vec1, vec2)))
+    encodings, _, face_ids = load_encodings(db_name, with_face_ids=True)
+    if len(encodings) == 0:
+        print("⚠️ No facial encodings extracted from the images.")
+    return encodings, face_ids
 
-def hierarchical_clustering(encodings, threshold=0.6):
+def hierarchical_clustering(encodings, threshold=0.6, block_size=4096):
     """
     Perform Hierarchical Agglomerative Clustering (HAC) on facial encodings.
     Groups faces into clusters based on a distance threshold.
+    Each face joins the nearest running cluster centroid within `threshold`,
+    otherwise it starts a new cluster. Centroids of existing clusters are
+    refreshed once per block of `block_size` faces.
+    Returns one cluster label per encoding, in input order.
     """
-    clusters = []
-    for encoding in encodings:
-        added_to_cluster = False
-        for cluster in clusters:
-            # Compare with the first encoding in the cluster
-            if euclidean_distance(encoding, cluster[0]) <= threshold:
-                cluster.append(encoding)
-                added_to_cluster = True
-                break
-        if not added_to_cluster:
-            clusters.append([encoding])  # Start a new cluster
-    return clusters
-
-def assign_cluster_ids(encodings, clusters):
-    """
-    Assign cluster IDs to each encoding based on the clustering results.
-    """
-    labels = [-1] * len(encodings)
-    for cluster_id, cluster in enumerate(clusters):
-        for encoding in cluster:
-            index = encodings.index(encoding)
-            labels[index] = cluster_id
-    return labels
-
-def update_database_with_clusters(db_name, table_name, image_ids, labels):
-    """Update the database with cluster IDs."""
+    matrix = as_matrix(encodings)
+    labels = np.full(len(matrix), -1, dtype=np.int64)
+    capacity = 0
+    sums = np.zeros((capacity, matrix.shape[1]), dtype=np.float64)
+    counts = np.zeros(capacity, dtype=np.int64)
+    centroids = np.zeros((capacity, matrix.shape[1]), dtype=np.float32)
+    cluster_count = 0
+
+    for start in range(0, len(matrix), block_size):
+        block = matrix[start:start + block_size]
+        block_labels = labels[start:start + block_size]
+
+        # Make room for every face of the block starting a new cluster
+        if cluster_count + len(block) > capacity:
+            capacity = max(2 * capacity, cluster_count + len(block))
+            sums = np.resize(sums, (capacity, matrix.shape[1]))
+            counts = np.resize(counts, capacity)
+            centroids = np.resize(centroids, (capacity, matrix.shape[1]))
+
+        # Match the whole block against the centroids known before it
+        nearest, distances = nearest_neighbors(block, centroids[:cluster_count])
+        matched = distances <= threshold
+        block_labels[matched] = nearest[matched]
+        np.add.at(sums, nearest[matched], block[matched])
+        np.add.at(counts, nearest[matched], 1)
+
+        # Faces that matched nothing are compared against clusters started in this block
+        first_new = cluster_count
+        for i in np.flatnonzero(~matched):
+            if cluster_count > first_new:
+                offset, distance = nearest_neighbors(block[i:i + 1], centroids[first_new:cluster_count])
+                if distance[0] <= threshold:
+                    cluster_id = first_new + offset[0]
+                    block_labels[i] = cluster_id
+                    sums[cluster_id] += block[i]
+                    counts[cluster_id] += 1
+                    centroids[cluster_id] = sums[cluster_id] / counts[cluster_id]
+                    continue
+            block_labels[i] = cluster_count  # Start a new cluster
+            sums[cluster_count] = block[i]
+            counts[cluster_count] = 1
+            centroids[cluster_count] = block[i]
+            cluster_count += 1
+
+        touched = np.unique(nearest[matched])
+        centroids[touched] = sums[touched] / counts[touched, None]
+
+    return labels.tolist()
+
+def update_database_with_clusters(db_name, face_ids, labels):
+    """Update the database with the cluster ID of every face (and of their photos)."""
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        for image_id, cluster_id in zip(image_ids, labels):
-            cursor.execute(f"UPDATE {table_name} SET cluster_id = ? WHERE id = ?", (cluster_id, image_id))
-        conn.commit()
-        conn.close()
+        update_face_labels(db_name, face_ids, labels)
         print("✅ Database updated with cluster IDs.")
     except sqlite3.Error as e:
         print(f"❌ Database update error: {e}")
 
-def save_clustered_faces(db_name, table_name, output_folder):
-    """Save images into folders based on their cluster IDs."""
+def save_clustered_faces(db_name, output_folder, mode="hardlink"):
+    """
+    Link images into folders based on the clusters of their faces (see
+    cluster_folders.materialize_clusters for the modes); reruns only apply changes.
+    """
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT file_path, cluster_id FROM {table_name} WHERE cluster_id IS NOT NULL;")
-        clustered_data = cursor.fetchall()
-        conn.close()
-
-        if not clustered_data:
+        stats = materialize_clusters(db_name, output_folder, mode)
+        if not stats["created"] and not stats["kept"]:
             print("⚠️ No clustered data found in the database.")
-            return
-
-        for file_path, cluster_id in clustered_data:
-            cluster_folder = os.path.join(output_folder, f"cluster_{cluster_id}")
-            if not os.path.exists(cluster_folder):
-                os.makedirs(cluster_folder)
-
-            try:
-                shutil.copy(file_path, cluster_folder)
-            except Exception as e:
-                print(f"❌ Error copying {file_path} to cluster folder: {e}")
-
-        print(f"✅ Clustered faces saved in {output_folder}.")
     except sqlite3.Error as e:
         print(f"❌ Error retrieving clustered data: {e}")
 
@@ -158,25 +152,25 @@ if __name__ == "__main__":
 
         # Step 2: Extract facial encodings
         print("Extracting facial encodings...")
-        encodings, image_ids = extract_face_encodings(image_data)
-        if not encodings:
+        encodings, face_ids = extract_face_encodings(db_name, image_data)
+        if len(encodings) == 0:
             print("❌ No faces found in the images. Exiting.")
             exit()
         print(f"✅ Extracted {len(encodings)} facial encodings.")
 
         # Step 3: Perform hierarchical clustering
         print("Clustering faces using Hierarchical Agglomerative Clustering...")
-        clusters = hierarchical_clustering(encodings, threshold=0.6)
-        labels = assign_cluster_ids(encodings, clusters)
-        print(f"✅ Clustering complete. Found {len(clusters)} clusters.")
+        with metrics.timed("cluster"):
+            labels = hierarchical_clustering(encodings, threshold=0.6)
+        print(f"✅ Clustering complete. Found {max(labels) + 1} clusters.")
 
         # Step 4: Update database with cluster IDs
         print("Updating database with cluster IDs...")
-        update_database_with_clusters(db_name, table_name, image_ids, labels)
+        update_database_with_clusters(db_name, face_ids, labels)
 
         # Step 5: Save clustered faces into folders
         print("Saving clustered faces into folders...")
-        save_clustered_faces(db_name, table_name, output_folder)
+        save_clustered_faces(db_name, output_folder)
 
         # Step 6: Print cluster summary
         print_cluster_summary(db_name, table_name)
@@ -184,3 +178,4 @@ if __name__ == "__main__":
         print("✅ Face clustering complete!")
     except Exception as e:
         print(f"❌ An error occurred: {e}")
+    metrics.print_summary()
@@ -0,0 +1,88 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+from exif_reader import read_exif_header, read_exif_pillow
+
+CAMERAS = [("Apple", "iPad"), ("Apple", "iPhone 12"), ("Canon", "EOS 80D"), ("NIKON CORPORATION", "NIKON D750")]
+
+def _dms(value):
+    """Split decimal degrees into EXIF (degrees, minutes, seconds) rationals."""
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = IFDRational(round(((value - degrees) * 60 - minutes) * 60 * 100), 100)
+    return (IFDRational(degrees, 1), IFDRational(minutes, 1), seconds)
+
+def write_synthetic_jpeg(path, rng, size=(2592, 1936), quality=85):
+    """Write a JPEG with randomized date, camera, exposure and GPS EXIF fields."""
+    make, model = rng.choice(CAMERAS)
+    exif = Image.Exif()
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = f"{rng.randint(2005, 2024)}:{rng.randint(1, 12):02}:{rng.randint(1, 28):02} " \
+                       f"{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02}"
+    exif_ifd[0x8827] = rng.choice([50, 100, 200, 250, 400, 800, 1600])
+    exif_ifd[0x829D] = IFDRational(rng.choice([18, 24, 28, 40, 56]), 10)
+    exif_ifd[0x829A] = IFDRational(1, rng.choice([15, 17, 30, 60, 125, 250]))
+    gps_ifd = exif.get_ifd(0x8825)
+    latitude, longitude = rng.uniform(-80, 80), rng.uniform(-179, 179)
+    gps_ifd[1], gps_ifd[2] = ("N" if latitude >= 0 else "S"), _dms(abs(latitude))
+    gps_ifd[3], gps_ifd[4] = ("E" if longitude >= 0 else "W"), _dms(abs(longitude))
+
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    image.save(path, "JPEG", exif=exif, quality=quality)
+
+def stored_fields(result):
+    """Reduce a reader result to the values extract_image_metadata would store."""
+    metadata, size = result
+    if metadata is None:
+        return None, size
+    gps = metadata.get("GPSInfo") or {}
+    coordinates = tuple(
+        d + (m / 60.0) + (s / 3600.0) for d, m, s in (gps.get(2, (0, 0, 0)), gps.get(4, (0, 0, 0)))
+    )
+    return (
+        metadata.get("DateTimeOriginal"), metadata.get("Make"), metadata.get("Model"), size,
+        metadata.get("ISOSpeedRatings"), float(metadata.get("FNumber", 0)),
+        str(metadata.get("ExposureTime")), gps.get(1), gps.get(3), coordinates,
+    )
+
+def benchmark(folder, rounds=3):
+    """Time both EXIF readers over every JPEG in `folder` and check they agree."""
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith(".jpg")]
+    timings = {}
+    for name, reader in (("pillow", read_exif_pillow), ("header", read_exif_header)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            results = [reader(path) for path in paths]
+        timings[name] = (time.perf_counter() - start) / rounds
+        timings[name + "_results"] = results
+
+    mismatches = sum(
+        stored_fields(a) != stored_fields(b)
+        for a, b in zip(timings["pillow_results"], timings["header_results"])
+    )
+    for name in ("pillow", "header"):
+        print(f"{name:>6}: {timings[name]:.3f}s for {len(paths)} files ({len(paths) / timings[name]:.0f} files/s)")
+    print(f"Speedup: {timings['pillow'] / timings['header']:.1f}x, mismatching results: {mismatches}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the header-only EXIF reader against Pillow.")
+    parser.add_argument("--count", type=int, default=500, help="Number of synthetic JPEGs")
+    parser.add_argument("--folder", help="Existing folder of JPEGs to use instead of a synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.folder:
+        benchmark(args.folder)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            rng = random.Random(args.seed)
+            print(f"Generating {args.count} synthetic JPEGs...")
+            for i in range(args.count):
+                write_synthetic_jpeg(os.path.join(folder, f"{i:06}.jpg"), rng)
+            benchmark(folder)
@@ -0,0 +1,47 @@
+import argparse
+import time
+import numpy as np
+from face_index import INDEX_BACKENDS, build_index, recall
+
+def synthetic_encodings(count, identities=1000, dim=128, spread=0.15, seed=0):
+    """Generate unit-length encodings grouped around `identities` random people."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(identities, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    owners = rng.integers(0, identities, size=count)
+    noise = rng.normal(scale=spread / np.sqrt(dim), size=(count, dim)).astype(np.float32)
+    encodings = centers[owners] + noise
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings
+
+def benchmark(count, identities, eps, queries, backends):
+    """Time index build and eps-range queries, reporting recall against the exact backend."""
+    encodings = synthetic_encodings(count, identities)
+    query_ids = np.random.default_rng(1).choice(count, min(queries, count), replace=False)
+    results = {}
+
+    for backend in ["exact"] + [b for b in backends if b != "exact"]:
+        start = time.perf_counter()
+        index = build_index(encodings, backend)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        neighbors = index.range_query(query_ids, eps)
+        query_seconds = time.perf_counter() - start
+
+        results[backend] = neighbors
+        backend_recall = recall(neighbors, results["exact"])
+        print(f"{backend:>6}: build {build_seconds:.3f}s, {len(query_ids)} queries {query_seconds:.3f}s "
+              f"({len(query_ids) / max(query_seconds, 1e-9):.0f} q/s), recall {backend_recall:.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark face neighbor index backends.")
+    parser.add_argument("--count", type=int, default=100000, help="Number of synthetic encodings")
+    parser.add_argument("--identities", type=int, default=5000, help="Number of distinct synthetic people")
+    parser.add_argument("--eps", type=float, default=0.5, help="Range query radius")
+    parser.add_argument("--queries", type=int, default=2000, help="Number of range queries to time")
+    parser.add_argument("--backends", nargs="+", default=list(INDEX_BACKENDS), choices=list(INDEX_BACKENDS))
+    args = parser.parse_args()
+
+    print(f"Benchmarking {args.count} encodings ({args.identities} identities, eps={args.eps})...")
+    benchmark(args.count, args.identities, args.eps, args.queries, args.backends)
@@ -0,0 +1,259 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import redirect_stdout, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from bench_exif import write_synthetic_jpeg
+from bench_face_index import synthetic_encodings
+from schema import migrate
+from extract_exif import rescan_folder, read_file_metadata, normalize_encodings, cluster_faces, update_cluster_ids
+from auto_categorize_faces import hierarchical_clustering
+from face_store import create_face_store, save_faces, load_encodings
+from duplicates import hash_new_media, group_duplicates
+from api_server import query_images
+from export_to_excel import export_table
+from locations import photos_in_bbox, nearest_photos
+from metrics import metrics, percentile
+
+# Stages that can be left out; ingest and encoding storage always run since the others need their data
+OPTIONAL_STAGES = ("exif", "dedupe", "load_encodings", "cluster_dbscan", "cluster_ivf", "cluster_hac", "update_clusters",
+                   "queries", "export")
+FILES_PER_FOLDER = 1000
+
+def corpus_path(folder, i):
+    return os.path.join(folder, f"{i // FILES_PER_FOLDER:04}", f"{i:07}.jpg")
+
+def _write_corpus_range(folder, seed, start, stop, size):
+    """Worker step: write photos start..stop-1, each from its own seeded generator."""
+    for i in range(start, stop):
+        path = corpus_path(folder, i)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_synthetic_jpeg(path, random.Random(f"{seed}:{i}"), size)
+
+def generate_corpus(folder, count, seed=0, size=(320, 240), workers=None):
+    """
+    Write `count` synthetic JPEGs with randomized EXIF under `folder`, in
+    subfolders of FILES_PER_FOLDER. Photo i only depends on (seed, i), so the
+    corpus is identical for any worker count, and an existing corpus with the
+    same parameters is reused as is.
+    """
+    spec = {"count": count, "seed": seed, "size": list(size)}
+    spec_path = os.path.join(folder, "corpus.json")
+    if os.path.exists(spec_path):
+        with open(spec_path) as f:
+            if json.load(f) == spec:
+                return
+    os.makedirs(folder, exist_ok=True)
+    print(f"Generating {count} synthetic JPEGs in {folder}...")
+    step = 250
+    with ProcessPoolExecutor(workers) as pool:
+        for future in [pool.submit(_write_corpus_range, folder, seed, start, min(start + step, count), size)
+                       for start in range(0, count, step)]:
+            future.result()
+    with open(spec_path, "w") as f:
+        json.dump(spec, f)
+
+def timed_stage(results, name, items, run, quiet=None):
+    """Run one stage (inside the `quiet` context, if any) and record its wall time and throughput in `results`."""
+    with quiet or nullcontext():
+        started = time.perf_counter()
+        value = run()
+    seconds = time.perf_counter() - started
+    results[name] = {"seconds": round(seconds, 4), "items": items, "per_s": round(items / max(seconds, 1e-9), 1)}
+    print(f"  {name:<16} {seconds:8.3f}s  {items:>8} items  {results[name]['per_s']:>10.1f}/s")
+    return value
+
+def time_queries(conn, repeat):
+    """p50/p95 latency of the API's typical page queries and of the location lookups."""
+    row = conn.execute("SELECT make, model FROM media_metadata LIMIT 1").fetchone()
+    queries = {
+        "first_page": lambda: query_images(conn, {}),
+        "make_model_page": lambda: query_images(conn, {"make": row[0], "model": row[1]}),
+        "date_range_page": lambda: query_images(conn, {"date_from": "2015-01-01", "date_to": "2015-12-31"}),
+        "cluster_page": lambda: query_images(conn, {"cluster": "0"}),
+        "bbox_page": lambda: query_images(conn, {"bbox": "30,-10,60,30"}),
+        "tenth_page": lambda: _walk_pages(conn, 10),
+        "bbox": lambda: photos_in_bbox(conn, 30, -10, 60, 30),
+        "nearest_20": lambda: nearest_photos(conn, 48.85, 2.35, 20),
+    }
+    timings = {}
+    for name, query in queries.items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        timings[name] = {"p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+                         "p95_ms": round(percentile(samples, 0.95) * 1000, 3)}
+    return timings
+
+def _walk_pages(conn, pages):
+    params = {}
+    for _ in range(pages):
+        _, cursor = query_images(conn, params)
+        if cursor is None:
+            return
+        params = {"cursor": cursor}
+
+def store_synthetic_faces(db_name, encodings, seed):
+    """Attach the encodings to random photos, as face detection would."""
+    conn = sqlite3.connect(db_name)
+    media_ids = np.array([row[0] for row in conn.execute("SELECT id FROM media_metadata")])
+    conn.close()
+    owners = np.random.default_rng(seed).choice(media_ids, len(encodings))
+    faces = {}
+    for media_id, encoding in zip(owners.tolist(), encodings):
+        faces.setdefault(media_id, []).append(encoding)
+    save_faces(db_name, [
+        (media_id, (0.0, 0, None), [(0, 10, 10, 0)] * len(found), found) for media_id, found in faces.items()
+    ])
+
+def run_scale(count, args, work_dir):
+    """Run every selected stage on a fresh database over a corpus of `count` photos."""
+    with open(os.devnull, "w") as devnull:
+        return _run_scale(count, args, work_dir, nullcontext() if args.verbose else redirect_stdout(devnull))
+
+def _run_scale(count, args, work_dir, quiet):
+    folder = os.path.join(args.corpus_dir, str(count))
+    generate_corpus(folder, count, args.seed, tuple(args.image_size), args.workers)
+    db_name = os.path.join(work_dir, f"bench_{count}.db")
+    face_count = int(count * args.faces_per_photo)
+    selected = set(args.stages)
+    results = {}
+    metrics.reset()
+    print(f"Scale {count} ({face_count} faces):")
+
+    with quiet:
+        migrate(db_name)
+    timed_stage(results, "ingest", count, lambda: rescan_folder(folder, db_name, args.workers), quiet)
+    if "exif" in selected:
+        paths = [corpus_path(folder, i) for i in range(min(count, args.exif_sample))]
+        timed_stage(results, "exif", len(paths), lambda: [read_file_metadata(path) for path in paths], quiet)
+    if "dedupe" in selected:  # Synthetic photos are flat, so this times the hashing decode, not the grouping
+        timed_stage(results, "dedupe_hash", count, lambda: hash_new_media(db_name, args.workers), quiet)
+        timed_stage(results, "dedupe_group", count, lambda: group_duplicates(db_name), quiet)
+
+    encodings = synthetic_encodings(face_count, max(10, face_count // 20), seed=args.seed)
+    create_face_store(db_name)
+    timed_stage(results, "store_encodings", face_count, lambda: store_synthetic_faces(db_name, encodings, args.seed))
+    if "load_encodings" in selected:
+        load = lambda: load_encodings(db_name, with_face_ids=True)
+        encodings, _, face_ids = timed_stage(results, "load_encodings", face_count, load)
+    else:
+        encodings, _, face_ids = load_encodings(db_name, with_face_ids=True)
+    encodings = normalize_encodings(encodings)
+
+    labels = None
+    if "cluster_dbscan" in selected:
+        if face_count <= args.max_exact_faces:
+            labels = timed_stage(results, "cluster_dbscan", face_count, lambda: cluster_faces(encodings, 0.5, 2), quiet)
+        else:
+            results["cluster_dbscan"] = {"skipped": f"more than --max-exact-faces={args.max_exact_faces} faces"}
+    if "cluster_ivf" in selected:
+        labels = timed_stage(results, "cluster_ivf", face_count, lambda: cluster_faces(encodings, 0.5, 2, "ivf"), quiet)
+    if "cluster_hac" in selected:
+        hac_labels = timed_stage(results, "cluster_hac", face_count, lambda: hierarchical_clustering(encodings))
+        labels = labels if labels is not None else hac_labels
+    if "update_clusters" in selected and labels is not None:
+        update = lambda: update_cluster_ids(db_name, face_ids, labels)
+        timed_stage(results, "update_clusters", face_count, update, quiet)
+
+    if "queries" in selected:
+        conn = sqlite3.connect(db_name)
+        results["queries"] = time_queries(conn, args.query_repeat)
+        conn.close()
+        for name, timing in results["queries"].items():
+            print(f"  query {name:<16} p50 {timing['p50_ms']:8.3f} ms  p95 {timing['p95_ms']:8.3f} ms")
+
+    if "export" in selected:
+        for fmt in ("csv", "parquet", "xlsx"):
+            output = os.path.join(work_dir, f"bench_{count}.{fmt}")
+            try:
+                timed_stage(results, f"export_{fmt}", count, lambda: export_table(db_name, output), quiet)
+            except ImportError as e:  # pyarrow and openpyxl are optional
+                results[f"export_{fmt}"] = {"skipped": str(e)}
+
+    report = metrics.report()
+    results["detail"] = report["stages"]
+    results["peak_rss_bytes"] = report["peak_rss_bytes"]
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def compare(old, new, threshold=0.10):
+    """
+    Print the time ratio new/old of every stage (and query p50) both runs
+    measured, flagging those more than `threshold` slower; returns their number.
+    """
+    regressions = 0
+    print(f"Comparing {old['environment'].get('commit')} -> {new['environment'].get('commit')}:")
+    for scale, stages in new["scales"].items():
+        old_stages = old["scales"].get(scale, {})
+        pairs = [(stage, old_stages.get(stage), result, "seconds", "s") for stage, result in stages.items()]
+        pairs += [
+            (f"query {name}", old_stages.get("queries", {}).get(name), timing, "p50_ms", "ms")
+            for name, timing in stages.get("queries", {}).items()
+        ]
+        for stage, before, after, key, unit in pairs:
+            if not isinstance(after, dict) or key not in after or not before or key not in before:
+                continue
+            ratio = after[key] / max(before[key], 1e-9)
+            slower = ratio > 1 + threshold
+            regressions += slower
+            print(f"  {scale:>7} {stage:<24} {before[key]:9.3f}{unit} -> {after[key]:9.3f}{unit}  "
+                  f"x{ratio:.2f}{'  ⚠️ slower' if slower else ''}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the photo pipeline on synthetic corpora.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="Photos per run")
+    parser.add_argument("--stages", nargs="+", choices=OPTIONAL_STAGES, default=list(OPTIONAL_STAGES))
+    parser.add_argument("--corpus-dir", default="bench_corpus", help="Where synthetic corpora are kept between runs")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="RESULTS", help="Earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--image-size", type=int, nargs=2, default=[320, 240], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--faces-per-photo", type=float, default=1.5)
+    parser.add_argument("--exif-sample", type=int, default=10000, help="Photos parsed by the isolated EXIF stage")
+    parser.add_argument("--max-exact-faces", type=int, default=50000, help="Skip exact DBSCAN above this many faces")
+    parser.add_argument("--query-repeat", type=int, default=50)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipeline's per-file output")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "settings": vars(args), "scales": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in args.scales:
+            results["scales"][str(count)] = run_scale(count, args, work_dir)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(1 if compare(json.load(f), results) else 0)
@@ -0,0 +1,239 @@
+import os
+import shutil
+import sqlite3
+import threading
+import functools
+from PIL import Image
+from face_detection import face_crops
+from face_store import LIVE_MEDIA
+from ingest import ingest_paths
+from db_writer import DatabaseWriter
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# How each cluster folder entry is made from the original; "crops" writes one small JPEG per face instead
+LINK_MODES = ("hardlink", "symlink", "reflink", "copy")
+MODES = LINK_MODES + ("crops",)
+# Linux ioctl that makes a file share the extents of another (btrfs, XFS, ...): a copy-on-write copy
+FICLONE = 0x40049409
+MANIFEST_NAME = ".materialized.db"
+
+def reflink(source, target):
+    """Clone `source` into a new file `target` without copying its data; OSError where unsupported."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def _temp_path(target):
+    return f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def place_file(source, target, mode):
+    """
+    Make `target` a hardlink, symlink, reflink or copy of `source`, replacing
+    whatever is there. Where the link cannot be made (another filesystem, no
+    permission for symlinks, no reflink support) the file is copied instead.
+    Returns the mode actually used.
+    """
+    temp_path = _temp_path(target)
+    try:
+        try:
+            if mode == "hardlink":
+                os.link(source, temp_path)
+            elif mode == "symlink":
+                os.symlink(os.path.abspath(source), temp_path)
+            elif mode == "reflink":
+                reflink(source, temp_path)
+            else:
+                raise OSError("copy requested")
+            used = mode
+        except OSError:
+            shutil.copy2(source, temp_path)
+            used = "copy"
+        os.replace(temp_path, target)
+        return used
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+def _place_entry(task, output_folder, mode):
+    """Worker step for links: returns (mode used, None) or (None, error message)."""
+    name, source = task
+    target = os.path.join(output_folder, name)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return place_file(source, target, mode), None
+    except OSError as e:
+        return None, str(e)
+
+def _write_crops(task, output_folder, size, quality):
+    """
+    Worker step for crops: decode the photo once, at the resolution its
+    smallest face needs, and write a `size` JPEG of every face in `task`.
+    Returns (names written, None) or ([], error message).
+    """
+    file_path, faces = task
+    try:
+        names = []
+        with metrics.timed("crop_decode"):
+            crops = list(face_crops(file_path, [box for _, box in faces]))
+        for (name, _), (pixels, _) in zip(faces, crops):
+            crop = Image.fromarray(pixels)
+            crop.thumbnail((size, size))
+            target = os.path.join(output_folder, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = _temp_path(target)
+            crop.save(temp_path, "JPEG", quality=quality)
+            os.replace(temp_path, target)
+            names.append(name)
+        metrics.count("crops_written", len(names))
+        return names, None
+    except Exception as e:
+        return [], str(e)
+
+def cluster_entries(db_name, mode, crop_size=256, quality=85):
+    """
+    The wanted content of the cluster folders as {entry name: (source, signature)}.
+    A live photo (see face_store.LIVE_MEDIA) appears once in the folder of
+    each cluster its faces belong to (noise faces are left out); in "crops"
+    mode every face gets its own entry and the source also carries its box.
+    Signatures are (file path, size, mtime, mode, variant) and change whenever
+    the photo file or the mode does; for crops the variant holds the crop
+    size, quality and face box, so changing any of them renders again.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        if mode == "crops":
+            rows = conn.execute(f'''
+                SELECT f.cluster_id, f.id, m.file_path, m.file_size, m.file_mtime, f.top, f.right, f.bottom, f.left
+                FROM face_encodings f JOIN media_metadata m ON m.id = f.media_id
+                WHERE f.cluster_id >= 0 AND {LIVE_MEDIA}
+            ''').fetchall()
+            return {
+                os.path.join(f"cluster_{cluster_id}", f"face_{face_id}.jpg"): (
+                    (file_path, tuple(box)),
+                    (file_path, size, mtime, mode, f"{crop_size}px q{quality} box {','.join(map(str, box))}"),
+                )
+                for cluster_id, face_id, file_path, size, mtime, *box in rows
+            }
+        rows = conn.execute(f'''
+            SELECT DISTINCT f.cluster_id, m.id, m.filename, m.file_path, m.file_size, m.file_mtime
+            FROM face_encodings f JOIN media_metadata m ON m.id = f.media_id
+            WHERE f.cluster_id >= 0 AND {LIVE_MEDIA}
+        ''').fetchall()
+        # Prefixed with the media id, since photos from different folders may share a file name
+        return {
+            os.path.join(f"cluster_{cluster_id}", f"{media_id}_{filename}"): (
+                file_path, (file_path, size, mtime, mode, None)
+            )
+            for cluster_id, media_id, filename, file_path, size, mtime in rows
+        }
+    finally:
+        conn.close()
+
+def materialize_clusters(db_name, output_folder, mode="hardlink", crop_size=256, quality=85, workers=None):
+    """
+    Bring `output_folder` in line with the stored clusters, with one
+    cluster_<id> folder per cluster. Photos are hardlinked, symlinked,
+    reflinked or copied into it (falling back to a copy where a link is not
+    possible), or with mode "crops" every face is written as a `crop_size`
+    JPEG, rendered in parallel processes.
+
+    What was placed is recorded in a manifest inside the folder, so a rerun
+    only adds entries that are new or whose photo (or, for crops, face box,
+    size or quality) changed and removes those no longer wanted; files the
+    manifest does not know about are never touched.
+    Returns counts of the entries created, kept, removed and failed.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}; use one of {', '.join(MODES)}.")
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = sqlite3.connect(manifest_path)
+    manifest.execute('''
+        CREATE TABLE IF NOT EXISTS entries (
+            name TEXT PRIMARY KEY, source TEXT, file_size INTEGER, file_mtime REAL, mode TEXT, variant TEXT
+        )
+    ''')
+    # Manifests written before entries had a variant; their crops are rendered once more
+    if "variant" not in {row[1] for row in manifest.execute("PRAGMA table_info(entries)")}:
+        manifest.execute("ALTER TABLE entries ADD COLUMN variant TEXT")
+    placed = {
+        row[0]: tuple(row[1:])
+        for row in manifest.execute("SELECT name, source, file_size, file_mtime, mode, variant FROM entries")
+    }
+    manifest.commit()
+    manifest.close()
+
+    wanted = cluster_entries(db_name, mode, crop_size, quality)
+    stale = [name for name in placed if name not in wanted]
+    pending = {
+        name: entry for name, entry in wanted.items()
+        if placed.get(name) != entry[1] or not os.path.lexists(os.path.join(output_folder, name))
+    }
+    stats = {"created": 0, "kept": len(wanted) - len(pending), "removed": 0, "copied": 0, "failed": 0}
+    print(f"Cluster folders: {len(pending)} entries to create, {len(stale)} to remove, {stats['kept']} up to date.")
+
+    with DatabaseWriter(manifest_path) as writer:
+        with metrics.timed("materialize_remove"):
+            folders = set()
+            for name in stale:
+                try:
+                    os.remove(os.path.join(output_folder, name))
+                except FileNotFoundError:
+                    pass
+                writer.add("DELETE FROM entries WHERE name = ?", (name,))
+                folders.add(os.path.dirname(name))
+                stats["removed"] += 1
+            for folder in folders:
+                try:
+                    os.rmdir(os.path.join(output_folder, folder))
+                except OSError:  # Still has entries (or files of the user's)
+                    pass
+
+        def record(name):
+            writer.add(
+                "INSERT OR REPLACE INTO entries (name, source, file_size, file_mtime, mode, variant) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, *pending[name][1]),
+            )
+            stats["created"] += 1
+
+        if mode == "crops":
+            photos = {}
+            for name, ((file_path, box), _) in pending.items():
+                photos.setdefault(file_path, []).append((name, box))
+
+            def write_crops(task, result):
+                names, error = result
+                if error:
+                    print(f"❌ Error writing face crops of {task[0]}: {error}")
+                    stats["failed"] += len(task[1])
+                for name in names:
+                    record(name)
+
+            render = functools.partial(_write_crops, output_folder=output_folder, size=crop_size, quality=quality)
+            ingest_paths(list(photos.items()), render, write_crops, workers=workers, use_processes=True,
+                         stage="materialize")
+        else:
+            def write_entry(task, result):
+                used, error = result
+                if error:
+                    print(f"❌ Error placing {task[1]} in {os.path.dirname(task[0])}: {error}")
+                    stats["failed"] += 1
+                    return
+                stats["copied"] += used != mode
+                record(task[0])
+
+            place = functools.partial(_place_entry, output_folder=output_folder, mode=mode)
+            ingest_paths([(name, entry[0]) for name, entry in pending.items()], place, write_entry,
+                         workers=workers or min(32, 4 * (os.cpu_count() or 1)), stage="materialize")
+
+    if stats["copied"]:
+        print(f"⚠️ {stats['copied']} files were copied because a {mode} could not be made.")
+    print(f"✅ Cluster folders in {output_folder} are up to date: {stats}")
+    return stats
@@ -0,0 +1,101 @@
+import time
+import sqlite3
+from contextlib import contextmanager
+from metrics import metrics
+
+# Pragmas applied to every connection that writes to the media database
+WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-65536;",  # 64 MB page cache
+    "PRAGMA busy_timeout=5000;",
+)
+
+def connect_for_writing(db_name):
+    """Open a connection in autocommit mode with the write pragmas; callers manage transactions."""
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    for pragma in WRITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def write_transaction(db_name):
+    """Yield a write connection whose statements all commit in one transaction (or none on error)."""
+    conn = connect_for_writing(db_name)
+    try:
+        with metrics.timed("db_commit"):
+            conn.execute("BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+
+class DatabaseWriter:
+    """
+    Holds one connection and buffers parameterized statements, writing them with
+    executemany inside a single transaction once `batch_rows` rows are queued or
+    `batch_ms` milliseconds have passed since the last flush (checked on every add).
+    Remaining rows are flushed on close, including when leaving a `with` block
+    because of an error or Ctrl+C.
+    """
+
+    def __init__(self, db_name, batch_rows=1000, batch_ms=500):
+        self.conn = connect_for_writing(db_name)
+        self.batch_rows = batch_rows
+        self.batch_ms = batch_ms
+        self.pending = []  # [sql, rows] runs, in the order statements were added
+        self.pending_rows = 0
+        self.rows_added = 0
+        self.rows_changed = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, sql, params):
+        """Queue one statement execution."""
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].append(params)
+        else:
+            self.pending.append([sql, [params]])
+        self.pending_rows += 1
+        self.rows_added += 1
+        if self.pending_rows >= self.batch_rows or (time.monotonic() - self.last_flush) * 1000 >= self.batch_ms:
+            self.flush()
+
+    def add_many(self, sql, rows):
+        """Queue one execution of `sql` per parameter row."""
+        for params in rows:
+            self.add(sql, params)
+
+    def flush(self):
+        """Write every queued row in one transaction."""
+        pending, self.pending, self.pending_rows = self.pending, [], 0
+        self.last_flush = time.monotonic()
+        if not pending:
+            return
+        with metrics.timed("db_commit"):
+            self.conn.execute("BEGIN")
+            try:
+                for sql, rows in pending:
+                    self.rows_changed += self.conn.executemany(sql, rows).rowcount
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        metrics.count("db_rows", sum(len(rows) for _, rows in pending))
+
+    def close(self):
+        """Flush remaining rows and close the connection."""
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
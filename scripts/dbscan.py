@@ -0,0 +1,100 @@
+from collections import deque
+from itertools import chain
+import numpy as np
+
+# Point states
+UNVISITED = 0
+NOISE = 1
+CORE = 2
+BORDER = 3
+
+class RegionQueryCache:
+    """
+    Memoized eps-region queries against a neighbor index.
+    Misses are fetched in batches, but every point is queried at most once.
+    """
+
+    def __init__(self, index, eps, batch_size=1024):
+        self.index = index
+        self.eps = eps
+        self.batch_size = batch_size
+        self.regions = {}
+        self.query_count = 0
+
+    def get(self, point, upcoming=()):
+        """Return the region of `point`, prefetching regions of `upcoming` points on a miss."""
+        if point not in self.regions:
+            batch = {point: None}
+            for other in upcoming:
+                if len(batch) >= self.batch_size:
+                    break
+                if other not in self.regions:
+                    batch[other] = None
+                    if len(batch) >= self.batch_size:
+                        break  # Stop before consuming more of `upcoming`
+            batch = list(batch)
+            for other, region in zip(batch, self.index.range_query(batch, self.eps)):
+                self.regions[other] = region
+            self.query_count += len(batch)
+        return self.regions.pop(point)  # Each region is consumed exactly once
+
+def dbscan(index, eps, min_samples, region_cache=None, return_core=False):
+    """
+    Run DBSCAN over every encoding stored in `index`.
+    Returns a label array where -1 marks noise, plus a boolean core-point mask
+    with `return_core`.
+    """
+    n = len(index)
+    cache = region_cache or RegionQueryCache(index, eps)
+    states = np.full(n, UNVISITED, dtype=np.int8)
+    labels = np.full(n, -1, dtype=np.int64)
+    enqueued = np.zeros(n, dtype=bool)
+    cluster_id = 0
+    # Shared look-ahead over points the outer loop has yet to reach, used to fill query batches
+    ahead = (p for p in range(n) if states[p] == UNVISITED)
+
+    for point in range(n):
+        if states[point] != UNVISITED:
+            continue
+
+        region = cache.get(point, ahead)
+        if len(region) < min_samples:
+            states[point] = NOISE
+            continue
+
+        states[point] = CORE
+        labels[point] = cluster_id
+        enqueued[point] = True
+        queue = deque()
+        _enqueue(queue, region, states, enqueued)
+
+        while queue:
+            neighbor = queue.popleft()
+            if states[neighbor] == NOISE:  # Already queried, becomes a border point
+                states[neighbor] = BORDER
+                labels[neighbor] = cluster_id
+                continue
+            if states[neighbor] != UNVISITED:
+                continue
+
+            labels[neighbor] = cluster_id
+            # Fill the batch with queued points first, then with points the outer loop will reach
+            region = cache.get(neighbor, chain(
+                (q for q in queue if states[q] == UNVISITED),
+                ahead,
+            ))
+            if len(region) >= min_samples:
+                states[neighbor] = CORE
+                _enqueue(queue, region, states, enqueued)
+            else:
+                states[neighbor] = BORDER
+        cluster_id += 1
+
+    return (labels, states == CORE) if return_core else labels
+
+def _enqueue(queue, region, states, enqueued):
+    """Add unclaimed points of a region to the work queue, never twice."""
+    candidates = region[~enqueued[region]]
+    candidates = candidates[(states[candidates] == UNVISITED) | (states[candidates] == NOISE)]
+    enqueued[candidates] = True
+    queue.extend(candidates.tolist())
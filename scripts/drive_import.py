@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from http.client import HTTPException
+from datetime import datetime
+from urllib.parse import urlencode, quote
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from db_writer import connect_for_writing
+
+DRIVE_API = "https://www.googleapis.com/drive/v2"
+LIST_FIELDS = "nextPageToken,items(id,title,mimeType,md5Checksum,fileSize)"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class DriveClient:
+    """
+    Minimal Drive v2 REST client. `token` is a callable returning a current
+    OAuth access token (or None, e.g. against a local fake server), and
+    `base_url` points at the API root.
+    """
+
+    def __init__(self, token=None, base_url=DRIVE_API, timeout=60, attempts=4, backoff=1.0):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+
+    def _open(self, url, headers=None):
+        headers = dict(headers or {})
+        access_token = self.token() if self.token else None
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
+        return urlopen(Request(url, headers=headers), timeout=self.timeout)
+
+    def _retry(self, action):
+        """Run `action()`, retrying rate limits, server errors and dropped connections with backoff."""
+        for attempt in range(self.attempts):
+            try:
+                return action()
+            except HTTPError as e:
+                if e.code not in RETRY_STATUSES or attempt == self.attempts - 1:
+                    raise
+            except (URLError, HTTPException, ConnectionError, TimeoutError):
+                if attempt == self.attempts - 1:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def list_images(self, folder_id, page_size=1000):
+        """Yield the image files of a folder page by page, without holding the whole listing."""
+        params = {
+            "q": f"'{folder_id}' in parents and trashed=false and mimeType contains 'image/'",
+            "maxResults": page_size,
+            "fields": LIST_FIELDS,
+        }
+        while True:
+            url = f"{self.base_url}/files?{urlencode(params)}"
+            page = self._retry(lambda: json.load(self._open(url)))
+            yield from page.get("items", [])
+            if not page.get("nextPageToken"):
+                return
+            params["pageToken"] = page["nextPageToken"]
+
+    def download(self, item, path, chunk_size=1024 * 1024):
+        """
+        Download a file to `path` through `path + '.part'`. An existing partial
+        download is resumed with a Range request, and the result is checked
+        against the Drive md5 before it replaces `path`.
+        """
+        part_path = path + ".part"
+        url = f"{self.base_url}/files/{quote(item['id'])}?alt=media"
+
+        def attempt():
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                response = self._open(url, {"Range": f"bytes={offset}-"} if offset else None)
+            except HTTPError as e:
+                if e.code == 416 and offset:  # The partial file is already complete
+                    return
+                raise
+            mode = "ab" if offset and response.status == 206 else "wb"  # 200: the server ignored the range
+            length = response.headers.get("Content-Length")
+            with response, open(part_path, mode) as f:
+                start = f.tell()
+                for chunk in iter(lambda: response.read(chunk_size), b""):
+                    f.write(chunk)
+                # http.client ends a body cut short by the server without an error
+                if length is not None and f.tell() - start < int(length):
+                    raise ConnectionError(f"Download of {item['title']} interrupted")
+
+        self._retry(attempt)
+        expected = item.get("md5Checksum")
+        if expected and file_md5(part_path) != expected:
+            os.remove(part_path)
+            raise ValueError(f"md5 mismatch for {item['title']}")
+        os.replace(part_path, path)
+
+def file_md5(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def pydrive_token(gauth):
+    """Token callable for DriveClient backed by an authenticated pydrive GoogleAuth."""
+    def token():
+        if gauth.access_token_expired:
+            gauth.Refresh()
+        return gauth.credentials.access_token
+    return token
+
+def create_drive_manifest(db_name):
+    """Create the table recording which Drive file was downloaded to which local path."""
+    conn = sqlite3.connect(db_name)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS drive_files (
+            drive_id TEXT PRIMARY KEY,
+            title TEXT,
+            md5 TEXT,
+            size INTEGER,
+            local_path TEXT,
+            downloaded_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def is_present(item, file_path, known_md5=None):
+    """True if `file_path` already holds this Drive file, judged by size and md5."""
+    try:
+        if item.get("fileSize") is not None and os.path.getsize(file_path) != int(item["fileSize"]):
+            return False
+    except OSError:
+        return False
+    expected = item.get("md5Checksum")
+    return not expected or known_md5 == expected or file_md5(file_path) == expected
+
+def import_folder(client, folder_id, download_path, db_name, workers=8):
+    """
+    Stream the images of a Drive folder into `download_path`, yielding each
+    local path as soon as it is available, in completion order. Files already
+    present with the same size and md5 are yielded without downloading, and
+    local files with other contents are never overwritten. At
+    most 2 * `workers` downloads are queued or running at once.
+    """
+    os.makedirs(download_path, exist_ok=True)
+    create_drive_manifest(db_name)
+    conn = connect_for_writing(db_name)
+    manifest = {row[0]: row[1:] for row in conn.execute("SELECT drive_id, local_path, md5 FROM drive_files")}
+    used_paths = {row[0] for row in manifest.values()}
+    downloaded = skipped = failed = 0
+
+    def local_path(item):
+        """
+        (path, present) for an item: its recorded path, or else its title in
+        `download_path`. A name already taken by another item, or by a local
+        file with other contents, gets the item's id (and a counter) appended,
+        so no file is ever overwritten.
+        """
+        if item["id"] in manifest:
+            path, known_md5 = manifest[item["id"]]
+            return path, is_present(item, path, known_md5)
+        stem, ext = os.path.splitext(os.path.join(download_path, os.path.basename(item["title"])))
+        path = stem + ext
+        attempt = 0
+        while path in used_paths or os.path.exists(path):
+            if path not in used_paths and is_present(item, path):  # E.g. fetched by an earlier, unrecorded download
+                used_paths.add(path)
+                return path, True
+            attempt += 1
+            path = f"{stem}_{item['id'][:8]}{ext}" if attempt == 1 else f"{stem}_{item['id'][:8]}_{attempt}{ext}"
+        used_paths.add(path)
+        return path, False
+
+    def record(item, path):
+        conn.execute(
+            "INSERT OR REPLACE INTO drive_files VALUES (?, ?, ?, ?, ?, ?)",
+            (item["id"], item["title"], item.get("md5Checksum"), item.get("fileSize"), path,
+             datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        )
+
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            running = {}
+            items = client.list_images(folder_id)
+            listing = True
+            while listing or running:
+                while listing and len(running) < 2 * workers:
+                    item = next(items, None)
+                    if item is None:
+                        listing = False
+                        break
+                    path, present = local_path(item)
+                    if present:
+                        if item["id"] not in manifest:
+                            record(item, path)
+                        skipped += 1
+                        yield path
+                        continue
+                    running[pool.submit(client.download, item, path)] = (item, path)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, path = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"❌ Error downloading {item['title']}: {e}")
+                        continue
+                    record(item, path)
+                    downloaded += 1
+                    print(f"✅ Downloaded {item['title']}")
+                    yield path
+    finally:
+        conn.close()
+        print(f"Drive import: {downloaded} downloaded, {skipped} already present, {failed} failed.")
@@ -0,0 +1,110 @@
+import sqlite3
+from image_hash import image_hashes, hamming, to_signed, to_unsigned, MultiIndexHash
+from ingest import ingest_paths
+from db_writer import DatabaseWriter, write_transaction
+from metrics import metrics
+
+# dHash bits two copies of a photo may differ in; the multi-index lookup stays cheap below 8
+DEFAULT_MAX_DISTANCE = 7
+# pHash bits they may differ in as well, which weeds out dHash collisions of unrelated photos
+DEFAULT_MAX_PHASH_DISTANCE = 12
+
+def _hash_file(file_path):
+    """Worker step: (dHash, pHash), None for a featureless image, or the error message."""
+    try:
+        return image_hashes(file_path)
+    except Exception as e:
+        return str(e)
+
+def hash_new_media(db_name, workers=None, use_processes=False, should_stop=None):
+    """
+    Compute the perceptual hashes of photos that have none yet (new, or changed
+    since they were hashed). Featureless photos get no hashes and are made
+    their own group right away, so they are neither compared nor hashed again.
+    Returns the number of photos processed.
+    """
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute('''
+        SELECT id, file_path FROM media_metadata
+        WHERE deleted_at IS NULL AND dhash IS NULL AND duplicate_of IS NULL
+    ''').fetchall()
+    conn.close()
+    media_ids = {file_path: media_id for media_id, file_path in rows}
+    print(f"{len(media_ids)} images need perceptual hashes.")
+
+    def write(file_path, result):
+        if isinstance(result, str):
+            print(f"❌ Error hashing {file_path}: {result}")
+        elif result is None:
+            writer.add("UPDATE media_metadata SET duplicate_of = id WHERE id = ?", (media_ids[file_path],))
+        else:
+            writer.add(
+                "UPDATE media_metadata SET dhash = ?, phash = ? WHERE id = ?",
+                (to_signed(result[0]), to_signed(result[1]), media_ids[file_path]),
+            )
+
+    with DatabaseWriter(db_name) as writer:
+        return ingest_paths(
+            list(media_ids), _hash_file, write, workers=workers, use_processes=use_processes,
+            should_stop=should_stop, stage="hash",
+        )
+
+def group_duplicates(db_name, max_distance=DEFAULT_MAX_DISTANCE, max_phash_distance=DEFAULT_MAX_PHASH_DISTANCE,
+                     regroup=False):
+    """
+    Assign every hashed, ungrouped photo to a near-duplicate group.
+
+    Each group has one representative, whose duplicate_of is its own id; the
+    other members point at it. An ungrouped photo joins the group of the
+    nearest representative within `max_distance` dHash bits (and
+    `max_phash_distance` pHash bits), or else starts a group of its own.
+    Ungrouped photos are visited largest first (in pixels, then bytes), so the
+    best copy of a set of re-imports represents it. Groups whose representative
+    was deleted or changed are dissolved and their members placed again;
+    `regroup` dissolves every group first (e.g. after changing the distances).
+    Returns (number of new groups, number of new duplicates).
+    """
+    with write_transaction(db_name) as conn:
+        with metrics.timed("dedupe_group"):
+            if regroup:
+                conn.execute("UPDATE media_metadata SET duplicate_of = NULL WHERE dhash IS NOT NULL")
+            released = conn.execute('''
+                UPDATE media_metadata SET duplicate_of = NULL
+                WHERE duplicate_of IS NOT NULL AND duplicate_of != id AND duplicate_of NOT IN (
+                    SELECT id FROM media_metadata WHERE duplicate_of = id AND deleted_at IS NULL
+                )
+            ''').rowcount
+            if released:
+                print(f"⚠️ {released} photos lost their group's original and are grouped again.")
+
+            index = MultiIndexHash()
+            for media_id, dhash, phash in conn.execute('''
+                SELECT id, dhash, phash FROM media_metadata
+                WHERE duplicate_of = id AND dhash IS NOT NULL AND deleted_at IS NULL
+            '''):
+                index.add(to_unsigned(dhash), (media_id, to_unsigned(phash)))
+
+            assignments = []
+            groups = 0
+            for media_id, dhash, phash in conn.execute('''
+                SELECT id, dhash, phash FROM media_metadata
+                WHERE duplicate_of IS NULL AND dhash IS NOT NULL AND deleted_at IS NULL
+                ORDER BY COALESCE(image_width * image_height, 0) DESC, file_size DESC, id
+            ''').fetchall():
+                dhash, phash = to_unsigned(dhash), to_unsigned(phash)
+                original = next((
+                    other for _, (other, other_phash) in index.search(dhash, max_distance)
+                    if hamming(phash, other_phash) <= max_phash_distance
+                ), None)
+                if original is None:
+                    index.add(dhash, (media_id, phash))
+                    original = media_id
+                    groups += 1
+                assignments.append((original, media_id))
+            conn.executemany("UPDATE media_metadata SET duplicate_of = ? WHERE id = ?", assignments)
+
+    duplicates = len(assignments) - groups
+    metrics.count("duplicates", duplicates)
+    print(f"✅ Grouped {len(assignments)} photos: {duplicates} near-duplicates of {len(index)} originals "
+          f"({groups} new).")
+    return groups, duplicates
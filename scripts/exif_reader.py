@@ -0,0 +1,130 @@
+import struct
+from PIL import Image
+from PIL.ExifTags import TAGS
+
+# Give up looking for the EXIF segment and frame header after this many bytes
+MAX_HEADER_BYTES = 512 * 1024
+
+# The only IFD entries we store, named as in PIL.ExifTags.TAGS
+IFD0_TAGS = {0x010F: "Make", 0x0110: "Model"}
+EXIF_IFD_TAGS = {
+    0x9003: "DateTimeOriginal",
+    0x8827: "ISOSpeedRatings",
+    0x829D: "FNumber",
+    0x829A: "ExposureTime",
+}
+GPS_IFD_TAGS = {1, 2, 3, 4}  # GPSLatitudeRef, GPSLatitude, GPSLongitudeRef, GPSLongitude
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# TIFF field type -> (struct format of one value, size in bytes)
+FIELD_TYPES = {
+    1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("L", 4),
+    5: ("LL", 8), 7: ("B", 1), 9: ("l", 4), 10: ("ll", 8),
+}
+
+# Start-of-frame markers that carry the image dimensions
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def read_jpeg_segments(file_path):
+    """
+    Scan JPEG markers up to the frame header without decoding any pixels.
+    Returns (EXIF TIFF payload or None, (width, height)), or None if the file
+    is not a JPEG or the header could not be found.
+    """
+    with open(file_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        exif = None
+        while f.tell() < MAX_HEADER_BYTES:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            kind = marker[1]
+            if kind == 0xFF:  # Fill byte, the marker starts one byte later
+                f.seek(-1, 1)
+                continue
+            if kind == 0x01 or 0xD0 <= kind <= 0xD8:  # Markers without a length
+                continue
+            if kind in (0xD9, 0xDA):  # End of image or start of scan before any frame header
+                return None
+
+            length = struct.unpack(">H", f.read(2))[0]
+            if kind == 0xE1 and exif is None:
+                payload = f.read(length - 2)
+                if payload.startswith(b"Exif\x00\x00"):
+                    exif = payload[6:]
+            elif kind in SOF_MARKERS:
+                _, height, width = struct.unpack(">BHH", f.read(5))
+                return exif, (width, height)
+            else:
+                f.seek(length - 2, 1)
+    return None
+
+def _read_ifd(data, order, offset, wanted):
+    """Decode the `wanted` tags of the IFD at `offset`, skipping all others."""
+    values = {}
+    count = struct.unpack_from(order + "H", data, offset)[0]
+    for entry in range(offset + 2, offset + 2 + 12 * count, 12):
+        tag, field_type, value_count = struct.unpack_from(order + "HHL", data, entry)
+        if tag not in wanted or field_type not in FIELD_TYPES:
+            continue
+        fmt, size = FIELD_TYPES[field_type]
+        total = size * value_count
+        start = entry + 8 if total <= 4 else struct.unpack_from(order + "L", data, entry + 8)[0]
+        raw = data[start:start + total]
+        if len(raw) < total:
+            raise ValueError(f"EXIF tag {tag:#x} points past the end of the segment")
+        values[tag] = _decode(raw, order, field_type, fmt, value_count)
+    return values
+
+def _decode(raw, order, field_type, fmt, count):
+    """Decode a raw field the same way Pillow does for the types we read."""
+    if field_type == 2:
+        if raw.endswith(b"\x00"):
+            raw = raw[:-1]
+        return raw.decode("latin-1", "replace")
+    numbers = struct.unpack(order + fmt * count, raw)
+    if field_type in (5, 10):
+        numbers = [
+            numerator / denominator if denominator else float("nan")
+            for numerator, denominator in zip(numbers[::2], numbers[1::2])
+        ]
+    return numbers[0] if count == 1 else tuple(numbers)
+
+def parse_exif(data):
+    """Parse the stored fields out of a TIFF-structured EXIF payload, keyed like Pillow's TAGS."""
+    order = {b"II": "<", b"MM": ">"}[data[:2]]
+    ifd0_offset = struct.unpack_from(order + "L", data, 4)[0]
+    ifd0 = _read_ifd(data, order, ifd0_offset, set(IFD0_TAGS) | {EXIF_IFD_POINTER, GPS_IFD_POINTER})
+
+    metadata = {name: ifd0[tag] for tag, name in IFD0_TAGS.items() if tag in ifd0}
+    if EXIF_IFD_POINTER in ifd0:
+        exif_ifd = _read_ifd(data, order, ifd0[EXIF_IFD_POINTER], EXIF_IFD_TAGS)
+        metadata.update({name: exif_ifd[tag] for tag, name in EXIF_IFD_TAGS.items() if tag in exif_ifd})
+    if GPS_IFD_POINTER in ifd0:
+        metadata["GPSInfo"] = _read_ifd(data, order, ifd0[GPS_IFD_POINTER], GPS_IFD_TAGS)
+    return metadata
+
+def read_exif_header(file_path):
+    """
+    Read EXIF fields of a JPEG from its APP1 segment only.
+    Returns (metadata or None when there is no EXIF, (width, height)), or None
+    when the file must go through Pillow instead.
+    """
+    try:
+        header = read_jpeg_segments(file_path)
+        if header is None:
+            return None
+        exif, size = header
+        return (parse_exif(exif) if exif else None), size
+    except (struct.error, KeyError, ValueError):
+        return None
+
+def read_exif_pillow(file_path):
+    """Read EXIF fields by opening the image with Pillow. Returns (metadata or None, (width, height))."""
+    image = Image.open(file_path)
+    exif_data = image._getexif()
+    if exif_data is None:
+        return None, image.size
+    return {TAGS.get(tag): value for tag, value in exif_data.items() if tag in TAGS}, image.size
@@ -1,18 +1,187 @@
+import os
+import csv
 import sqlite3
-import pandas as pd
+import argparse
+from metrics import metrics
 
-db_name = "media_metadata.db"
-excel_file = "media_metadata.xlsx"
+# Rows fetched (and written) per step; memory use depends on this, not on the table size
+DEFAULT_CHUNK_ROWS = 10000
+# Rows per XLSX sheet, Excel's limit minus the header row; longer exports continue on a new sheet
+XLSX_SHEET_ROWS = 1048575
+# SQLite declared type -> Arrow type name, by SQLite's type affinity rules
+ARROW_TYPES = (("INT", "int64"), ("CHAR", "string"), ("CLOB", "string"), ("TEXT", "string"),
+               ("BLOB", "binary"), ("REAL", "float64"), ("FLOA", "float64"), ("DOUB", "float64"))
 
-# Connect to the database
-conn = sqlite3.connect(db_name)
+def export_format(file_path):
+    """Output format from the file extension: csv, parquet or xlsx."""
+    extension = os.path.splitext(file_path)[1].lower()
+    formats = {".csv": "csv", ".parquet": "parquet", ".xlsx": "xlsx"}
+    if extension not in formats:
+        raise ValueError(f"Unknown export format {extension!r}; use .csv, .parquet or .xlsx.")
+    return formats[extension]
 
-# Read the table into a pandas DataFrame
-df = pd.read_sql_query("SELECT * FROM media_metadata", conn)
+def table_columns(conn, table="media_metadata"):
+    """[(name, declared type)] of a table, in column order."""
+    return [(row[1], row[2]) for row in conn.execute(f"PRAGMA table_info({table});")]
 
-# Export to Excel
-df.to_excel(excel_file, index=False)
-print(f"Data exported to {excel_file}")
+def iter_chunks(cursor, chunk_rows):
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
 
-# Close the connection
-conn.close()
\ No newline at end of file
+def _write_csv(f, header, chunks):
+    writer = csv.writer(f)
+    writer.writerow(header)
+    for rows in chunks:
+        writer.writerows(rows)
+
+def arrow_type(declared):
+    for fragment, name in ARROW_TYPES:
+        if fragment in (declared or "").upper():
+            return name
+    return "string"
+
+def stored_type(declared, storage):
+    """
+    Arrow type name for a column from its declared type and the SQLite storage
+    classes its values actually use: SQLite lets any column hold any value, so
+    an INTEGER column holding REAL values becomes float64, and a numeric or
+    BLOB column holding other values is exported as strings.
+    """
+    kind = arrow_type(declared)
+    if kind == "binary":
+        return kind if storage <= {"blob", "null"} else "string"
+    if kind in ("int64", "float64"):
+        if not storage <= {"integer", "real", "null"}:
+            return "string"
+        if "real" in storage:
+            return "float64"
+    return kind
+
+def column_storage(conn, columns, where=None, params=()):
+    """{name: set of SQLite storage classes} of the selected rows, for every non-TEXT column, in one scan."""
+    typed = [name for name, declared in columns if arrow_type(declared) != "string"]
+    if not typed:
+        return {}
+    row = conn.execute(
+        "SELECT " + ", ".join(f'group_concat(DISTINCT typeof(m."{name}"))' for name in typed)
+        + " FROM media_metadata m" + (f" WHERE {where}" if where else ""),
+        tuple(params),
+    ).fetchone()
+    return {name: set((found or "").split(",")) - {""} for name, found in zip(typed, row)}
+
+def _write_parquet(f, columns, chunks, storage=None):
+    """
+    One row group per chunk. Column types follow the declared types, widened
+    to what the values hold (see stored_type) when `storage` is given; string
+    columns may hold numbers (e.g. iso), so their values are stringified.
+    """
+    import pyarrow as pa  # Only needed for Parquet exports
+    import pyarrow.parquet as pq
+
+    storage = storage or {}
+    types = [
+        stored_type(declared, storage[name]) if name in storage else arrow_type(declared)
+        for name, declared in columns
+    ]
+    schema = pa.schema([(name, getattr(pa, kind)()) for (name, _), kind in zip(columns, types)])
+    with pq.ParquetWriter(f, schema) as writer:
+        for rows in chunks:
+            arrays = []
+            for i, (field, kind) in enumerate(zip(schema, types)):
+                values = [row[i] for row in rows]
+                if kind == "string":
+                    values = [None if value is None else str(value) for value in values]
+                arrays.append(pa.array(values, field.type))
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+def _write_xlsx(f, header, chunks, sheet_name="media_metadata"):
+    """Write-only workbook: rows are streamed to the file instead of kept as cells."""
+    from openpyxl import Workbook  # Only needed for Excel exports
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(header)
+    sheet_rows = 0
+    for rows in chunks:
+        for row in rows:
+            if sheet_rows == XLSX_SHEET_ROWS:
+                sheet = workbook.create_sheet(f"{sheet_name}_{len(workbook.sheetnames) + 1}")
+                sheet.append(header)
+                sheet_rows = 0
+            # EXIF strings can carry control characters, which XLSX cannot store
+            sheet.append([ILLEGAL_CHARACTERS_RE.sub("", value) if isinstance(value, str) else value for value in row])
+            sheet_rows += 1
+    workbook.save(f)
+
+def export_table(db_name, output, columns=None, where=None, params=(), chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Stream media_metadata (aliased `m`) to `output` as CSV, Parquet or XLSX,
+    chosen by its extension. `columns` selects and orders the columns (all by
+    default) and `where` is an SQL condition with `params`, e.g.
+    "m.make = ? AND m.taken_at >= ?". Rows are read `chunk_rows` at a time and
+    written as they come, so memory stays flat however large the table is.
+    The file is written under a temporary name and renamed when complete.
+    Returns the number of rows written.
+    """
+    fmt = export_format(output)
+    conn = sqlite3.connect("file:" + os.path.abspath(db_name) + "?mode=ro", uri=True)
+    try:
+        declared = dict(table_columns(conn))
+        columns = list(columns or declared)
+        unknown = [name for name in columns if name not in declared]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}.")
+        selected = ", ".join(f'm."{name}"' for name in columns)
+        cursor = conn.execute(
+            f"SELECT {selected} FROM media_metadata m" + (f" WHERE {where}" if where else "") + " ORDER BY m.id",
+            tuple(params),
+        )
+
+        exported = 0
+
+        def counted(chunks):
+            nonlocal exported
+            for rows in chunks:
+                yield rows
+                exported += len(rows)
+
+        chunks = counted(iter_chunks(cursor, chunk_rows))
+        temp_path = f"{output}.{os.getpid()}.tmp"
+        try:
+            with metrics.timed("export"):
+                if fmt == "csv":
+                    with open(temp_path, "w", newline="", encoding="utf-8") as f:
+                        _write_csv(f, columns, chunks)
+                elif fmt == "parquet":
+                    typed_columns = [(name, declared[name]) for name in columns]
+                    storage = column_storage(conn, typed_columns, where, params)
+                    _write_parquet(temp_path, typed_columns, chunks, storage)
+                else:
+                    _write_xlsx(temp_path, columns, chunks)
+            os.replace(temp_path, output)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    finally:
+        conn.close()
+    metrics.count("export_rows", exported)
+    print(f"✅ Exported {exported} rows to {output}.")
+    return exported
+
+def export_to_excel(db_name, excel_file):
+    """Write the whole media_metadata table to an Excel file."""
+    return export_table(db_name, excel_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the media_metadata table to CSV, Parquet or XLSX.")
+    parser.add_argument("--db", default="media_metadata.db")
+    parser.add_argument("--output", default="media_metadata.xlsx", help="Output file; the extension picks the format")
+    parser.add_argument("--columns", nargs="+", help="Columns to export, in order (default: all)")
+    parser.add_argument("--where", help="SQL condition on the table aliased m, e.g. \"m.make = 'Apple'\"")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args()
+    export_table(args.db, args.output, args.columns, args.where, chunk_rows=args.chunk_rows)
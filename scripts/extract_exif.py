@@ -1,81 +1,37 @@
 import os
+import time
 import sqlite3
-import face_recognition
-from math import sqrt
+import numpy as np
 from datetime import datetime
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
-
-print("Script is running...")
+from PIL.ExifTags import GPSTAGS
+from face_distance import as_matrix, squared_norms
+from face_index import build_index
+from dbscan import dbscan
+from face_store import create_face_store, pending_images, load_encodings, update_face_labels
+from face_detection import detect_and_store
+from duplicates import hash_new_media, group_duplicates
+from ingest import ingest_folder, ingest_paths
+from exif_reader import read_exif_header, read_exif_pillow
+from db_writer import DatabaseWriter
+from metrics import metrics
+from known_paths import load_known_paths
+from schema import TYPED_COLUMNS, typed_values, migrate
+from drive_import import DriveClient, import_folder, pydrive_token
+from scan_journal import create_scan_journal, diff_tree, record_file, commit_directories
 
 # Global flag for stopping the process
 stop_requested = False
 
 def authenticate_google_drive():
     """Authenticate and return a GoogleDrive instance."""
+    from pydrive.auth import GoogleAuth  # Only needed for Drive imports
+    from pydrive.drive import GoogleDrive
+
     gauth = GoogleAuth()
     gauth.LocalWebserverAuth()  # Creates local webserver and auto handles authentication
     drive = GoogleDrive(gauth)
     return drive
 
-def download_files_from_drive(drive, folder_id, download_path):
-    """Download all files from a Google Drive folder."""
-    file_list = drive.ListFile({'q': f"'{folder_id}' in parents and trashed=false"}).GetList()
-    if not os.path.exists(download_path):
-        os.makedirs(download_path)
-
-    for file in file_list:
-        if file['mimeType'].startswith('image/'):  # Only process image files
-            print(f"Downloading {file['title']}...")
-            file.GetContentFile(os.path.join(download_path, file['title']))
-
-def create_database(db_name):
-    """Create the database and the media_metadata table if it doesn't exist."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS media_metadata (
-            id INTEGER PRIMARY KEY,
-            file_path TEXT UNIQUE,
-            filename TEXT,
-            date_taken TEXT,
-            date_added TEXT,
-            make TEXT,
-            model TEXT,
-            resolution TEXT,
-            iso TEXT,
-            f_stop TEXT,
-            shutter_speed TEXT,
-            GPSInfo TEXT,
-            cluster_id INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def add_missing_columns(db_name):
-    """Ensure the table has all required columns."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(media_metadata);")
-    columns = [col[1] for col in cursor.fetchall()]
-    if "filename" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN filename TEXT;")
-    if "iso" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN iso TEXT;")
-    if "f_stop" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN f_stop TEXT;")
-    if "shutter_speed" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN shutter_speed TEXT;")
-    if "GPSInfo" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN GPSInfo TEXT;")
-    if "cluster_id" not in columns:
-        cursor.execute("ALTER TABLE media_metadata ADD COLUMN cluster_id INTEGER;")
-    conn.commit()
-    conn.close()
-
 def extract_gps_info(gps_data):
     """Convert raw GPS data into latitude and longitude."""
     def convert_to_degrees(value):
@@ -106,18 +62,15 @@ def extract_gps_info(gps_data):
 def extract_image_metadata(image_path):
     """Extract metadata from an image file."""
     try:
-        image = Image.open(image_path)
-        exif_data = image._getexif()
-        if exif_data is not None:
-            metadata = {
-                TAGS.get(tag): value for tag, value in exif_data.items() if tag in TAGS
-            }
+        # JPEGs are read from their EXIF segment only; anything else goes through Pillow
+        metadata, size = read_exif_header(image_path) or read_exif_pillow(image_path)
+        if metadata is not None:
             gps_info = extract_gps_info(metadata.get("GPSInfo"))
             structured_metadata = {
                 "DateTimeOriginal": metadata.get("DateTimeOriginal"),
                 "Make": metadata.get("Make"),
                 "Model": metadata.get("Model"),
-                "Resolution": f"{image.size[0]}x{image.size[1]}",
+                "Resolution": f"{size[0]}x{size[1]}",
                 "ISO": metadata.get("ISOSpeedRatings"),
                 "FStop": float(metadata.get("FNumber", 0)) if metadata.get("FNumber") else None,
                 "ShutterSpeed": str(metadata.get("ExposureTime")) if metadata.get("ExposureTime") else None,
@@ -133,180 +86,262 @@ def extract_image_metadata(image_path):
         print(f"❌ Error extracting metadata from {image_path}: {e}")
         return {}
 
-def insert_metadata(db_name, file_path, metadata):
-    """Insert metadata into the database."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO media_metadata (
-                file_path, filename, date_taken, date_added, make, model, resolution, iso, f_stop, shutter_speed, GPSInfo
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            file_path,
-            os.path.basename(file_path),
-            metadata.get("DateTimeOriginal"),
-            metadata.get("DateAdded"),
-            metadata.get("Make"),
-            metadata.get("Model"),
-            metadata.get("Resolution"),
-            metadata.get("ISO"),
-            metadata.get("FStop"),
-            metadata.get("ShutterSpeed"),
-            metadata.get("GPSInfo")
-        ))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        print(f"⚠️ Duplicate entry skipped for {file_path}")
-    conn.close()
-
-def file_already_processed(db_name, file_path):
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM media_metadata WHERE file_path = ?', (file_path,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
-def extract_face_encodings(db_name):
-    """Extract facial encodings for all images in the database."""
+METADATA_COLUMNS = (
+    "file_path", "filename", "date_taken", "date_added", "make", "model", "resolution", "iso", "f_stop",
+    "shutter_speed", "GPSInfo", "file_size", "file_mtime",
+) + tuple(name for name, _ in TYPED_COLUMNS)
+
+INSERT_METADATA = f'''
+    INSERT OR IGNORE INTO media_metadata ({", ".join(METADATA_COLUMNS)})
+    VALUES ({", ".join("?" * len(METADATA_COLUMNS))})
+'''
+
+# Used when re-extracting a changed file: the row is updated in place so its id stays stable,
+# and it is hashed and grouped with its near-duplicates again
+UPSERT_METADATA = f'''
+    INSERT INTO media_metadata ({", ".join(METADATA_COLUMNS)})
+    VALUES ({", ".join("?" * len(METADATA_COLUMNS))})
+    ON CONFLICT(file_path) DO UPDATE SET
+        {", ".join(f"{name} = excluded.{name}" for name in METADATA_COLUMNS[1:])}, deleted_at = NULL,
+        dhash = NULL, phash = NULL, duplicate_of = NULL
+'''
+
+def read_file_metadata(file_path):
+    """Return (metadata, size, mtime) for a file; used as the parallel ingest step."""
+    stat = os.stat(file_path)
+    return extract_image_metadata(file_path), stat.st_size, stat.st_mtime
+
+def insert_metadata(writer, file_path, metadata, file_size=None, file_mtime=None, replace=False):
+    """
+    Queue metadata for insertion on a DatabaseWriter. Duplicate paths are ignored,
+    or with `replace` the existing row is updated in place (keeping its id).
+    """
+    writer.add(UPSERT_METADATA if replace else INSERT_METADATA, (
+        file_path,
+        os.path.basename(file_path),
+        metadata.get("DateTimeOriginal"),
+        metadata.get("DateAdded"),
+        metadata.get("Make"),
+        metadata.get("Model"),
+        metadata.get("Resolution"),
+        metadata.get("ISO"),
+        metadata.get("FStop"),
+        metadata.get("ShutterSpeed"),
+        metadata.get("GPSInfo"),
+        file_size,
+        file_mtime,
+        *typed_values(metadata)
+    ))
+
+def extract_face_encodings(db_name, workers=None, save_every=100, max_side=None):
+    """
+    Extract facial encodings for images that are new or changed since the last run,
+    then return every stored encoding with the id of its face.
+    """
+    detect_new_faces(db_name, workers, save_every, max_side)
+    encodings, _, face_ids = load_encodings(db_name, with_face_ids=True)
+    return encodings, face_ids
+
+def detect_new_faces(db_name, workers=None, save_every=100, max_side=None):
+    """
+    Run face detection on images that are new or changed since their last scan.
+    Detection runs in `workers` processes (one per CPU by default). With
+    `max_side`, images are decoded downscaled for detection (see face_detection).
+    """
+    create_face_store(db_name)
     conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
-    cursor.execute("SELECT id, file_path FROM media_metadata;")
+    # Near-duplicates (see duplicates.py) are left to their group's original
+    cursor.execute('''
+        SELECT id, file_path FROM media_metadata
+        WHERE deleted_at IS NULL AND (duplicate_of IS NULL OR duplicate_of = id);
+    ''')
     image_data = cursor.fetchall()  # List of (id, file_path)
     conn.close()
 
-    encodings = []
-    image_ids = []
-
-    for image_id, file_path in image_data:
-        if file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-            try:
-                print(f"Processing {file_path} for face encodings...")
-                image = face_recognition.load_image_file(file_path)
-                face_locations = face_recognition.face_locations(image)
-                face_encodings = face_recognition.face_encodings(image, face_locations)
-
-                if face_encodings:
-                    encodings.extend(face_encodings)
-                    image_ids.extend([image_id] * len(face_encodings))
-                else:
-                    print(f"⚠️ No faces detected in {file_path}.")
-            except Exception as e:
-                print(f"❌ Error processing {file_path}: {e}")
-
-    return encodings, image_ids
-
-def normalize_encoding(encoding):
-    """Normalize a single encoding vector."""
-    magnitude = sqrt(sum(x**2 for x in encoding))
-    if magnitude == 0:
-        return encoding  # Avoid division by zero
-    return [x / magnitude for x in encoding]
-
-def normalize_encodings(encodings):
-    """Normalize all encodings."""
-    return [normalize_encoding(encoding) for encoding in encodings]
+    image_data = [(i, p) for i, p in image_data if p.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    pending = pending_images(db_name, image_data)
+    print(f"{len(pending)} of {len(image_data)} images need face detection.")
 
-def euclidean_distance(vec1, vec2):
-    """Calculate the Euclidean distance between two vectors."""
-    return sqrt(sum((a - b) ** 2 for a, b in zip(vec1, vec2)))
+    detect_and_store(db_name, pending, "face_recognition", workers, save_every, max_side)
 
-def cluster_faces(encodings, eps=0.5, min_samples=2):
-    """Cluster facial encodings using a pure Python DBSCAN-like algorithm."""
-    if not encodings:
+def normalize_encodings(encodings):
+    """Normalize all encodings to unit length, returned as one float32 matrix."""
+    matrix = as_matrix(encodings)
+    magnitudes = np.sqrt(squared_norms(matrix))
+    magnitudes[magnitudes == 0] = 1.0  # Avoid division by zero
+    return matrix / magnitudes[:, None]
+
+def cluster_faces(encodings, eps=0.5, min_samples=2, index="exact"):
+    """
+    Cluster facial encodings using DBSCAN (-1 marks noise).
+    `index` is a backend name from face_index.INDEX_BACKENDS or a prebuilt index.
+    """
+    if len(encodings) == 0:
         print("⚠️ No encodings provided for clustering.")
         return []
 
-    labels = [-1] * len(encodings)  # Initialize all labels as -1 (unclustered)
-    cluster_id = 0
-
-    for i, encoding in enumerate(encodings):
-        if labels[i] != -1:  # Skip already clustered points
-            continue
-
-        # Find neighbors within `eps` distance
-        neighbors = []
-        for j, other_encoding in enumerate(encodings):
-            if euclidean_distance(encoding, other_encoding) <= eps:
-                neighbors.append(j)
-
-        if len(neighbors) < min_samples:
-            labels[i] = -1  # Mark as noise
-        else:
-            # Expand cluster
-            labels[i] = cluster_id
-            while neighbors:
-                neighbor = neighbors.pop()
-                if labels[neighbor] == -1:  # Previously marked as noise
-                    labels[neighbor] = cluster_id
-                elif labels[neighbor] == -1:  # Not yet visited
-                    labels[neighbor] = cluster_id
-                    # Add neighbors of this point
-                    for k, other_encoding in enumerate(encodings):
-                        if euclidean_distance(encodings[neighbor], other_encoding) <= eps:
-                            neighbors.append(k)
-            cluster_id += 1
+    matrix = as_matrix(encodings)
+    if isinstance(index, str):
+        with metrics.timed("cluster_index"):
+            index = build_index(matrix, index)
+    with metrics.timed("cluster"):
+        labels = dbscan(index, eps, min_samples)
+    cluster_id = int(labels.max()) + 1 if len(labels) else 0
 
     print(f"✅ Clustering complete. Found {cluster_id} clusters.")
-    return labels
+    return labels.tolist()
 
-def update_cluster_ids(db_name, image_ids, labels):
-    """Update the database with cluster IDs."""
+def update_cluster_ids(db_name, face_ids, labels):
+    """Update the database with the cluster ID of every face (and of their photos)."""
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        for image_id, cluster_id in zip(image_ids, labels):
-            cursor.execute("UPDATE media_metadata SET cluster_id = ? WHERE id = ?", (cluster_id, image_id))
-        conn.commit()
-        conn.close()
+        update_face_labels(db_name, face_ids, labels)
         print("✅ Database updated with cluster IDs.")
     except sqlite3.Error as e:
         print(f"❌ Database update error: {e}")
 
-def process_folder(folder_path, db_name, limit=100000):
-    global stop_requested
-    processed_count = 0
-
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if stop_requested:
-                print("⚠️ Process stopped by user.")
-                return
-
-            file_path = os.path.join(root, file)
-            print(f"Processing file: {file_path}")
-
-            if file_already_processed(db_name, file_path):
-                print(f"⚠️ Skipping {file_path}, already processed.")
-                continue
-
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif')):
-                metadata = extract_image_metadata(file_path)
-                insert_metadata(db_name, file_path, metadata)
-                processed_count += 1
+def process_folder(folder_path, db_name, limit=100000, workers=None, use_processes=False):
+    """
+    Extract and store metadata for every new image under `folder_path`.
+    EXIF parsing runs on `workers` threads (or processes) while this thread writes to the
+    database through one batched DatabaseWriter.
+    """
+    known_paths = load_known_paths(db_name)
+    print(f"{len(known_paths)} files already in the database.")
+
+    skipped_count = 0
+
+    def select_new(file_paths):
+        nonlocal skipped_count
+        known = known_paths.contains_many(file_paths)
+        skipped_count += int(known.sum())
+        return [path for path, is_known in zip(file_paths, known) if not is_known]
+
+    def write(file_path, result):
+        metadata, file_size, file_mtime = result
+        # Upserted, so that a file whose row was marked deleted is restored
+        insert_metadata(writer, file_path, metadata, file_size, file_mtime, replace=True)
+
+    with DatabaseWriter(db_name) as writer:
+        processed_count = ingest_folder(
+            folder_path, read_file_metadata, write, select=select_new, workers=workers,
+            use_processes=use_processes, limit=limit, should_stop=lambda: stop_requested, stage="exif",
+        )
+    if skipped_count:
+        print(f"⚠️ Skipped {skipped_count} files that were already processed.")
+    duplicates = writer.rows_added - writer.rows_changed
+    if duplicates:
+        print(f"⚠️ {duplicates} duplicate entries skipped.")
+    if stop_requested:
+        print("⚠️ Process stopped by user.")
+    elif processed_count >= limit:
+        print(f"✅ Limit of {limit} files reached. Stopping.")
+
+def rescan_folder(folder_path, db_name, workers=None, use_processes=False, verify_files=False):
+    """
+    Incrementally rescan `folder_path` against the scan journal: only new or
+    changed files are re-extracted and files that disappeared are marked deleted.
+    Prints a diff summary and the time spent per phase; returns (diff, timings).
+    """
+    create_scan_journal(db_name)
+    timings = {}
+
+    started = time.perf_counter()
+    diff = diff_tree(db_name, folder_path, verify_files)
+    timings["walk"] = time.perf_counter() - started
+
+    # Files ingested before the journal existed only need a journal entry
+    known_paths = load_known_paths(db_name)
+    adopted = []
+    signatures = {}
+    for signature in diff.added:
+        path, _, size, mtime, _ = signature
+        if known_paths.signature(path) == (size, mtime):
+            adopted.append(signature)
+        else:
+            signatures[path] = signature
+    for signature in diff.changed:
+        signatures[signature[0]] = signature
+
+    def write(file_path, result):
+        metadata, file_size, file_mtime = result
+        insert_metadata(writer, file_path, metadata, file_size, file_mtime, replace=True)
+        record_file(writer, signatures[file_path])
+
+    failed_directories = set()
+
+    def failed(file_path, error):
+        failed_directories.add(signatures[file_path][1])
+
+    with DatabaseWriter(db_name) as writer:
+        started = time.perf_counter()
+        for signature in adopted:
+            record_file(writer, signature)
+        ingest_paths(
+            list(signatures), read_file_metadata, write, workers=workers,
+            use_processes=use_processes, should_stop=lambda: stop_requested, stage="exif", on_error=failed,
+        )
+        timings["extract"] = time.perf_counter() - started
 
-                if processed_count >= limit:
-                    print(f"✅ Limit of {limit} files reached. Stopping.")
-                    return
+        started = time.perf_counter()
+        deleted_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        writer.add_many(
+            "UPDATE media_metadata SET deleted_at = ? WHERE file_path = ? AND deleted_at IS NULL",
+            ((deleted_at, path) for path in diff.removed),
+        )
+        if not stop_requested:  # Unfinished directories are listed again next time
+            # So are directories with a file that failed, or the unchanged mtime would hide it for good
+            commit_directories(writer, diff, failed_directories)
+    timings["commit"] = time.perf_counter() - started
+
+    print(f"✅ Rescan complete: {diff.summary()}.")
+    print("Time per phase: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+    return diff, timings
+
+def import_from_drive(client, folder_id, db_name, download_path, workers=None, download_workers=8):
+    """
+    Stream a Google Drive folder into the database: each image is handed to
+    metadata extraction as soon as its download completes, while the listing
+    and the remaining downloads continue. Images already ingested are skipped.
+    """
+    known_paths = load_known_paths(db_name)
+
+    def new_files():
+        for file_path in import_folder(client, folder_id, download_path, db_name, download_workers):
+            if file_path not in known_paths:
+                yield file_path
+
+    with DatabaseWriter(db_name) as writer:
+        def write(file_path, result):
+            metadata, file_size, file_mtime = result
+            insert_metadata(writer, file_path, metadata, file_size, file_mtime, replace=True)
+
+        ingest_paths(
+            new_files(), read_file_metadata, write, workers=workers, should_stop=lambda: stop_requested, stage="exif",
+        )
 
 def stop_process():
     global stop_requested
     stop_requested = True
 
 if __name__ == "__main__":
+    print("Script is running...")
     db_name = "media_metadata.db"
     download_path = "downloaded_images"
 
     # Ask the user for input type
-    input_type = input("Enter 'local' to process local files or 'drive' to process Google Drive files: ").strip().lower()
+    input_type = input("Enter 'local' to process local files, 'rescan' to incrementally rescan a local folder "
+                       "or 'drive' to process Google Drive files: ").strip().lower()
 
-    if input_type == "local":
+    if input_type == "rescan":
+        folder_path = input("Enter the path to the local folder: ").strip()
+        migrate(db_name)
+        print("Rescanning local files...")
+        rescan_folder(folder_path, db_name)
+    elif input_type == "local":
         # Process local files
         folder_path = input("Enter the path to the local folder: ").strip()
-        create_database(db_name)
-        add_missing_columns(db_name)
+        migrate(db_name)
         print("Processing local files...")
         process_folder(folder_path, db_name)
         print(f"✅ Metadata extraction complete. Data stored in {db_name}.")
@@ -314,21 +349,23 @@ if __name__ == "__main__":
         # Process Google Drive files
         folder_id = input("Enter the Google Drive folder ID: ").strip()
         drive = authenticate_google_drive()
-        print("Downloading files from Google Drive...")
-        download_files_from_drive(drive, folder_id, download_path)
-        create_database(db_name)
-        add_missing_columns(db_name)
-        print("Processing downloaded files...")
-        process_folder(download_path, db_name)
+        migrate(db_name)
+        print("Importing files from Google Drive...")
+        import_from_drive(DriveClient(pydrive_token(drive.auth)), folder_id, db_name, download_path)
         print(f"✅ Metadata extraction complete. Data stored in {db_name}.")
     else:
-        print("❌ Invalid input. Please enter 'local' or 'drive'.")
+        print("❌ Invalid input. Please enter 'local', 'rescan' or 'drive'.")
 
     try:
+        # Near-duplicates skip the face stage
+        print("Grouping near-duplicate photos...")
+        hash_new_media(db_name, should_stop=lambda: stop_requested)
+        group_duplicates(db_name)
+
         # Step 3: Extract facial encodings
         print("Extracting facial encodings...")
-        encodings, image_ids = extract_face_encodings(db_name)
-        if not encodings:
+        encodings, face_ids = extract_face_encodings(db_name)
+        if len(encodings) == 0:
             print("❌ No facial encodings found. Exiting.")
             exit()
 
@@ -345,7 +382,7 @@ if __name__ == "__main__":
 
         # Step 6: Update database with cluster IDs
         print("Updating database with cluster IDs...")
-        update_cluster_ids(db_name, image_ids, labels)
+        update_cluster_ids(db_name, face_ids, labels)
 
         print("✅ Face clustering and metadata extraction complete!")
     except KeyboardInterrupt:
@@ -353,3 +390,4 @@ if __name__ == "__main__":
         print("⚠️ Process interrupted by user.")
     except Exception as e:
         print(f"❌ An error occurred: {e}")
+    metrics.print_summary()
@@ -0,0 +1,248 @@
+import json
+import sqlite3
+import numpy as np
+from face_distance import as_matrix, squared_norms, iter_squared_distances, nearest_neighbors, radius_neighbors
+from face_index import BruteForceIndex, build_index
+from face_store import create_face_store, write_face_labels, stable_labels, ENCODING_DIM, LIVE_MEDIA
+from dbscan import dbscan
+from db_writer import write_transaction
+from metrics import metrics
+
+def create_cluster_store(db_name):
+    """
+    Create the per-cluster summaries used to place new faces without re-clustering:
+    the centroid and size of each cluster and the radius of its core points
+    around the centroid, plus the settings of the last full clustering.
+    """
+    create_face_store(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS face_clusters (
+            cluster_id INTEGER PRIMARY KEY,
+            centroid BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            radius REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS face_cluster_state (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+    conn.close()
+
+def _load_state(conn):
+    return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM face_cluster_state")}
+
+def _save_state(conn, **values):
+    conn.executemany(
+        "INSERT OR REPLACE INTO face_cluster_state VALUES (?, ?)",
+        ((key, json.dumps(value)) for key, value in values.items()),
+    )
+
+def _unit_rows(matrix):
+    """Scale rows to unit length, as extract_exif.normalize_encodings does before clustering."""
+    magnitudes = np.sqrt(squared_norms(matrix))
+    magnitudes[magnitudes == 0] = 1.0
+    return matrix / magnitudes[:, None]
+
+def _load_faces(conn, condition="1", params=()):
+    """(face ids, normalized encodings, cluster ids) of live faces matching `condition`, by face id."""
+    rows = conn.execute(f'''
+        SELECT f.id, f.encoding, f.cluster_id FROM face_encodings f
+        JOIN media_metadata m ON m.id = f.media_id
+        WHERE {LIVE_MEDIA} AND ({condition})
+        ORDER BY f.id
+    ''', params).fetchall()
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(-1, ENCODING_DIM)
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        _unit_rows(matrix),
+        np.array([-1 if row[2] is None else row[2] for row in rows], dtype=np.int64),
+    )
+
+def _load_summaries(conn):
+    rows = conn.execute("SELECT cluster_id, centroid, size, radius FROM face_clusters ORDER BY cluster_id").fetchall()
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(-1, ENCODING_DIM).copy(),
+        np.array([row[2] for row in rows], dtype=np.int64),
+        np.array([row[3] for row in rows], dtype=np.float64),
+    )
+
+def cluster_summaries(matrix, labels, core):
+    """
+    Return (cluster ids, centroids, sizes, radii) for every label >= 0, where
+    the radius is the largest distance from the centroid to a core point.
+    """
+    clustered = labels >= 0
+    cluster_ids, inverse, sizes = np.unique(labels[clustered], return_inverse=True, return_counts=True)
+    sums = np.zeros((len(cluster_ids), matrix.shape[1]), dtype=np.float64)
+    np.add.at(sums, inverse, matrix[clustered])
+    centroids = (sums / np.maximum(sizes, 1)[:, None]).astype(np.float32)
+
+    radii = np.zeros(len(cluster_ids), dtype=np.float64)
+    core_rows = core[clustered]
+    if core_rows.any():
+        offsets = matrix[clustered][core_rows] - centroids[inverse[core_rows]]
+        np.maximum.at(radii, inverse[core_rows], np.sqrt(squared_norms(offsets)))
+    return cluster_ids, centroids, sizes, radii
+
+def _write_summaries(conn, cluster_ids, centroids, sizes, radii):
+    conn.executemany("INSERT OR REPLACE INTO face_clusters VALUES (?, ?, ?, ?)", zip(
+        cluster_ids.tolist(), (c.astype(np.float32).tobytes() for c in centroids), sizes.tolist(), radii.tolist(),
+    ))
+
+def recluster(db_name, eps=0.5, min_samples=2, index="exact"):
+    """
+    Cluster every face from scratch with DBSCAN and rebuild the cluster
+    summaries. Cluster ids stay stable across runs (see stable_labels), so a
+    full pass merges or splits drifted clusters without renumbering the rest.
+    Returns the number of clusters.
+    """
+    create_cluster_store(db_name)
+    conn = sqlite3.connect(db_name)
+    face_ids, matrix, previous = _load_faces(conn)
+    conn.close()
+
+    with metrics.timed("cluster_index"):
+        face_index = build_index(matrix, index)
+    with metrics.timed("cluster"):
+        labels, core = dbscan(face_index, eps, min_samples, return_core=True)
+    labels = stable_labels(previous, labels)
+
+    with write_transaction(db_name) as conn:
+        conn.execute("DELETE FROM face_clusters")
+        write_face_labels(conn, face_ids, labels, core)
+        _write_summaries(conn, *cluster_summaries(matrix, labels, core))
+        _save_state(conn, eps=eps, min_samples=min_samples, index=index,
+                    faces_at_full=len(face_ids), faces=len(face_ids), assigned_since=0)
+    cluster_count = len(np.unique(labels[labels >= 0]))
+    print(f"✅ Full clustering complete. Found {cluster_count} clusters in {len(face_ids)} faces.")
+    return cluster_count
+
+def assign_new_faces(db_name, eps=0.5, min_samples=2):
+    """
+    Place faces that have no cluster yet without re-clustering the library.
+
+    A face joins the cluster of the nearest core point within `eps`, as
+    DBSCAN would make it a border point. Only clusters whose centroid lies
+    within radius + eps of the face can hold such a core point, so only their
+    core points are loaded. Faces that join no cluster are clustered with the
+    stored noise points near them; groups of `min_samples` become new
+    clusters and the rest is noise. Returns (assigned, new clusters, noise).
+    """
+    create_cluster_store(db_name)
+    conn = sqlite3.connect(db_name)
+    face_ids, matrix, _ = _load_faces(conn, "f.cluster_id IS NULL")
+    if len(face_ids) == 0:
+        conn.close()
+        return 0, 0, 0
+    cluster_ids, centroids, sizes, radii = _load_summaries(conn)
+    labels = np.full(len(face_ids), -1, dtype=np.int64)
+    core = np.zeros(len(face_ids), dtype=bool)
+
+    with metrics.timed("cluster_assign"):
+        if len(cluster_ids):
+            candidates = np.zeros(len(cluster_ids), dtype=bool)
+            for _, block in iter_squared_distances(matrix, centroids):
+                candidates |= (np.sqrt(block) <= radii[None, :] + eps).any(axis=0)
+            core_owners, core_matrix = [], []
+            candidate_ids = cluster_ids[candidates].tolist()
+            for start in range(0, len(candidate_ids), 500):
+                chunk = candidate_ids[start:start + 500]
+                _, chunk_matrix, chunk_owners = _load_faces(
+                    conn, f"f.is_core = 1 AND f.cluster_id IN ({', '.join('?' * len(chunk))})", chunk,
+                )
+                core_owners.append(chunk_owners)
+                core_matrix.append(chunk_matrix)
+            if core_owners:
+                core_owners = np.concatenate(core_owners)
+                nearest, distances = nearest_neighbors(matrix, np.vstack(core_matrix))
+                joined = (nearest >= 0) & (distances <= eps)
+                labels[joined] = core_owners[nearest[joined]]
+
+        # Unplaced faces may start new clusters together with the stored noise points near them
+        unplaced = np.flatnonzero(labels < 0)
+        near_noise = np.zeros(0, dtype=np.int64)
+        new_summaries = None
+        if len(unplaced):
+            noise_ids, noise_matrix, _ = _load_faces(conn, "f.cluster_id = -1")
+            if len(noise_ids):
+                near_noise = np.unique(np.concatenate(radius_neighbors(matrix[unplaced], noise_matrix, eps)))
+            pool = np.vstack([matrix[unplaced], noise_matrix[near_noise]])
+            pool_labels, pool_core = dbscan(BruteForceIndex(pool), eps, min_samples, return_core=True)
+            next_id = int(cluster_ids.max(initial=-1)) + 1
+            pool_labels = np.where(pool_labels >= 0, pool_labels + next_id, -1)
+            labels[unplaced] = pool_labels[:len(unplaced)]
+            core[unplaced] = pool_core[:len(unplaced)]
+            new_summaries = cluster_summaries(pool, pool_labels, pool_core)
+
+    conn.close()
+
+    joined_existing = labels >= 0
+    joined_existing[unplaced] = False
+    with write_transaction(db_name) as conn:
+        if len(near_noise):  # Noise points that became part of a new cluster
+            promoted = pool_labels[len(unplaced):] >= 0
+            write_face_labels(
+                conn,
+                np.concatenate([face_ids, noise_ids[near_noise][promoted]]),
+                np.concatenate([labels, pool_labels[len(unplaced):][promoted]]),
+                np.concatenate([core, pool_core[len(unplaced):][promoted]]),
+            )
+        else:
+            write_face_labels(conn, face_ids, labels, core)
+
+        # Fold the new border points into the centroids of the clusters they joined
+        if joined_existing.any():
+            rows = np.searchsorted(cluster_ids, labels[joined_existing])
+            sums = np.zeros_like(centroids, dtype=np.float64)
+            np.add.at(sums, rows, matrix[joined_existing])
+            added = np.bincount(rows, minlength=len(cluster_ids))
+            touched = np.flatnonzero(added)
+            new_sizes = sizes[touched] + added[touched]
+            moved = (centroids[touched] * sizes[touched, None] + sums[touched]) / new_sizes[:, None]
+            # The radius bound must still cover every core point after the centroid moves
+            radii[touched] += np.sqrt(squared_norms(as_matrix(moved - centroids[touched])))
+            _write_summaries(conn, cluster_ids[touched], moved, new_sizes, radii[touched])
+        if new_summaries is not None:
+            _write_summaries(conn, *new_summaries)
+
+        state = _load_state(conn)
+        _save_state(conn, faces=state.get("faces", 0) + len(face_ids),
+                    assigned_since=state.get("assigned_since", 0) + len(face_ids))
+
+    new_clusters = 0 if new_summaries is None else len(new_summaries[0])
+    noise = int((labels < 0).sum())
+    print(f"✅ Placed {len(face_ids)} new faces: {int(joined_existing.sum())} joined existing clusters, "
+          f"{new_clusters} new clusters, {noise} noise.")
+    return int(joined_existing.sum()), new_clusters, noise
+
+def cluster_incremental(db_name, eps=0.5, min_samples=2, index="exact", recluster_fraction=0.2):
+    """
+    Assign new faces to the existing clusters, or re-cluster everything when
+    there is no clustering yet, its settings changed, or the faces added and
+    removed since the last full pass exceed `recluster_fraction` of the faces
+    it saw. Returns "full" or "incremental".
+    """
+    create_cluster_store(db_name)
+    conn = sqlite3.connect(db_name)
+    state = _load_state(conn)
+    pending, labeled = conn.execute(f'''
+        SELECT COUNT(*) - COUNT(f.cluster_id), COUNT(f.cluster_id) FROM face_encodings f
+        JOIN media_metadata m ON m.id = f.media_id
+        WHERE {LIVE_MEDIA}
+    ''').fetchone()
+    conn.close()
+
+    settings = {"eps": eps, "min_samples": min_samples, "index": index}
+    removed = max(0, state.get("faces", 0) - labeled)
+    drift = state.get("assigned_since", 0) + pending + removed
+    if any(state.get(key) != value for key, value in settings.items()):
+        reason = "no clustering with these settings yet"
+    elif drift > recluster_fraction * max(state.get("faces_at_full", 0), 1):
+        reason = f"{drift} faces added or removed since the last full pass"
+    else:
+        assign_new_faces(db_name, eps, min_samples)
+        return "incremental"
+    print(f"Re-clustering all faces: {reason}.")
+    recluster(db_name, eps, min_samples, index)
+    return "full"
@@ -0,0 +1,228 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from PIL import Image
+from face_store import save_faces
+from metrics import Metrics, metrics
+
+DLIB_SHAPE_PREDICTOR = "shape_predictor_68_face_landmarks.dat"
+DLIB_RECOGNITION_MODEL = "dlib_face_recognition_resnet_model_v1.dat"
+
+# Faces are decoded with at least this many pixels on their shorter side before descriptors are computed
+DESCRIPTOR_MIN_FACE = 150
+# Context kept around each face when cropping, as a fraction of the face size
+CROP_MARGIN = 0.5
+
+# Detection function of the current process, set by load_backend()
+_detect = None
+# Sub-stage timings (decode, detect, describe) of the chunk being processed, see _detect_chunk()
+_chunk_metrics = Metrics()
+
+def load_downscaled(file_path, max_side):
+    """
+    Decode an RGB copy of an image whose longer side is at most `max_side`.
+    JPEGs are reduced during decoding (draft mode) by the smallest 1/2, 1/4 or 1/8
+    step that fits, so the full frame is never built and no resampling is needed;
+    the result's longer side lies between half of `max_side` and `max_side`.
+    Returns (pixels, (x scale, y scale) back to full resolution, full size).
+    """
+    image = Image.open(file_path)
+    full_size = image.size
+    if max(full_size) > max_side:
+        ratio = max_side / max(full_size) / 2
+        image.draft("RGB", (math.ceil(full_size[0] * ratio), math.ceil(full_size[1] * ratio)))
+        image = image.convert("RGB")
+        if max(image.size) > max_side:  # Formats without draft support, or past the 1/8 limit
+            image.thumbnail((max_side, max_side))
+    else:
+        image = image.convert("RGB")
+    scale = (full_size[0] / image.size[0], full_size[1] / image.size[1])
+    return np.asarray(image), scale, full_size
+
+def scale_boxes(boxes, scale, size):
+    """Map (top, right, bottom, left) boxes from a downscaled image back to full resolution."""
+    x_scale, y_scale = scale
+    width, height = size
+    return [
+        (max(0, int(top * y_scale)), min(width, round(right * x_scale)),
+         min(height, round(bottom * y_scale)), max(0, int(left * x_scale)))
+        for top, right, bottom, left in boxes
+    ]
+
+def face_crops(file_path, boxes):
+    """
+    Yield (pixels, box within the crop) for every full-resolution face box.
+    The image is only decoded at the resolution the smallest face needs.
+    """
+    if not boxes:
+        return
+    image = Image.open(file_path)
+    full_width, full_height = image.size
+    smallest = min(min(bottom - top, right - left) for top, right, bottom, left in boxes)
+    ratio = min(1.0, DESCRIPTOR_MIN_FACE / max(smallest, 1))
+    image.draft("RGB", (math.ceil(full_width * ratio), math.ceil(full_height * ratio)))
+    image = image.convert("RGB")
+    x_scale, y_scale = image.size[0] / full_width, image.size[1] / full_height
+
+    for top, right, bottom, left in boxes:
+        x_margin, y_margin = (right - left) * CROP_MARGIN, (bottom - top) * CROP_MARGIN
+        region = (
+            max(0, int((left - x_margin) * x_scale)), max(0, int((top - y_margin) * y_scale)),
+            min(image.size[0], math.ceil((right + x_margin) * x_scale)),
+            min(image.size[1], math.ceil((bottom + y_margin) * y_scale)),
+        )
+        box = (
+            int(top * y_scale) - region[1], round(right * x_scale) - region[0],
+            round(bottom * y_scale) - region[1], int(left * x_scale) - region[0],
+        )
+        yield np.asarray(image.crop(region)), box
+
+def _load_face_recognition(max_side=None):
+    """Detector built on the face_recognition package (HOG + ResNet descriptor)."""
+    import face_recognition
+
+    def detect(file_path):
+        with _chunk_metrics.timed("face_decode"):
+            image = face_recognition.load_image_file(file_path)
+        with _chunk_metrics.timed("face_detect"):
+            boxes = face_recognition.face_locations(image)
+        with _chunk_metrics.timed("face_describe"):
+            return boxes, face_recognition.face_encodings(image, boxes)
+
+    def detect_downscaled(file_path):
+        with _chunk_metrics.timed("face_decode"):
+            image, scale, size = load_downscaled(file_path, max_side)
+        with _chunk_metrics.timed("face_detect"):
+            boxes = scale_boxes(face_recognition.face_locations(image), scale, size)
+        with _chunk_metrics.timed("face_describe"):
+            encodings = [
+                face_recognition.face_encodings(crop, [box])[0]
+                for crop, box in face_crops(file_path, boxes)
+            ]
+        return boxes, encodings
+    return detect_downscaled if max_side else detect
+
+def _load_dlib(max_side=None):
+    """Detector built directly on dlib's frontal face detector and ResNet model."""
+    import dlib
+    face_detector = dlib.get_frontal_face_detector()
+    shape_predictor = dlib.shape_predictor(DLIB_SHAPE_PREDICTOR)
+    face_recognition_model = dlib.face_recognition_model_v1(DLIB_RECOGNITION_MODEL)
+
+    def detect(file_path):
+        with _chunk_metrics.timed("face_decode"):
+            image = dlib.load_rgb_image(file_path)
+        with _chunk_metrics.timed("face_detect"):
+            faces = face_detector(image, 1)
+        boxes = []
+        encodings = []
+        with _chunk_metrics.timed("face_describe"):
+            for face in faces:
+                shape = shape_predictor(image, face)
+                boxes.append((face.top(), face.right(), face.bottom(), face.left()))
+                encodings.append(face_recognition_model.compute_face_descriptor(image, shape))
+        return boxes, encodings
+
+    def detect_downscaled(file_path):
+        with _chunk_metrics.timed("face_decode"):
+            image, scale, size = load_downscaled(file_path, max_side)
+        with _chunk_metrics.timed("face_detect"):
+            faces = face_detector(image, 1)
+        boxes = scale_boxes([(f.top(), f.right(), f.bottom(), f.left()) for f in faces], scale, size)
+        encodings = []
+        with _chunk_metrics.timed("face_describe"):
+            for crop, (top, right, bottom, left) in face_crops(file_path, boxes):
+                shape = shape_predictor(crop, dlib.rectangle(left, top, right, bottom))
+                encodings.append(face_recognition_model.compute_face_descriptor(crop, shape))
+        return boxes, encodings
+    return detect_downscaled if max_side else detect
+
+BACKENDS = {
+    "face_recognition": _load_face_recognition,
+    "dlib": _load_dlib,
+}
+
+def load_backend(backend, max_side=None):
+    """
+    Load the models of a backend once for the current process.
+    With `max_side`, faces are detected on a downscaled decode and descriptors
+    are computed on crops around each face.
+    """
+    global _detect
+    _detect = BACKENDS[backend](max_side)
+
+def _detect_chunk(tasks):
+    """
+    Run detection for a chunk of (image_id, file_path, signature) tasks.
+    Returns the results and the chunk's timing samples for Metrics.merge().
+    """
+    _chunk_metrics.reset()
+    results = []
+    for image_id, file_path, signature in tasks:
+        try:
+            with _chunk_metrics.timed("face_detection"):
+                boxes, encodings = _detect(file_path)
+            encodings = [np.asarray(encoding, dtype=np.float32) for encoding in encodings]
+            results.append((image_id, file_path, signature, boxes, encodings, None))
+        except Exception as e:
+            results.append((image_id, file_path, signature, [], [], str(e)))
+    return results, _chunk_metrics.samples()
+
+def detect_faces(pending, backend="face_recognition", workers=None, chunk_size=4, max_in_flight=None,
+                 max_side=None):
+    """
+    Detect faces for (image_id, file_path, signature) tasks and yield
+    (image_id, file_path, signature, boxes, encodings, error) as results arrive.
+    With more than one worker, tasks are dispatched to a process pool in chunks
+    and at most `max_in_flight` images are queued or being decoded at once.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = (pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size))
+
+    def collect(chunk_result):
+        results, samples = chunk_result
+        metrics.merge(samples)
+        return results
+
+    if workers == 1:
+        load_backend(backend, max_side)
+        for chunk in chunks:
+            yield from collect(_detect_chunk(chunk))
+        return
+
+    max_chunks = max(1, (max_in_flight or 2 * workers * chunk_size) // chunk_size)
+    with ProcessPoolExecutor(workers, initializer=load_backend, initargs=(backend, max_side)) as pool:
+        running = set()
+        for chunk in chunks:
+            if len(running) >= max_chunks:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from collect(future.result())
+            running.add(pool.submit(_detect_chunk, chunk))
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from collect(future.result())
+
+def detect_and_store(db_name, pending, backend="face_recognition", workers=None, save_every=100, max_side=None):
+    """Detect faces for pending images and write the results to the face store in batches."""
+    results = []
+    detections = detect_faces(pending, backend, workers, max_side=max_side)
+    for image_id, file_path, signature, boxes, encodings, error in detections:
+        if error:
+            metrics.count("face_errors")
+            print(f"❌ Error processing {file_path}: {error}")
+            continue
+        metrics.count("face_images")
+        metrics.count("faces", len(encodings))
+        if encodings:
+            print(f"✅ {len(encodings)} face(s) found in {file_path}.")
+        else:
+            print(f"⚠️ No faces detected in {file_path}.")
+
+        results.append((image_id, signature, boxes, encodings))
+        if len(results) >= save_every:
+            save_faces(db_name, results)
+            results = []
+    save_faces(db_name, results)
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Upper bound on the size of one distance block (rows x n float32 values).
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+def as_matrix(encodings):
+    """Stack encodings into one contiguous float32 matrix (one row per face)."""
+    matrix = np.asarray(encodings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1) if matrix.size else matrix.reshape(0, 0)
+    return np.ascontiguousarray(matrix)
+
+def squared_norms(matrix):
+    """Return the squared L2 norm of every row."""
+    return np.einsum("ij,ij->i", matrix, matrix)
+
+def rows_per_block(n_columns, block_bytes=DEFAULT_BLOCK_BYTES):
+    """How many query rows fit in one block against `n_columns` data rows."""
+    return max(1, block_bytes // (4 * max(n_columns, 1)))
+
+def iter_squared_distances(queries, data, data_norms=None, block_bytes=DEFAULT_BLOCK_BYTES):
+    """
+    Yield (start, block) pairs where block[i, j] is the squared distance between
+    queries[start + i] and data[j], computed as |a|^2 + |b|^2 - 2ab.
+    Each block holds at most `block_bytes` worth of float32 values.
+    """
+    queries = as_matrix(queries)
+    data = as_matrix(data)
+    if data_norms is None:
+        data_norms = squared_norms(data)
+    step = rows_per_block(len(data), block_bytes)
+
+    for start in range(0, len(queries), step):
+        block_queries = queries[start:start + step]
+        block = block_queries @ data.T
+        block *= -2.0
+        block += squared_norms(block_queries)[:, None]
+        block += data_norms[None, :]
+        np.maximum(block, 0.0, out=block)  # Rounding can push exact matches below zero
+        yield start, block
+
+def pairwise_distances(queries, data):
+    """Return the full Euclidean distance matrix (only for small inputs)."""
+    blocks = [block for _, block in iter_squared_distances(queries, data)]
+    if not blocks:
+        return np.empty((0, len(as_matrix(data))), dtype=np.float32)
+    return np.sqrt(np.vstack(blocks))
+
+def radius_neighbors(queries, data, eps, block_bytes=DEFAULT_BLOCK_BYTES):
+    """Return, for every query row, the sorted indices of data rows within `eps`."""
+    eps_squared = np.float32(eps) ** 2
+    neighbors = []
+    for _, block in iter_squared_distances(queries, data, block_bytes=block_bytes):
+        rows, columns = np.nonzero(block <= eps_squared)
+        splits = np.searchsorted(rows, np.arange(1, len(block)))
+        neighbors.extend(np.split(columns, splits))
+    return neighbors
+
+def nearest_neighbors(queries, data, block_bytes=DEFAULT_BLOCK_BYTES):
+    """Return (indices, distances) of the closest data row for every query row."""
+    queries = as_matrix(queries)
+    indices = np.full(len(queries), -1, dtype=np.int64)
+    distances = np.full(len(queries), np.inf, dtype=np.float32)
+    if len(as_matrix(data)) == 0:
+        return indices, distances
+    for start, block in iter_squared_distances(queries, data, block_bytes=block_bytes):
+        best = np.argmin(block, axis=1)
+        indices[start:start + len(block)] = best
+        distances[start:start + len(block)] = np.sqrt(block[np.arange(len(block)), best])
+    return indices, distances
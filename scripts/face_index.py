@@ -0,0 +1,131 @@
+import numpy as np
+from face_distance import (
+    DEFAULT_BLOCK_BYTES, as_matrix, squared_norms, iter_squared_distances,
+    radius_neighbors, nearest_neighbors,
+)
+
+def _group_hits(query_ids, data_ids, n_queries):
+    """Turn flat (query, data) hit pairs into one sorted index array per query."""
+    if not query_ids:
+        return [np.empty(0, dtype=np.int64) for _ in range(n_queries)]
+    query_ids = np.concatenate(query_ids)
+    data_ids = np.concatenate(data_ids)
+    order = np.lexsort((data_ids, query_ids))
+    query_ids, data_ids = query_ids[order], data_ids[order]
+    splits = np.searchsorted(query_ids, np.arange(1, n_queries))
+    return np.split(data_ids, splits)
+
+class BruteForceIndex:
+    """Exact index: every query is compared against every stored encoding."""
+
+    def __init__(self, encodings, block_bytes=DEFAULT_BLOCK_BYTES):
+        self.matrix = as_matrix(encodings)
+        self.block_bytes = block_bytes
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def query_radius(self, queries, eps):
+        """Return the indices of stored encodings within `eps` of every query."""
+        if len(self.matrix) == 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(queries))]
+        return radius_neighbors(queries, self.matrix, eps, block_bytes=self.block_bytes)
+
+    def range_query(self, ids, eps):
+        """Region query for stored encodings, addressed by their row index."""
+        return self.query_radius(self.matrix[np.asarray(ids, dtype=np.int64)], eps)
+
+class IVFIndex(BruteForceIndex):
+    """
+    Approximate inverted-file index. Encodings are partitioned by k-means and a
+    query only scans the `n_probe` partitions whose centroids are closest to it.
+    """
+
+    def __init__(self, encodings, n_lists=None, n_probe=8, train_size=100000,
+                 iterations=10, seed=0, block_bytes=DEFAULT_BLOCK_BYTES):
+        super().__init__(encodings, block_bytes)
+        n = len(self.matrix)
+        self.n_lists = max(1, min(n, n_lists or int(np.sqrt(n))))
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self.centroids = self._train(train_size, iterations, np.random.default_rng(seed))
+
+        assignments, _ = nearest_neighbors(self.matrix, self.centroids, block_bytes)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(self.n_lists + 1))
+        self.grouped = np.ascontiguousarray(self.matrix[self.order])
+        self.grouped_norms = squared_norms(self.grouped)
+
+    def _train(self, train_size, iterations, rng):
+        """Run Lloyd's k-means on a sample of the encodings."""
+        if len(self.matrix) == 0:
+            return self.matrix.copy()
+        sample_size = min(len(self.matrix), max(train_size, self.n_lists))
+        sample = self.matrix[rng.choice(len(self.matrix), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments, _ = nearest_neighbors(sample, centroids, self.block_bytes)
+            counts = np.bincount(assignments, minlength=self.n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = counts == 0
+            # Re-seed empty partitions with random sample points
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            counts[empty] = 1
+            centroids = sums / counts[:, None]
+        return np.ascontiguousarray(centroids, dtype=np.float32)
+
+    def _probes(self, queries):
+        """Return the `n_probe` closest partitions for every query."""
+        probes = np.empty((len(queries), self.n_probe), dtype=np.int64)
+        for start, block in iter_squared_distances(queries, self.centroids, block_bytes=self.block_bytes):
+            if self.n_probe < self.n_lists:
+                block = np.argpartition(block, self.n_probe - 1, axis=1)[:, :self.n_probe]
+            else:
+                block = np.broadcast_to(np.arange(self.n_lists), block.shape)
+            probes[start:start + len(block)] = block
+        return probes
+
+    def query_radius(self, queries, eps):
+        queries = as_matrix(queries)
+        if len(self.matrix) == 0 or len(queries) == 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(queries))]
+
+        # Visit partitions one at a time with every query that probes them
+        probes = self._probes(queries).ravel()
+        query_of_probe = np.repeat(np.arange(len(queries)), self.n_probe)
+        by_list = np.argsort(probes, kind="stable")
+        list_bounds = np.searchsorted(probes[by_list], np.arange(self.n_lists + 1))
+        eps_squared = np.float32(eps) ** 2
+
+        hit_queries, hit_data = [], []
+        for list_id in np.unique(probes):
+            begin, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if begin == end:
+                continue
+            probing = query_of_probe[by_list[list_bounds[list_id]:list_bounds[list_id + 1]]]
+            members = self.grouped[begin:end]
+            member_norms = self.grouped_norms[begin:end]
+            for start, block in iter_squared_distances(queries[probing], members, member_norms, self.block_bytes):
+                rows, columns = np.nonzero(block <= eps_squared)
+                hit_queries.append(probing[start + rows])
+                hit_data.append(self.order[begin + columns])
+        return _group_hits(hit_queries, hit_data, len(queries))
+
+# Available neighbor index backends, selectable by name.
+INDEX_BACKENDS = {
+    "exact": BruteForceIndex,
+    "ivf": IVFIndex,
+}
+
+def build_index(encodings, backend="exact", **options):
+    """Build a neighbor index over encodings using the named backend."""
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend '{backend}'. Choose from: {', '.join(INDEX_BACKENDS)}")
+    return INDEX_BACKENDS[backend](encodings, **options)
+
+def recall(approximate, exact):
+    """Fraction of exact neighbors that the approximate results also found."""
+    found = sum(len(np.intersect1d(a, e, assume_unique=True)) for a, e in zip(approximate, exact))
+    total = sum(len(e) for e in exact)
+    return found / total if total else 1.0
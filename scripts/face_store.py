@@ -0,0 +1,243 @@
+import os
+import sqlite3
+import hashlib
+from collections import Counter
+from datetime import datetime
+import numpy as np
+from metrics import metrics
+from db_writer import write_transaction
+
+ENCODING_DIM = 128
+# Photos whose faces are clustered: not deleted, and not a near-duplicate of another photo
+LIVE_MEDIA = "m.deleted_at IS NULL AND (m.duplicate_of IS NULL OR m.duplicate_of = m.id)"
+
+def create_face_tables(cursor):
+    """
+    Create the tables that cache face detection results per media file.
+    face_encodings holds one row per face with its box, encoding and cluster
+    label, indexed both by media (faces of a photo) and by cluster (photos of
+    a person, covering media_id so that lookup never reads the encodings).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_scans (
+            media_id INTEGER PRIMARY KEY,
+            file_mtime REAL,
+            file_size INTEGER,
+            content_hash TEXT,
+            face_count INTEGER,
+            scanned_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_encodings (
+            id INTEGER PRIMARY KEY,
+            media_id INTEGER NOT NULL,
+            top INTEGER,
+            right INTEGER,
+            bottom INTEGER,
+            left INTEGER,
+            encoding BLOB NOT NULL,
+            cluster_id INTEGER,
+            is_core INTEGER
+        )
+    ''')
+    # Stores created before faces carried their own cluster label
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(face_encodings);")}
+    for column in ("cluster_id", "is_core"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE face_encodings ADD COLUMN {column} INTEGER;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_face_encodings_media ON face_encodings(media_id);")
+    cursor.execute("DROP INDEX IF EXISTS idx_face_encodings_cluster;")  # Superseded by the covering index below
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_face_encodings_cluster_media ON face_encodings(cluster_id, is_core, media_id);"
+    )
+
+def create_face_store(db_name):
+    conn = sqlite3.connect(db_name)
+    create_face_tables(conn.cursor())
+    conn.commit()
+    conn.close()
+
+def content_hash(file_path, chunk_size=1024 * 1024):
+    """Return the BLAKE2b digest of a file's contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_signature(file_path, with_hash=True):
+    """Return (mtime, size, content hash) for a file."""
+    stat = os.stat(file_path)
+    return stat.st_mtime, stat.st_size, content_hash(file_path) if with_hash else None
+
+def pending_images(db_name, image_data):
+    """
+    Return (id, file_path, signature) for images that are new or changed since
+    their last face scan. A file whose mtime/size changed but whose content
+    hash did not is marked as scanned again without re-detection.
+    """
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute("SELECT media_id, file_mtime, file_size, content_hash FROM face_scans;")
+    scans = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    pending = []
+    touched = []
+    for image_id, file_path in image_data:
+        try:
+            mtime, size, _ = file_signature(file_path, with_hash=False)
+            known = scans.get(image_id)
+            if known and known[0] == mtime and known[1] == size:
+                continue
+            signature = (mtime, size, content_hash(file_path))
+            if known and known[2] == signature[2]:
+                touched.append((mtime, size, image_id))
+                continue
+            pending.append((image_id, file_path, signature))
+        except OSError as e:
+            print(f"❌ Error reading {file_path}: {e}")
+
+    cursor.executemany("UPDATE face_scans SET file_mtime = ?, file_size = ? WHERE media_id = ?", touched)
+    conn.commit()
+    conn.close()
+    return pending
+
+def save_faces(db_name, results):
+    """
+    Store detection results, replacing earlier faces of the same media.
+    `results` holds (media_id, signature, boxes, encodings) tuples, where boxes
+    are (top, right, bottom, left) and encodings are 128-d vectors.
+    """
+    scanned_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with metrics.timed("db_commit"):
+        conn = sqlite3.connect(db_name)
+        cursor = conn.cursor()
+        for media_id, (mtime, size, digest), boxes, encodings in results:
+            cursor.execute("DELETE FROM face_encodings WHERE media_id = ?", (media_id,))
+            cursor.executemany('''
+                INSERT INTO face_encodings (media_id, top, right, bottom, left, encoding)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (media_id, *map(int, box), np.asarray(encoding, dtype=np.float32).tobytes())
+                for box, encoding in zip(boxes, encodings)
+            ])
+            cursor.execute('''
+                INSERT OR REPLACE INTO face_scans (media_id, file_mtime, file_size, content_hash, face_count, scanned_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (media_id, mtime, size, digest, len(encodings), scanned_at))
+        # The photo's faces changed, so its cluster is unknown until they are clustered again
+        cursor.executemany(
+            "UPDATE media_metadata SET cluster_id = NULL WHERE id = ?", [(result[0],) for result in results]
+        )
+        conn.commit()
+        conn.close()
+
+def load_encodings(db_name, with_face_ids=False):
+    """
+    Return the stored encodings of live photos (see LIVE_MEDIA) as one float32
+    matrix plus the media id of each row, and with `with_face_ids` also the
+    face id of each row.
+    """
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT f.id, f.media_id, f.encoding FROM face_encodings f
+        JOIN media_metadata m ON m.id = f.media_id
+        WHERE {LIVE_MEDIA}
+        ORDER BY f.id;
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+
+    media_ids = [row[1] for row in rows]
+    matrix = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(-1, ENCODING_DIM).copy()
+    if with_face_ids:
+        return matrix, media_ids, [row[0] for row in rows]
+    return matrix, media_ids
+
+def stable_labels(previous, labels):
+    """
+    Renumber fresh cluster labels so that each cluster keeps the id of the
+    previous cluster it shares the most faces with. Each previous id is reused
+    at most once; clusters without a match (new people, or the smaller half
+    of a split) get ids above every previous one. Noise stays -1.
+    """
+    overlaps = Counter(zip(labels[(labels >= 0) & (previous >= 0)], previous[(labels >= 0) & (previous >= 0)]))
+    mapping, taken = {}, set()
+    for (label, old), _ in sorted(overlaps.items(), key=lambda item: -item[1]):
+        if label not in mapping and old not in taken:
+            mapping[label] = old
+            taken.add(old)
+    next_id = int(previous.max(initial=-1)) + 1
+    for label in np.unique(labels[labels >= 0]):
+        if label not in mapping:
+            mapping[label] = next_id
+            next_id += 1
+    lookup = np.full(int(labels.max(initial=-1)) + 2, -1, dtype=np.int64)  # Noise (-1) reads the spare last slot
+    for label, cluster_id in mapping.items():
+        lookup[label] = cluster_id
+    return lookup[labels]
+
+def write_face_labels(conn, face_ids, labels, core=None):
+    """
+    Set the cluster label (and core flag) of many faces with one set-based
+    UPDATE: the labels are bulk-loaded into a temp table first. Without `core`
+    the faces keep their core flags. The cluster_id of each affected photo is
+    then refreshed from its faces, taking the cluster of its largest clustered
+    face (-1 if all its faces are noise).
+    Runs inside the caller's transaction on `conn`.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS face_labels (face_id INTEGER PRIMARY KEY, cluster_id INTEGER, is_core INTEGER)"
+    )
+    cursor.execute("DELETE FROM temp.face_labels")
+    flags = [None] * len(face_ids) if core is None else [int(flag) for flag in core]
+    cursor.executemany("INSERT INTO temp.face_labels VALUES (?, ?, ?)", zip(
+        [int(face_id) for face_id in face_ids], [int(label) for label in labels], flags,
+    ))
+    columns = ["cluster_id"] if core is None else ["cluster_id", "is_core"]
+    if sqlite3.sqlite_version_info >= (3, 33, 0):  # UPDATE ... FROM joins once instead of a lookup per column
+        assignments = ", ".join(f"{column} = l.{column}" for column in columns)
+        cursor.execute(f'''
+            UPDATE face_encodings SET {assignments}
+            FROM temp.face_labels l WHERE l.face_id = face_encodings.id
+        ''')
+    else:
+        assignments = ", ".join(
+            f"{column} = (SELECT l.{column} FROM temp.face_labels l WHERE l.face_id = face_encodings.id)"
+            for column in columns
+        )
+        cursor.execute(f'''
+            UPDATE face_encodings SET {assignments}
+            WHERE id IN (SELECT face_id FROM temp.face_labels)
+        ''')
+    cursor.execute('''
+        UPDATE media_metadata SET cluster_id = (
+            SELECT f.cluster_id FROM face_encodings f WHERE f.media_id = media_metadata.id
+            ORDER BY COALESCE(f.cluster_id, -1) < 0, (f.bottom - f.top) * (f.right - f.left) DESC, f.id
+            LIMIT 1
+        )
+        WHERE id IN (SELECT f.media_id FROM face_encodings f JOIN temp.face_labels l ON l.face_id = f.id)
+    ''')
+    cursor.execute("DELETE FROM temp.face_labels")
+
+def update_face_labels(db_name, face_ids, labels, core=None):
+    """
+    Store cluster labels computed outside face_clusters (e.g. by the legacy
+    scripts) in one transaction (see write_face_labels). They are renumbered
+    with stable_labels first, so each cluster keeps the id it had before.
+    The cluster summaries and state of face_clusters no longer describe these
+    labels, so they are cleared and the next cluster_incremental re-clusters.
+    """
+    face_ids = np.asarray(face_ids, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    with write_transaction(db_name) as conn:
+        previous = dict(conn.execute("SELECT id, cluster_id FROM face_encodings WHERE cluster_id IS NOT NULL"))
+        previous = np.array([previous.get(int(face_id), -1) for face_id in face_ids], dtype=np.int64)
+        write_face_labels(conn, face_ids, stable_labels(previous, labels), core)
+        for (table,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('face_clusters', 'face_cluster_state')"
+        ).fetchall():
+            conn.execute(f"DELETE FROM {table}")
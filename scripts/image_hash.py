@@ -0,0 +1,122 @@
+import math
+import numpy as np
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+# Side of the grayscale image the DCT of pHash is taken over; its top-left 8x8 block is kept
+PHASH_SIZE = 32
+# Images whose tiny decode varies less than this (grey levels, standard deviation) carry no
+# structure to hash: every flat frame, whatever its colour, would hash the same
+FLAT_STDDEV = 2.0
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis as an n x n matrix, so dct(x) = D @ x @ D.T."""
+    k = np.arange(n)[:, None]
+    basis = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * math.sqrt(2 / n)
+    basis[0] /= math.sqrt(2)
+    return basis
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def load_tiny(file_path, side=PHASH_SIZE):
+    """
+    Decode a grayscale copy of an image just large enough for hashing.
+    JPEGs are decoded in draft mode at 1/8 scale (or the smallest scale that
+    still covers `side` pixels), so no full-resolution frame is ever built.
+    """
+    image = Image.open(file_path)
+    image.draft("L", (side, side))
+    image = ImageOps.exif_transpose(image)
+    return image.convert("L")
+
+def dhash(image):
+    """64-bit difference hash: whether each pixel of a 9x8 thumbnail is brighter than its right neighbour."""
+    pixels = np.asarray(image.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(pixels[:, :-1] > pixels[:, 1:])
+
+def phash(image):
+    """64-bit DCT hash: whether each of the 8x8 lowest frequencies is above their median (DC excluded)."""
+    pixels = np.asarray(image.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+def image_hashes(file_path):
+    """Return (dHash, pHash) of an image, both from one tiny decode, or None for a featureless image."""
+    image = load_tiny(file_path)
+    if np.asarray(image, dtype=np.float32).std() < FLAT_STDDEV:
+        return None
+    return dhash(image), phash(image)
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash into SQLite's signed INTEGER range."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+def to_unsigned(value):
+    return value & HASH_MASK
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit hashes under the Hamming distance.
+
+    Hashes are split into `chunks` substrings, each with its own dict from
+    substring to the hashes containing it. Two hashes within `radius` of each
+    other differ in at most radius // chunks bits of at least one substring
+    (pigeonhole), so a search only probes the substrings within that many bit
+    flips of the query's and verifies the few hashes stored under them.
+    With 4 chunks of 16 bits, a radius below 8 costs 68 dict lookups.
+    """
+
+    def __init__(self, chunks=4):
+        self.chunk_bits = HASH_BITS // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(chunks)]
+        self.items = {}  # hash -> [items]
+        self._flips = {}
+
+    def __len__(self):
+        return sum(len(items) for items in self.items.values())
+
+    def _chunks(self, value):
+        return [(value >> (i * self.chunk_bits)) & self.chunk_mask for i in range(len(self.tables))]
+
+    def add(self, value, item):
+        """Store `item` under hash `value`; items with equal hashes share one entry."""
+        if value in self.items:
+            self.items[value].append(item)
+            return
+        self.items[value] = [item]
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(value)
+
+    def flips(self, bits):
+        """Every mask of at most `bits` set bits within one chunk (cached per bit count)."""
+        if bits not in self._flips:
+            masks = {0}
+            for _ in range(bits):
+                masks |= {mask | (1 << i) for mask in masks for i in range(self.chunk_bits)}
+            self._flips[bits] = sorted(masks)
+        return self._flips[bits]
+
+    def search(self, value, radius):
+        """Return [(distance, item)] of every stored hash within `radius` of `value`, nearest first."""
+        masks = self.flips(radius // len(self.tables))
+        seen = set()
+        found = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for mask in masks:
+                for candidate in table.get(chunk ^ mask, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming(value, candidate)
+                    if distance <= radius:
+                        found.extend((distance, item) for item in self.items[candidate])
+        found.sort(key=lambda hit: hit[0])
+        return found
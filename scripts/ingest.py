@@ -0,0 +1,140 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from metrics import metrics
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif')
+
+_DONE = object()  # Marks the end of the input
+
+def walk_images(folder_path, select=None):
+    """
+    Yield every image path under `folder_path`.
+    `select(file_paths)` may narrow each directory's images down to those worth parsing.
+    """
+    for root, dirs, files in os.walk(folder_path):
+        images = [os.path.join(root, file) for file in files if file.lower().endswith(IMAGE_EXTENSIONS)]
+        if select and images:
+            images = select(images)
+        yield from images
+
+def _produce(file_paths, paths, stop_event):
+    """Producer: move paths from an iterable (e.g. a directory walk) onto the bounded `paths` queue."""
+    try:
+        for file_path in file_paths:
+            if stop_event.is_set():
+                return
+            _put(paths, file_path, stop_event)
+    finally:
+        _put(paths, _DONE, stop_event)
+
+def _put(paths, item, stop_event):
+    """Block while the queue is full, giving up once a stop is requested."""
+    while not stop_event.is_set():
+        try:
+            paths.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _timed_parse(parse, file_path):
+    """Worker step: run `parse` and return (seconds taken, result)."""
+    started = time.perf_counter()
+    result = parse(file_path)
+    return time.perf_counter() - started, result
+
+def _timed_parse_in_process(parse, file_path):
+    """
+    Process worker step: like _timed_parse, plus the timing samples and
+    counters `parse` recorded in this process, which the parent merges.
+    """
+    metrics.reset()  # Also drops whatever a forked worker inherited from the parent
+    seconds, result = _timed_parse(parse, file_path)
+    return seconds, result, metrics.samples(), dict(metrics.counters)
+
+def ingest_folder(folder_path, parse, write, select=None, **options):
+    """
+    Streaming ingest of every image under `folder_path`; the directory walk runs
+    in the producer thread. `select(file_paths)` filters each directory's paths
+    before they are queued for parsing. See ingest_paths for the other options.
+    """
+    return ingest_paths(walk_images(folder_path, select), parse, write, **options)
+
+def ingest_paths(file_paths, parse, write, workers=None, use_processes=False,
+                 queue_size=1000, max_in_flight=None, limit=None, should_stop=None, stage="parse", on_error=None):
+    """
+    Streaming ingest: a producer thread drains `file_paths` into a bounded queue,
+    a pool of `workers` threads (or processes) runs `parse(file_path)`, and the
+    calling thread is the single writer that calls `write(file_path, result)`.
+
+    `limit` caps the number of written files and `should_stop()` is polled to
+    abort early; on stop, queued parse tasks are cancelled. A file whose parse
+    raises (e.g. it vanished after being listed) is reported, counted under
+    `stage + "_errors"`, passed to `on_error(file_path, error)` and skipped. Per-file parse and write times are recorded
+    in metrics under `stage` and `stage + "_write"`; whatever `parse` records
+    itself in a worker process is merged into the parent's metrics.
+    Returns the number of files written.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * workers
+    should_stop = should_stop or (lambda: False)
+    stop_event = threading.Event()
+    paths = queue.Queue(maxsize=queue_size)
+    producer = threading.Thread(target=_produce, args=(file_paths, paths, stop_event), daemon=True)
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    worker_step = _timed_parse_in_process if use_processes else _timed_parse
+
+    written = 0
+    started = time.perf_counter()
+    producer.start()
+    with executor_class(workers) as executor:
+        running = {}
+        producing = True
+        try:
+            while producing or running:
+                if should_stop() or (limit is not None and written >= limit):
+                    break
+
+                # Keep the pool fed up to the in-flight cap
+                while producing and len(running) < max_in_flight:
+                    try:
+                        file_path = paths.get(timeout=0.05 if not running else 0)
+                    except queue.Empty:
+                        break
+                    if file_path is _DONE:
+                        producing = False
+                    else:
+                        running[executor.submit(worker_step, parse, file_path)] = file_path
+
+                if not running:
+                    continue
+                done, _ = wait(running, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = running.pop(future)
+                    if limit is not None and written >= limit:
+                        continue
+                    try:
+                        seconds, result, *worker_metrics = future.result()
+                    except Exception as e:
+                        print(f"❌ Error reading {file_path}: {e}")
+                        metrics.count(stage + "_errors")
+                        if on_error:
+                            on_error(file_path, e)
+                        continue
+                    if worker_metrics:
+                        metrics.merge(*worker_metrics)
+                    metrics.observe(stage, seconds)
+                    with metrics.timed(stage + "_write"):
+                        write(file_path, result)
+                    written += 1
+        finally:
+            stop_event.set()
+            for future in running:
+                future.cancel()
+
+    elapsed = time.perf_counter() - started
+    metrics.count(stage + "_files", written)
+    print(f"✅ {stage} stage: {written} files in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.1f} files/s).")
+    return written
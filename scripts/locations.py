@@ -0,0 +1,94 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Columns returned for every match; distance_km is appended by the radius queries
+LOCATION_COLUMNS = "m.id, m.file_path, m.latitude, m.longitude"
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def _boxes(south, west, north, east):
+    """Split a box crossing the antimeridian (west > east) into two."""
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+def _query_boxes(conn, boxes, limit=None):
+    rows = []
+    for south, west, north, east in boxes:
+        if limit is not None and len(rows) >= limit:
+            break
+        rows.extend(conn.execute(f'''
+            SELECT {LOCATION_COLUMNS} FROM media_locations r
+            JOIN media_metadata m ON m.id = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+              AND m.latitude BETWEEN ? AND ? AND m.longitude BETWEEN ? AND ?
+              AND m.deleted_at IS NULL
+            LIMIT ?
+        ''', (south, north, west, east, south, north, west, east, -1 if limit is None else limit - len(rows))).fetchall())
+    return rows
+
+def bbox_condition(south, west, north, east):
+    """
+    SQL condition (with its parameters) restricting media_metadata `m` to a box
+    through the R*Tree, for use inside a larger query's WHERE clause.
+    """
+    boxes = _boxes(south, west, north, east)
+    clause = " OR ".join("(max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)" for _ in boxes)
+    exact = " OR ".join("(m.latitude BETWEEN ? AND ? AND m.longitude BETWEEN ? AND ?)" for _ in boxes)
+    params = [value for s, w, n, e in boxes for value in (s, n, w, e)]
+    return (f"m.id IN (SELECT id FROM media_locations WHERE {clause}) AND ({exact})", params + params)
+
+def photos_in_bbox(conn, south, west, north, east, limit=None):
+    """
+    Return (id, file_path, latitude, longitude) of the photos inside the box,
+    at most `limit` of them. A box with west > east wraps across the antimeridian.
+    """
+    return _query_boxes(conn, _boxes(south, west, north, east), limit)
+
+def radius_bbox(lat, lon, radius_km):
+    """Smallest (south, west, north, east) box containing the circle, wrapping at ±180."""
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = lat - delta_lat, lat + delta_lat
+    if south <= -90 or north >= 90:  # The circle contains a pole: every longitude
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    if delta_lon >= 180:
+        return south, -180.0, north, 180.0
+    west, east = lon - delta_lon, lon + delta_lon
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+def photos_within_radius(conn, lat, lon, radius_km):
+    """
+    Return (id, file_path, latitude, longitude, distance_km) of every photo within
+    `radius_km` of a point, nearest first. The R*Tree narrows the search to the
+    circle's bounding box and the exact distance is checked on those candidates.
+    """
+    matches = []
+    for row in photos_in_bbox(conn, *radius_bbox(lat, lon, radius_km)):
+        distance = haversine_km(lat, lon, row[2], row[3])
+        if distance <= radius_km:
+            matches.append(row + (distance,))
+    matches.sort(key=lambda row: row[4])
+    return matches
+
+def nearest_photos(conn, lat, lon, count, start_km=0.05):
+    """
+    Return the `count` photos nearest to a point as (id, file_path, latitude,
+    longitude, distance_km), nearest first. The search radius starts at
+    `start_km` and doubles until enough photos are found or it covers the globe.
+    """
+    radius_km = start_km
+    while True:
+        matches = photos_within_radius(conn, lat, lon, radius_km)
+        if len(matches) >= count or radius_km >= math.pi * EARTH_RADIUS_KM:
+            return matches[:count]
+        radius_km *= 2
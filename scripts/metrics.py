@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import array
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def peak_rss_bytes(children=False):
+    """Peak resident set size of this process (or of its largest finished child process), or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports kilobytes
+
+class Metrics:
+    """
+    Per-stage timers and named counters for one run.
+
+    Every call of `timed(stage)` (or `observe(stage, seconds)`) adds one
+    latency sample to the stage, so p50/p95 describe a single file or batch.
+    Samples are kept as doubles (8 bytes each). Worker processes collect their
+    own samples (and counters) and hand them back with `samples()`; the parent
+    `merge`s them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.timers = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.timers:
+                self.timers[stage] = array.array("d")
+            self.timers[stage].append(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def samples(self):
+        """Picklable copy of the latency samples, for sending to another process."""
+        with self.lock:
+            return {stage: values.tobytes() for stage, values in self.timers.items()}
+
+    def merge(self, samples, counters=None):
+        with self.lock:
+            for stage, data in samples.items():
+                if stage not in self.timers:
+                    self.timers[stage] = array.array("d")
+                self.timers[stage].frombytes(data)
+            for name, amount in (counters or {}).items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.timers = {}
+            self.counters = {}
+
+    def report(self):
+        """Summary of the run so far as a JSON-serializable dict."""
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            timers = {stage: sorted(values) for stage, values in self.timers.items()}
+            counters = dict(self.counters)
+        stages = {}
+        for stage, values in timers.items():
+            total = sum(values)
+            stages[stage] = {
+                "count": len(values),
+                "total_s": round(total, 6),
+                "mean_s": round(total / len(values), 6),
+                "p50_s": round(percentile(values, 0.50), 6),
+                "p95_s": round(percentile(values, 0.95), 6),
+                "max_s": round(values[-1], 6),
+            }
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "stages": stages,
+            "counters": counters,
+            "rates_per_s": {name: round(value / elapsed, 2) for name, value in counters.items()} if elapsed else {},
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_child_rss_bytes": peak_rss_bytes(children=True),
+        }
+
+    def prometheus(self, prefix="diw"):
+        """The report in the Prometheus text exposition format (e.g. for node_exporter's textfile collector)."""
+        report = self.report()
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, values in report["stages"].items():
+            label = f'stage="{stage}"'
+            lines.append(f'{prefix}_stage_seconds{{{label},quantile="0.5"}} {values["p50_s"]}')
+            lines.append(f'{prefix}_stage_seconds{{{label},quantile="0.95"}} {values["p95_s"]}')
+            lines.append(f"{prefix}_stage_seconds_sum{{{label}}} {values['total_s']}")
+            lines.append(f"{prefix}_stage_seconds_count{{{label}}} {values['count']}")
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in report["counters"].items():
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        lines.append(f"# TYPE {prefix}_elapsed_seconds gauge")
+        lines.append(f"{prefix}_elapsed_seconds {report['elapsed_s']}")
+        for key in ("peak_rss_bytes", "peak_child_rss_bytes"):
+            if report[key] is not None:
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {report[key]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        """Write the report to `file_path`: Prometheus text for .prom files, JSON otherwise."""
+        text = self.prometheus() if file_path.endswith(".prom") else json.dumps(self.report(), indent=2)
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(text)
+        os.replace(temp_path, file_path)  # Scrapers never see a half-written file
+
+    def print_summary(self):
+        report = self.report()
+        print(f"\nRun time {report['elapsed_s']:.1f}s")
+        for stage, values in report["stages"].items():
+            print(f"  {stage:<16} {values['count']:>8} x  p50 {values['p50_s'] * 1000:9.2f} ms  "
+                  f"p95 {values['p95_s'] * 1000:9.2f} ms  total {values['total_s']:8.2f} s")
+        for name, value in report["counters"].items():
+            print(f"  {name:<16} {value:>8}  ({report['rates_per_s'][name]:.1f}/s)")
+        if report["peak_rss_bytes"] is not None:
+            print(f"  peak RSS {report['peak_rss_bytes'] / 1024 ** 2:.0f} MB "
+                  f"(largest worker {report['peak_child_rss_bytes'] / 1024 ** 2:.0f} MB)")
+
+# Metrics of the current process; the pipeline stages record into this
+metrics = Metrics()
+timed = metrics.timed
+observe = metrics.observe
+count = metrics.count
+
+@contextmanager
+def profiled(profile_path=None, trace_memory=False, top=15):
+    """
+    Opt-in profiling of a block: with `profile_path`, cProfile stats are dumped
+    there (view them with `python -m pstats`); with `trace_memory`, tracemalloc
+    runs and the `top` allocation sites by size are printed at the end.
+    Both slow the run down noticeably, so they are off by default.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"✅ Profile written to {profile_path}.")
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"Traced Python memory: {current / 1024 ** 2:.1f} MB now, {peak / 1024 ** 2:.1f} MB peak")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"  {stat}")
@@ -0,0 +1,271 @@
+import sys
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+import extract_exif
+from schema import migrate
+from face_store import create_face_store
+from face_clusters import cluster_incremental, recluster
+from duplicates import hash_new_media, group_duplicates, DEFAULT_MAX_DISTANCE, DEFAULT_MAX_PHASH_DISTANCE
+from cluster_folders import materialize_clusters, MODES
+from export_to_excel import export_table, DEFAULT_CHUNK_ROWS
+from metrics import metrics, profiled
+
+STAGES = ("ingest", "dedupe", "faces", "cluster", "folders", "export")
+
+def create_checkpoints(db_name):
+    """Create the table recording the last completed run of each stage."""
+    conn = sqlite3.connect(db_name)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            completed_at TEXT,
+            details TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def load_checkpoint(db_name, stage):
+    """Return (fingerprint, completed_at, details) of a stage's last completed run, or None."""
+    conn = sqlite3.connect(db_name)
+    try:
+        row = conn.execute(
+            "SELECT fingerprint, completed_at, details FROM pipeline_checkpoints WHERE stage = ?", (stage,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return (row[0], row[1], json.loads(row[2] or "{}")) if row else None
+
+def save_checkpoint(db_name, stage, fingerprint, details=None):
+    conn = sqlite3.connect(db_name)
+    conn.execute(
+        "INSERT OR REPLACE INTO pipeline_checkpoints VALUES (?, ?, ?, ?)",
+        (stage, fingerprint, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), json.dumps(details or {})),
+    )
+    conn.commit()
+    conn.close()
+
+def media_fingerprint(db_name):
+    """Changes whenever photos are added, re-extracted or marked deleted."""
+    conn = sqlite3.connect(db_name)
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*), MAX(id), MAX(date_added), COUNT(deleted_at) FROM media_metadata"
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.dumps(row)
+
+def faces_fingerprint(db_name):
+    """Changes whenever face encodings are added or replaced."""
+    create_face_store(db_name)
+    conn = sqlite3.connect(db_name)
+    try:
+        row = conn.execute("SELECT COUNT(*), MAX(id) FROM face_encodings").fetchone()
+    finally:
+        conn.close()
+    return json.dumps(row)
+
+def is_done(db_name, stage, fingerprint, force=False):
+    """True (and says so) if the stage already completed for these inputs."""
+    checkpoint = load_checkpoint(db_name, stage)
+    if force or checkpoint is None or checkpoint[0] != fingerprint:
+        return False
+    print(f"✅ {stage}: nothing new since the run completed at {checkpoint[1]}; skipping (use --force to rerun).")
+    return True
+
+def run_ingest(args):
+    """Ingest is incremental by itself, so it always runs; its checkpoint records what it saw."""
+    if args.drive:
+        drive = extract_exif.authenticate_google_drive()
+        client = extract_exif.DriveClient(extract_exif.pydrive_token(drive.auth))
+        extract_exif.import_from_drive(client, args.drive, args.db, args.download_path, args.workers)
+        source = f"drive:{args.drive}"
+    elif args.full:
+        extract_exif.process_folder(args.folder, args.db, args.limit, args.workers, args.processes)
+        source = args.folder
+    else:
+        extract_exif.rescan_folder(args.folder, args.db, args.workers, args.processes, args.verify_files)
+        source = args.folder
+    if extract_exif.stop_requested:
+        return 1
+    save_checkpoint(args.db, "ingest", media_fingerprint(args.db), {"source": source})
+    return 0
+
+def run_dedupe(args):
+    """Only photos without hashes are hashed; they are then placed among the existing groups."""
+    options = {"max_distance": args.max_distance, "max_phash_distance": args.max_phash_distance}
+    fingerprint = json.dumps([media_fingerprint(args.db), options])
+    if is_done(args.db, "dedupe", fingerprint, args.force or args.regroup):
+        return 0
+    hashed = hash_new_media(args.db, args.workers, args.processes, should_stop=lambda: extract_exif.stop_requested)
+    if extract_exif.stop_requested:
+        return 1
+    _, duplicates = group_duplicates(args.db, **options, regroup=args.regroup)
+    save_checkpoint(args.db, "dedupe", fingerprint, {**options, "hashed": hashed, "duplicates": duplicates})
+    return 0
+
+def run_faces(args):
+    fingerprint = media_fingerprint(args.db)
+    if is_done(args.db, "faces", fingerprint, args.force):
+        return 0
+    extract_exif.detect_new_faces(args.db, args.workers, max_side=args.max_side)
+    save_checkpoint(args.db, "faces", fingerprint, {"max_side": args.max_side})
+    return 0
+
+def run_cluster(args):
+    """New faces are placed into the stored clusters; --full (or enough drift) re-clusters everything."""
+    options = {"eps": args.eps, "min_samples": args.min_samples, "index": args.index}
+    fingerprint = json.dumps([faces_fingerprint(args.db), options])
+    if is_done(args.db, "cluster", fingerprint, args.force or args.full):
+        return 0
+    if args.full:
+        recluster(args.db, **options)
+        mode = "full"
+    else:
+        mode = cluster_incremental(args.db, **options, recluster_fraction=args.recluster_fraction)
+    save_checkpoint(args.db, "cluster", fingerprint, {**options, "mode": mode})
+    return 0
+
+def run_folders(args):
+    """Only memberships that changed since the last run are applied to the folders."""
+    options = {"output": args.output, "mode": args.mode, "crop_size": args.crop_size}
+    cluster = load_checkpoint(args.db, "cluster")
+    fingerprint = json.dumps([media_fingerprint(args.db), cluster and cluster[1], options])
+    if is_done(args.db, "folders", fingerprint, args.force):
+        return 0
+    stats = materialize_clusters(args.db, args.output, args.mode, args.crop_size, workers=args.workers)
+    if stats["failed"]:
+        return 1
+    save_checkpoint(args.db, "folders", fingerprint, {**options, **stats})
+    return 0
+
+def run_export(args):
+    options = {"output": args.output, "columns": args.columns, "where": args.where}
+    cluster = load_checkpoint(args.db, "cluster")
+    fingerprint = json.dumps([media_fingerprint(args.db), cluster and cluster[1], options])
+    if is_done(args.db, "export", fingerprint, args.force):
+        return 0
+    rows = export_table(args.db, args.output, args.columns, args.where, chunk_rows=args.chunk_rows)
+    save_checkpoint(args.db, "export", fingerprint, {**options, "rows": rows})
+    return 0
+
+def run_serve(args):
+    from api_server import serve
+
+    serve(args.db, args.host, args.port, args.pool_size, args.verbose, args.thumbnail_dir, args.thumbnail_mb * 1024 ** 2)
+    return 0
+
+def run_status(args):
+    for stage in STAGES:
+        checkpoint = load_checkpoint(args.db, stage)
+        if checkpoint:
+            print(f"{stage:>8}: completed {checkpoint[1]} {checkpoint[2]}")
+        else:
+            print(f"{stage:>8}: never completed")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Photo library pipeline: run each stage on its own.")
+    parser.add_argument("--db", default="media_metadata.db", help="SQLite database (default: media_metadata.db)")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write stage timings, counters and peak RSS to FILE (Prometheus text for .prom, else JSON)")
+    parser.add_argument("--profile", metavar="FILE", help="Profile the run with cProfile and dump the stats to FILE")
+    parser.add_argument("--trace-memory", action="store_true", help="Report the top allocation sites (tracemalloc)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Extract metadata for new or changed photos")
+    ingest.add_argument("folder", nargs="?", help="Local folder to scan")
+    ingest.add_argument("--drive", metavar="FOLDER_ID", help="Import a Google Drive folder instead")
+    ingest.add_argument("--download-path", default="downloaded_images")
+    ingest.add_argument("--full", action="store_true", help="Walk the whole folder instead of using the scan journal")
+    ingest.add_argument("--verify-files", action="store_true", help="Also stat files in unchanged directories")
+    ingest.add_argument("--limit", type=int, default=100000, help="Maximum new files with --full")
+    ingest.add_argument("--workers", type=int)
+    ingest.add_argument("--processes", action="store_true", help="Parse EXIF in processes instead of threads")
+    ingest.set_defaults(run=run_ingest)
+
+    dedupe = commands.add_parser("dedupe", help="Hash new photos and group near-duplicates, which skip face detection")
+    dedupe.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE, help="dHash bits copies may differ in")
+    dedupe.add_argument("--max-phash-distance", type=int, default=DEFAULT_MAX_PHASH_DISTANCE,
+                        help="pHash bits copies may differ in")
+    dedupe.add_argument("--regroup", action="store_true", help="Dissolve all groups and group every photo again")
+    dedupe.add_argument("--workers", type=int)
+    dedupe.add_argument("--processes", action="store_true", help="Hash in processes instead of threads")
+    dedupe.add_argument("--force", action="store_true")
+    dedupe.set_defaults(run=run_dedupe)
+
+    faces = commands.add_parser("faces", help="Detect faces in new or changed photos")
+    faces.add_argument("--workers", type=int, help="Detection processes (default: one per CPU)")
+    faces.add_argument("--max-side", type=int, help="Detect on images downscaled to this longer side")
+    faces.add_argument("--force", action="store_true")
+    faces.set_defaults(run=run_faces)
+
+    cluster = commands.add_parser("cluster", help="Cluster face encodings and store cluster ids")
+    cluster.add_argument("--eps", type=float, default=0.5)
+    cluster.add_argument("--min-samples", type=int, default=2)
+    cluster.add_argument("--index", choices=("exact", "ivf"), default="exact")
+    cluster.add_argument("--full", action="store_true", help="Re-cluster every face instead of placing new ones")
+    cluster.add_argument("--recluster-fraction", type=float, default=0.2,
+                         help="Re-cluster once this fraction of faces changed since the last full pass")
+    cluster.add_argument("--force", action="store_true")
+    cluster.set_defaults(run=run_cluster)
+
+    folders = commands.add_parser("folders", help="Link photos (or face crops) into one folder per cluster")
+    folders.add_argument("--output", default="output_faces")
+    folders.add_argument("--mode", choices=MODES, default="hardlink",
+                         help="How photos are placed; links fall back to copies where they cannot be made")
+    folders.add_argument("--crop-size", type=int, default=256, help="Longer side of face crops with --mode crops")
+    folders.add_argument("--workers", type=int)
+    folders.add_argument("--force", action="store_true")
+    folders.set_defaults(run=run_folders)
+
+    export = commands.add_parser("export", help="Stream the metadata table to CSV, Parquet or XLSX")
+    export.add_argument("--output", default="media_metadata.xlsx", help="Output file; the extension picks the format")
+    export.add_argument("--columns", nargs="+", help="Columns to export, in order (default: all)")
+    export.add_argument("--where", help="SQL condition on the table aliased m, e.g. \"m.make = 'Apple'\"")
+    export.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    export.add_argument("--force", action="store_true")
+    export.set_defaults(run=run_export)
+
+    serve = commands.add_parser("serve", help="Serve the HTTP API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=5000)
+    serve.add_argument("--pool-size", type=int, default=8)
+    serve.add_argument("--thumbnail-dir", default="thumbnails")
+    serve.add_argument("--thumbnail-mb", type=int, default=2048)
+    serve.add_argument("--verbose", action="store_true")
+    serve.set_defaults(run=run_serve)
+
+    status = commands.add_parser("status", help="Show the last completed run of each stage")
+    status.set_defaults(run=run_status)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "ingest" and (args.folder is None) == (args.drive is None):
+        parser.error("ingest needs either a folder or --drive FOLDER_ID")
+    migrate(args.db)
+    create_checkpoints(args.db)
+    try:
+        with profiled(args.profile, args.trace_memory):
+            return args.run(args)
+    except KeyboardInterrupt:
+        extract_exif.stop_process()
+        print(f"⚠️ {args.command} interrupted by user; its checkpoint was not updated.")
+        return 130
+    except Exception as e:
+        print(f"❌ {args.command} failed: {e}")
+        return 1
+    finally:
+        if args.command not in ("serve", "status"):
+            metrics.print_summary()
+        if args.metrics:
+            metrics.write(args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
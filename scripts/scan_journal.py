@@ -0,0 +1,138 @@
+import os
+import json
+import sqlite3
+from ingest import IMAGE_EXTENSIONS
+
+def create_scan_journal(db_name):
+    """Create the tables recording what the last scan saw on disk."""
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_directories (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            subdirs TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scan_files (
+            path TEXT PRIMARY KEY,
+            directory TEXT,
+            size INTEGER,
+            mtime REAL,
+            inode INTEGER
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_files_directory ON scan_files(directory);")
+    conn.commit()
+    conn.close()
+
+class ScanDiff:
+    """What changed on disk since the journal was last committed."""
+
+    def __init__(self):
+        self.added = []  # (path, directory, size, mtime, inode)
+        self.changed = []  # (path, directory, size, mtime, inode)
+        self.removed = []  # paths
+        self.directories = []  # (path, mtime, subdirs) of every directory that was listed
+        self.removed_directories = []
+        self.unchanged_directories = 0
+
+    def summary(self):
+        return (f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed "
+                f"({self.unchanged_directories} unchanged directories not listed)")
+
+def _signature(path, directory, stat):
+    return path, directory, stat.st_size, stat.st_mtime, stat.st_ino
+
+def diff_tree(db_name, folder_path, verify_files=False):
+    """
+    Compare the tree under `folder_path` with the journal.
+
+    A directory whose mtime matches the journal has the same entries as last
+    time, so it is not listed again and its recorded subdirectories are
+    visited directly. Editing a file in place does not change its directory's
+    mtime; with `verify_files`, the journaled files of unchanged directories
+    are stat'ed as well to catch such edits.
+    """
+    diff = ScanDiff()
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    stack = [folder_path]
+
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        cursor.execute("SELECT mtime, subdirs FROM scan_directories WHERE path = ?", (directory,))
+        known = cursor.fetchone()
+        journal = {}
+        if not known or known[0] != mtime or verify_files:
+            cursor.execute("SELECT path, size, mtime, inode FROM scan_files WHERE directory = ?", (directory,))
+            journal = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+        if known and known[0] == mtime:
+            diff.unchanged_directories += 1
+            stack.extend(json.loads(known[1]))
+            for path, signature in journal.items():
+                try:
+                    current = _signature(path, directory, os.stat(path))
+                except OSError:
+                    diff.removed.append(path)
+                    continue
+                if current[2:] != signature:
+                    diff.changed.append(current)
+            continue
+
+        subdirs = []
+        seen = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    current = _signature(entry.path, directory, entry.stat())
+                    seen.add(entry.path)
+                    if entry.path not in journal:
+                        diff.added.append(current)
+                    elif current[2:] != journal[entry.path]:
+                        diff.changed.append(current)
+        diff.removed.extend(path for path in journal if path not in seen)
+
+        if known:
+            gone = set(json.loads(known[1])) - set(subdirs)
+            diff.removed_directories.extend(gone)
+            for subdir in gone:
+                cursor.execute(
+                    "SELECT path FROM scan_files WHERE directory = ? OR substr(directory, 1, ?) = ?",
+                    (subdir, len(subdir) + 1, subdir + os.sep),
+                )
+                diff.removed.extend(row[0] for row in cursor.fetchall())
+        diff.directories.append((directory, mtime, json.dumps(subdirs)))
+        stack.extend(subdirs)
+
+    conn.close()
+    return diff
+
+def record_file(writer, signature):
+    """Queue a journal row for a file whose metadata has been (re)extracted."""
+    writer.add("INSERT OR REPLACE INTO scan_files (path, directory, size, mtime, inode) VALUES (?, ?, ?, ?, ?)", signature)
+
+def commit_directories(writer, diff, retry_directories=()):
+    """
+    Record removed files and the state of every listed directory once the scan
+    is complete. `retry_directories` are left unrecorded (e.g. a file in them
+    failed), so the next scan lists them again.
+    """
+    writer.add_many("DELETE FROM scan_files WHERE path = ?", ((path,) for path in diff.removed))
+    for subdir in diff.removed_directories:
+        writer.add(
+            "DELETE FROM scan_directories WHERE path = ? OR substr(path, 1, ?) = ?",
+            (subdir, len(subdir) + 1, subdir + os.sep),
+        )
+    writer.add_many(
+        "INSERT OR REPLACE INTO scan_directories (path, mtime, subdirs) VALUES (?, ?, ?)",
+        (entry for entry in diff.directories if entry[0] not in retry_directories),
+    )
@@ -0,0 +1,339 @@
+import sys
+import math
+import time
+import sqlite3
+import calendar
+from fractions import Fraction
+from face_store import create_face_tables
+
+# Typed copies of the EXIF text columns, filled on insert and backfilled by migration 2
+TYPED_COLUMNS = (
+    ("taken_at", "INTEGER"),  # date_taken as seconds since the epoch
+    ("latitude", "REAL"),
+    ("longitude", "REAL"),
+    ("image_width", "INTEGER"),
+    ("image_height", "INTEGER"),
+    ("iso_speed", "INTEGER"),
+    ("f_number", "REAL"),
+    ("exposure_time", "REAL"),  # seconds
+)
+
+def parse_exif_datetime(value):
+    """
+    Convert an EXIF date ('2012:11:18 10:37:23') to seconds since the epoch.
+    EXIF dates carry no timezone, so the camera's local time is read as UTC.
+    """
+    if not value:
+        return None
+    text = str(value).strip()
+    try:
+        # Fixed-width fields; slicing is much faster than strptime over a whole table
+        fields = (text[0:4], text[5:7], text[8:10], text[11:13], text[14:16], text[17:19])
+        year, month, day, hour, minute, second = (int(field) for field in fields)
+        if not (1 <= month <= 12 and 1 <= day <= 31 and hour < 24 and minute < 60 and second < 61):
+            return None
+        return calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0))
+    except ValueError:
+        return None
+
+def parse_number(value):
+    """Parse a stored number ('250', '2.4', '1/60', '0.0166') as a float, or None."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        try:
+            number = float(value)
+        except ValueError:
+            try:
+                number = float(Fraction(str(value).strip()))  # '1/60'
+            except (ValueError, ZeroDivisionError):
+                return None
+    return None if math.isnan(number) or math.isinf(number) else number
+
+def parse_integer(value):
+    number = parse_number(value)
+    return None if number is None else int(round(number))
+
+def parse_coordinate(value, index):
+    """Pick latitude (0) or longitude (1) out of a 'lat, lon' GPSInfo string."""
+    if not value:
+        return None
+    parts = str(value).split(",")
+    return parse_number(parts[index]) if len(parts) == 2 else None
+
+def parse_dimension(value, index):
+    """Pick width (0) or height (1) out of a 'WxH' resolution string."""
+    if not value:
+        return None
+    parts = str(value).lower().split("x")
+    return parse_integer(parts[index]) if len(parts) == 2 else None
+
+def typed_values(metadata):
+    """Values for TYPED_COLUMNS, in order, from an extract_image_metadata dict."""
+    gps = metadata.get("GPSInfo")
+    resolution = metadata.get("Resolution")
+    return (
+        parse_exif_datetime(metadata.get("DateTimeOriginal")),
+        parse_coordinate(gps, 0),
+        parse_coordinate(gps, 1),
+        parse_dimension(resolution, 0),
+        parse_dimension(resolution, 1),
+        parse_integer(metadata.get("ISO")),
+        parse_number(metadata.get("FStop")),
+        parse_number(metadata.get("ShutterSpeed")),
+    )
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table});")
+    return {col[1] for col in cursor.fetchall()}
+
+def _baseline(cursor):
+    """Bring any earlier media_metadata table (or none) to the layout extract_exif.py used to create."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_metadata (
+            id INTEGER PRIMARY KEY,
+            file_path TEXT UNIQUE,
+            filename TEXT,
+            date_taken TEXT,
+            date_added TEXT,
+            make TEXT,
+            model TEXT,
+            resolution TEXT,
+            iso TEXT,
+            f_stop TEXT,
+            shutter_speed TEXT,
+            GPSInfo TEXT,
+            cluster_id INTEGER,
+            file_size INTEGER,
+            file_mtime REAL,
+            deleted_at TEXT
+        )
+    ''')
+    columns = _columns(cursor, "media_metadata")
+    for name, kind in (
+        ("filename", "TEXT"), ("date_taken", "TEXT"), ("date_added", "TEXT"), ("make", "TEXT"),
+        ("model", "TEXT"), ("resolution", "TEXT"), ("iso", "TEXT"), ("f_stop", "TEXT"),
+        ("shutter_speed", "TEXT"), ("GPSInfo", "TEXT"), ("cluster_id", "INTEGER"),
+        ("file_size", "INTEGER"), ("file_mtime", "REAL"), ("deleted_at", "TEXT"),
+    ):
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE media_metadata ADD COLUMN {name} {kind};")
+
+    # Tables created by the old reset script have no UNIQUE constraint on file_path:
+    # drop duplicate rows (keeping the first) so the unique index can be built
+    cursor.execute("""
+        DELETE FROM media_metadata WHERE id NOT IN (
+            SELECT MIN(id) FROM media_metadata GROUP BY file_path
+        );
+    """)
+    if cursor.rowcount > 0:
+        print(f"⚠️ Removed {cursor.rowcount} duplicate rows from media_metadata.")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_media_metadata_file_path ON media_metadata(file_path);")
+
+def _typed_columns(cursor):
+    """Add typed numeric columns and fill them from the text columns."""
+    columns = _columns(cursor, "media_metadata")
+    for name, kind in TYPED_COLUMNS:
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE media_metadata ADD COLUMN {name} {kind};")
+
+    conn = cursor.connection
+    conn.create_function("exif_epoch", 1, parse_exif_datetime, deterministic=True)
+    conn.create_function("to_number", 1, parse_number, deterministic=True)
+    conn.create_function("to_integer", 1, parse_integer, deterministic=True)
+    conn.create_function("coordinate", 2, parse_coordinate, deterministic=True)
+    conn.create_function("dimension", 2, parse_dimension, deterministic=True)
+    cursor.execute("""
+        UPDATE media_metadata SET
+            taken_at = exif_epoch(date_taken),
+            latitude = coordinate(GPSInfo, 0),
+            longitude = coordinate(GPSInfo, 1),
+            image_width = COALESCE(dimension(resolution, 0), image_width),
+            image_height = COALESCE(dimension(resolution, 1), image_height),
+            iso_speed = to_integer(iso),
+            f_number = to_number(f_stop),
+            exposure_time = to_number(shutter_speed);
+    """)
+    print(f"✅ Backfilled typed columns for {cursor.rowcount} rows.")
+
+def _filter_indexes(cursor):
+    """Index the columns that date, camera and cluster filters use."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_taken_at ON media_metadata(taken_at);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_camera ON media_metadata(make, model);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_cluster_id ON media_metadata(cluster_id);")
+
+def _location_index(cursor):
+    """Add an R*Tree over photo coordinates, kept in sync by triggers."""
+    # R*Tree stores 32-bit floats rounded outward, so boxes may be a few metres
+    # too large; queries in locations.py recheck the exact REAL columns
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS media_locations USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO media_locations (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT id, latitude, latitude, longitude, longitude FROM media_metadata
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS media_locations_insert AFTER INSERT ON media_metadata
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT INTO media_locations VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS media_locations_update AFTER UPDATE OF latitude, longitude ON media_metadata
+        BEGIN
+            DELETE FROM media_locations WHERE id = OLD.id;
+            INSERT INTO media_locations
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS media_locations_delete AFTER DELETE ON media_metadata
+        BEGIN
+            DELETE FROM media_locations WHERE id = OLD.id;
+        END
+    ''')
+
+def _api_indexes(cursor):
+    """Index the lookups the API server makes."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_filename ON media_metadata(filename);")
+    # Serves cluster pages in date order without a sort
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_cluster_taken_at ON media_metadata(cluster_id, taken_at);")
+
+def _face_tables(cursor):
+    """
+    Create the per-face table (with its labels and both indexes) for every
+    database, so the API can filter photos by the clusters of all their faces.
+    """
+    create_face_tables(cursor)
+    # Cluster pages now come from face_encodings; media_metadata.cluster_id only keeps the main face's cluster
+    cursor.execute("DROP INDEX IF EXISTS idx_media_metadata_cluster_taken_at;")
+
+def _perceptual_hashes(cursor):
+    """
+    Add the perceptual hashes of each photo and the near-duplicate group it
+    belongs to: duplicate_of is the id of the group's original (its own id for
+    the original), NULL until the photo has been grouped.
+    """
+    columns = _columns(cursor, "media_metadata")
+    for name in ("dhash", "phash", "duplicate_of"):
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE media_metadata ADD COLUMN {name} INTEGER;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_metadata_duplicate_of ON media_metadata(duplicate_of);")
+
+def _location_upserts(cursor):
+    """
+    Make the location insert trigger replace a photo's box. Its INSERT ran under
+    the conflict policy of the statement that fired it, so under OR IGNORE a
+    leftover box for the id won, and since the delete trigger does not fire for
+    rows removed by OR REPLACE, a photo re-ingested without coordinates kept
+    its old box.
+    The index is rebuilt to drop the boxes left behind so far.
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS media_locations_insert;")
+    cursor.execute('''
+        CREATE TRIGGER media_locations_insert AFTER INSERT ON media_metadata
+        BEGIN
+            DELETE FROM media_locations WHERE id = NEW.id;
+            INSERT INTO media_locations
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    ''')
+    cursor.execute("DELETE FROM media_locations;")
+    cursor.execute('''
+        INSERT INTO media_locations (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT id, latitude, latitude, longitude, longitude FROM media_metadata
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+# Migration i brings the database from user_version i to i + 1. Only ever append.
+MIGRATIONS = [
+    _baseline,
+    _typed_columns,
+    _filter_indexes,
+    _location_index,
+    _api_indexes,
+    _face_tables,
+    _perceptual_hashes,
+    _location_upserts,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return conn.execute("PRAGMA user_version;").fetchone()[0]
+    finally:
+        conn.close()
+
+def migrate(db_name):
+    """
+    Apply every migration newer than the database's PRAGMA user_version, each in
+    its own transaction together with the version bump. Returns the new version.
+    """
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"{db_name} has schema version {version}, newer than this code ({SCHEMA_VERSION}).")
+        for number in range(version, SCHEMA_VERSION):
+            migration = MIGRATIONS[number]
+            started = time.perf_counter()
+            cursor.execute("BEGIN")
+            try:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {number + 1};")
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            print(f"✅ Migrated {db_name} to version {number + 1} ({migration.__name__.strip('_')}) "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        return SCHEMA_VERSION
+    finally:
+        conn.close()
+
+# Every table keyed by media ids or file paths; a reset drops them all, so that nothing
+# stale (journal entries, faces, clusters, locations) outlives the rows it describes
+MEDIA_TABLES = (
+    "media_metadata", "media_locations", "scan_files", "scan_directories", "face_scans", "face_encodings",
+    "face_clusters", "face_cluster_state", "drive_files", "pipeline_checkpoints",
+)
+
+def reset_database(db_name):
+    """
+    Drop media_metadata and every table derived from it (MEDIA_TABLES) in one
+    transaction, then recreate the schema at the current version.
+    """
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        try:
+            for table in MEDIA_TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table};")
+            conn.execute("PRAGMA user_version = 0;")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    migrate(db_name)
+
+if __name__ == "__main__":
+    db_name = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else "media_metadata.db"
+    if "--reset" in sys.argv:
+        reset_database(db_name)
+        print(f"✅ Reset {db_name}: dropped {', '.join(MEDIA_TABLES)} and recreated the schema.")
+    else:
+        print(f"{db_name} is at schema version {schema_version(db_name)} of {SCHEMA_VERSION}.")
+        migrate(db_name)
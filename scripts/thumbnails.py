@@ -0,0 +1,262 @@
+import io
+import os
+import math
+import sqlite3
+import argparse
+import threading
+import functools
+from collections import OrderedDict
+from PIL import Image, ImageOps
+from face_store import content_hash
+from ingest import ingest_paths
+from metrics import metrics
+
+THUMBNAIL_SIZES = (256, 1024)
+# Format name -> (Pillow format, file extension, content type)
+FORMATS = {"webp": ("WEBP", ".webp", "image/webp"), "jpeg": ("JPEG", ".jpg", "image/jpeg")}
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+
+def thumbnail_name(digest, size, fmt):
+    """Cache-relative file name of a thumbnail, keyed by the source's content hash."""
+    return os.path.join(digest[:2], f"{digest}_{size}{FORMATS[fmt][1]}")
+
+def render_thumbnails(file_path, sizes=THUMBNAIL_SIZES, fmt="webp", quality=80):
+    """
+    Decode an image once and return {size: encoded bytes} for each requested
+    longer-side size. JPEGs are decoded in draft mode at the smallest 1/2, 1/4
+    or 1/8 scale that still covers the largest size; smaller sizes are
+    resized from the larger ones. Images are never upscaled.
+    """
+    image = Image.open(file_path)
+    largest = max(sizes)
+    if max(image.size) > largest:
+        ratio = largest / max(image.size)
+        image.draft("RGB", (math.ceil(image.size[0] * ratio), math.ceil(image.size[1] * ratio)))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    thumbnails = {}
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, FORMATS[fmt][0], quality=quality)
+        thumbnails[size] = buffer.getvalue()
+    return thumbnails
+
+def _write_thumbnails(cache_dir, digest, fmt, thumbnails):
+    """Write rendered thumbnails atomically; returns [(name, bytes written)]."""
+    written = []
+    for size, data in thumbnails.items():
+        name = thumbnail_name(digest, size, fmt)
+        path = os.path.join(cache_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        written.append((name, len(data)))
+    return written
+
+def _pregenerate_one(file_path, cache_dir, sizes, fmt, quality):
+    """Worker step of pregenerate: hash the source and write whichever thumbnails are missing."""
+    try:
+        stat = os.stat(file_path)
+        with metrics.timed("thumbnail_hash"):
+            digest = content_hash(file_path)
+        missing = [s for s in sizes if not os.path.exists(os.path.join(cache_dir, thumbnail_name(digest, s, fmt)))]
+        written = []
+        if missing:
+            with metrics.timed("thumbnail_render"):
+                thumbnails = render_thumbnails(file_path, missing, fmt, quality)
+            written = _write_thumbnails(cache_dir, digest, fmt, thumbnails)
+        metrics.count("thumbnails_written", len(written))
+        metrics.count("thumbnail_bytes", sum(size for _, size in written))
+        return stat.st_size, stat.st_mtime, digest, written, None
+    except Exception as e:
+        return None, None, None, [], str(e)
+
+class ThumbnailCache:
+    """
+    On-disk thumbnail cache under `cache_dir`, capped at `max_bytes`.
+
+    Thumbnails are stored under the content hash of their source, so copies of
+    a photo share them and an edited photo gets new ones. The hash of each
+    source is remembered by (path, size, mtime) in sources.db, so it is only
+    computed again when the file changes. Least recently used thumbnails are
+    evicted first; recency survives restarts as the files' mtimes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES, fmt="webp", quality=80, sizes=THUMBNAIL_SIZES):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown thumbnail format: {fmt}")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.quality = quality
+        self.sizes = tuple(sizes)
+        self.content_type = FORMATS[fmt][2]
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.generated = self.evicted = 0
+
+        self.sources = sqlite3.connect(os.path.join(cache_dir, "sources.db"), check_same_thread=False)
+        self.sources.execute("PRAGMA journal_mode=WAL;")
+        self.sources.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)")
+        self.sources.commit()
+
+        self.entries = OrderedDict()  # name -> bytes, least recently used first
+        self.total_bytes = 0
+        found = []
+        for prefix in os.scandir(cache_dir):
+            if prefix.is_dir():
+                for entry in os.scandir(prefix.path):
+                    if not entry.name.endswith(".tmp"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, os.path.join(prefix.name, entry.name), stat.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def known_hash(self, file_path, stat):
+        """Content hash remembered for this exact file version, or None."""
+        with self.lock:
+            row = self.sources.execute("SELECT size, mtime, hash FROM sources WHERE path = ?", (file_path,)).fetchone()
+        return row[2] if row and row[0] == stat.st_size and row[1] == stat.st_mtime else None
+
+    def remember(self, file_path, size, mtime, digest, commit=True):
+        with self.lock:
+            self.sources.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)", (file_path, size, mtime, digest))
+            if commit:
+                self.sources.commit()
+
+    def register(self, written):
+        """Record newly written thumbnails and evict the least recently used ones beyond the cap."""
+        with self.lock:
+            for name, size in written:
+                self.total_bytes += size - self.entries.pop(name, 0)
+                self.entries[name] = size
+                self.generated += 1
+            while self.total_bytes > self.max_bytes and len(self.entries) > len(written):
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evicted += 1
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _touch(self, name):
+        """Mark a cached thumbnail as used; False if it is not (or no longer) on disk."""
+        with self.lock:
+            if name not in self.entries:
+                return False
+            self.entries.move_to_end(name)
+        try:
+            os.utime(os.path.join(self.cache_dir, name))
+            return True
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(name, 0)
+            return False
+
+    def is_cached(self, file_path):
+        """True if every size is cached for the current version of a file (without hashing it)."""
+        digest = self.known_hash(file_path, os.stat(file_path))
+        with self.lock:
+            return digest is not None and all(thumbnail_name(digest, s, self.fmt) in self.entries for s in self.sizes)
+
+    def get(self, file_path, size):
+        """
+        Return the path of a thumbnail of `file_path` with the given longer side and
+        its content hash, rendering every size of it first on a miss.
+        """
+        if size not in self.sizes:
+            raise ValueError(f"Thumbnail size must be one of {', '.join(map(str, self.sizes))}.")
+        stat = os.stat(file_path)
+        digest = self.known_hash(file_path, stat)
+        if digest is None:
+            digest = content_hash(file_path)
+            self.remember(file_path, stat.st_size, stat.st_mtime, digest)
+
+        name = thumbnail_name(digest, size, self.fmt)
+        hit = self._touch(name)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            missing = [s for s in self.sizes if s == size or thumbnail_name(digest, s, self.fmt) not in self.entries]
+            thumbnails = render_thumbnails(file_path, missing, self.fmt, self.quality)
+            self.register(_write_thumbnails(self.cache_dir, digest, self.fmt, thumbnails))
+        return os.path.join(self.cache_dir, name), digest
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else None,
+            "generated": self.generated,
+            "evicted": self.evicted,
+            "thumbnails": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self):
+        self.sources.commit()
+        self.sources.close()
+
+def pregenerate(db_name, cache, workers=None):
+    """
+    Render every size for each photo in media_metadata that is not cached yet,
+    in a process pool. Photos already cached count as hits.
+    """
+    conn = sqlite3.connect(db_name)
+    file_paths = [row[0] for row in conn.execute("SELECT file_path FROM media_metadata WHERE deleted_at IS NULL;")]
+    conn.close()
+
+    pending = []
+    for file_path in file_paths:
+        try:
+            if cache.is_cached(file_path):
+                cache.hits += 1
+                continue
+        except OSError:
+            print(f"⚠️ Missing file: {file_path}")
+            continue
+        pending.append(file_path)
+    print(f"Rendering thumbnails for {len(pending)} of {len(file_paths)} photos...")
+
+    def write(file_path, result):
+        size, mtime, digest, written, error = result
+        if error:
+            print(f"❌ Error creating thumbnails for {file_path}: {error}")
+            return
+        cache.misses += 1
+        cache.remember(file_path, size, mtime, digest, commit=False)
+        cache.register(written)
+
+    render = functools.partial(
+        _pregenerate_one, cache_dir=cache.cache_dir, sizes=cache.sizes, fmt=cache.fmt, quality=cache.quality,
+    )
+    ingest_paths(pending, render, write, workers=workers, use_processes=True, stage="thumbnail")
+    cache.sources.commit()
+    return cache.stats()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate thumbnails for every photo in the database.")
+    parser.add_argument("--db", default="media_metadata.db")
+    parser.add_argument("--cache-dir", default="thumbnails")
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_CACHE_BYTES // 1024 ** 2, help="Cache size cap")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="webp")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    cache = ThumbnailCache(args.cache_dir, args.max_mb * 1024 ** 2, args.format, args.quality)
+    try:
+        stats = pregenerate(args.db, cache, args.workers)
+        print(f"✅ Thumbnails ready: {stats}")
+    finally:
+        cache.close()
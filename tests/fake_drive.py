@@ -0,0 +1,97 @@
+import json
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class FakeDrive:
+    """
+    Local stand-in for the Drive v2 endpoints DriveClient uses: the paged file
+    listing and `alt=media` downloads with Range support. `files` maps an id
+    to (title, content). Ids listed in `cut_once` have their first download cut
+    off halfway, as a dropped connection would. Every request is recorded in
+    `requests` as (path, query, Range header).
+    """
+
+    def __init__(self, files, cut_once=()):
+        self.files = dict(files)
+        self.cut_once = set(cut_once)
+        self.requests = []
+        drive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                drive.requests.append((url.path, query, self.headers.get("Range")))
+                if url.path == "/files":
+                    drive.list_page(self, query)
+                elif url.path.startswith("/files/") and query.get("alt") == "media":
+                    drive.media(self, url.path[len("/files/"):], self.headers.get("Range"))
+                else:
+                    self.send_error(404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def item(self, file_id):
+        title, content = self.files[file_id]
+        return {
+            "id": file_id, "title": title, "mimeType": "image/jpeg",
+            "md5Checksum": hashlib.md5(content).hexdigest(), "fileSize": str(len(content)),
+        }
+
+    def list_page(self, handler, query):
+        ids = sorted(self.files)
+        start = int(query.get("pageToken", 0))
+        end = start + int(query.get("maxResults", 100))
+        page = {"items": [self.item(file_id) for file_id in ids[start:end]]}
+        if end < len(ids):
+            page["nextPageToken"] = str(end)
+        body = json.dumps(page).encode()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def media(self, handler, file_id, range_header):
+        if file_id not in self.files:
+            handler.send_error(404)
+            return
+        content = self.files[file_id][1]
+        offset = int(range_header[len("bytes="):].split("-")[0]) if range_header else 0
+        if offset >= len(content) and offset:
+            handler.send_error(416)
+            return
+        body = content[offset:]
+        handler.send_response(206 if offset else 200)
+        if offset:
+            handler.send_header("Content-Range", f"bytes {offset}-{len(content) - 1}/{len(content)}")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if file_id in self.cut_once:
+            self.cut_once.discard(file_id)
+            body = body[:len(body) // 2]
+            handler.close_connection = True
+        handler.wfile.write(body)
+
+    def media_requests(self, file_id=None):
+        """(file id, Range header) of every download request, optionally for one file."""
+        found = [
+            (path[len("/files/"):], range_header) for path, query, range_header in self.requests
+            if path.startswith("/files/") and query.get("alt") == "media"
+        ]
+        return [entry for entry in found if file_id is None or entry[0] == file_id]
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import numpy as np
+from PIL import Image
+import schema
+import cluster_folders
+from cluster_folders import materialize_clusters, MANIFEST_NAME
+
+# (media id, cluster of each of its faces)
+PHOTOS = [(1, [0]), (2, [0]), (3, [1]), (4, [1, 2])]
+
+def make_library(tmp_path):
+    db_name = str(tmp_path / "media.db")
+    schema.migrate(db_name)
+    conn = sqlite3.connect(db_name)
+    for media_id, clusters in PHOTOS:
+        file_path = str(tmp_path / f"photo{media_id}.jpg")
+        pixels = np.random.default_rng(media_id).integers(0, 255, (200, 300, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(file_path)
+        stat = os.stat(file_path)
+        conn.execute(
+            "INSERT INTO media_metadata (id, file_path, filename, file_size, file_mtime) VALUES (?, ?, ?, ?, ?)",
+            (media_id, file_path, os.path.basename(file_path), stat.st_size, stat.st_mtime),
+        )
+        for i, cluster_id in enumerate(clusters):
+            conn.execute(
+                "INSERT INTO face_encodings (media_id, top, right, bottom, left, encoding, cluster_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (media_id, 20, 80 + 100 * i, 100, 10 + 100 * i, np.zeros(128, np.float32).tobytes(), cluster_id),
+            )
+    conn.commit()
+    conn.close()
+    return db_name
+
+def listing(folder):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), folder)
+        for root, _, files in os.walk(folder) for name in files if name != MANIFEST_NAME
+    )
+
+def inodes(folder):
+    return {name: os.stat(os.path.join(folder, name)).st_ino for name in listing(folder)}
+
+def test_rerun_is_idempotent_and_only_moves_changed_entries(tmp_path):
+    db_name = make_library(tmp_path)
+    out = str(tmp_path / "people")
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert stats["created"] == 5 and stats["failed"] == 0
+    assert listing(out) == [
+        "cluster_0/1_photo1.jpg", "cluster_0/2_photo2.jpg", "cluster_1/3_photo3.jpg",
+        "cluster_1/4_photo4.jpg", "cluster_2/4_photo4.jpg",
+    ]
+    assert os.path.samefile(os.path.join(out, "cluster_0", "1_photo1.jpg"), tmp_path / "photo1.jpg")
+
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert (stats["created"], stats["removed"], stats["kept"]) == (0, 0, 5)
+
+    before = inodes(out)
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE face_encodings SET cluster_id = 1 WHERE media_id = 2")
+    conn.commit()
+    conn.close()
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert (stats["created"], stats["removed"], stats["kept"]) == (1, 1, 4)
+    after = inodes(out)
+    assert "cluster_0/2_photo2.jpg" not in after and "cluster_1/2_photo2.jpg" in after
+    assert all(after[name] == inode for name, inode in before.items() if name in after)
+
+def test_user_files_survive_stale_removal(tmp_path):
+    db_name = make_library(tmp_path)
+    out = str(tmp_path / "people")
+    materialize_clusters(db_name, out, "hardlink", workers=1)
+    with open(os.path.join(out, "cluster_2", "notes.txt"), "w") as f:
+        f.write("grandma")
+
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE face_encodings SET cluster_id = -1 WHERE cluster_id = 2")
+    conn.commit()
+    conn.close()
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert stats["removed"] == 1
+    assert listing(os.path.join(out, "cluster_2")) == ["notes.txt"]
+
+def test_duplicates_and_deleted_photos_leave_the_folders(tmp_path):
+    db_name = make_library(tmp_path)
+    out = str(tmp_path / "people")
+    materialize_clusters(db_name, out, "hardlink", workers=1)
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE media_metadata SET duplicate_of = 1 WHERE id IN (1, 2)")
+    conn.execute("UPDATE media_metadata SET deleted_at = '2024-01-01 00:00:00' WHERE id = 3")
+    conn.commit()
+    conn.close()
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert stats["removed"] == 2
+    assert listing(out) == ["cluster_0/1_photo1.jpg", "cluster_1/4_photo4.jpg", "cluster_2/4_photo4.jpg"]
+
+def test_hardlink_falls_back_to_copy(tmp_path, monkeypatch):
+    def no_link(source, target):
+        raise OSError("cross-device link")
+
+    db_name = make_library(tmp_path)
+    out = str(tmp_path / "people")
+    monkeypatch.setattr(cluster_folders.os, "link", no_link)
+    stats = materialize_clusters(db_name, out, "hardlink", workers=1)
+    assert (stats["created"], stats["copied"]) == (5, 5)
+    copy = os.path.join(out, "cluster_0", "1_photo1.jpg")
+    assert not os.path.samefile(copy, tmp_path / "photo1.jpg")
+    with open(copy, "rb") as a, open(tmp_path / "photo1.jpg", "rb") as b:
+        assert a.read() == b.read()
+
+def test_crops_follow_size_and_box_changes(tmp_path):
+    db_name = make_library(tmp_path)
+    out = str(tmp_path / "faces")
+    assert materialize_clusters(db_name, out, "crops", crop_size=32, workers=1)["created"] == 5
+    crop = os.path.join(out, "cluster_0", "face_1.jpg")
+    assert max(Image.open(crop).size) == 32
+    assert materialize_clusters(db_name, out, "crops", crop_size=32, workers=1)["created"] == 0
+
+    assert materialize_clusters(db_name, out, "crops", crop_size=48, workers=1)["created"] == 5
+    assert max(Image.open(crop).size) == 48
+
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE face_encodings SET bottom = 150 WHERE id = 1")
+    conn.commit()
+    conn.close()
+    stats = materialize_clusters(db_name, out, "crops", crop_size=48, workers=1)
+    assert (stats["created"], stats["kept"]) == (1, 4)
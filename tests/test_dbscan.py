@@ -0,0 +1,63 @@
+import numpy as np
+from dbscan import dbscan, RegionQueryCache
+from face_index import BruteForceIndex
+
+def reference_dbscan(matrix, eps, min_samples):
+    """Textbook DBSCAN (Ester et al. 1996) with one brute-force region query per visited point."""
+    n = len(matrix)
+    distances = np.sqrt(((matrix[:, None, :] - matrix[None, :, :]) ** 2).sum(axis=2))
+    regions = [np.flatnonzero(row <= eps) for row in distances]
+    labels = np.full(n, -2, dtype=np.int64)  # -2: unvisited
+    core = np.array([len(region) >= min_samples for region in regions])
+    cluster_id = 0
+    for point in range(n):
+        if labels[point] != -2:
+            continue
+        if not core[point]:
+            labels[point] = -1
+            continue
+        labels[point] = cluster_id
+        seeds = list(regions[point])
+        while seeds:
+            neighbor = seeds.pop()
+            if labels[neighbor] == -1:
+                labels[neighbor] = cluster_id
+            if labels[neighbor] != -2:
+                continue
+            labels[neighbor] = cluster_id
+            if core[neighbor]:
+                seeds.extend(regions[neighbor])
+        cluster_id += 1
+    return labels, core
+
+class CountingIndex(BruteForceIndex):
+    """Brute-force index that records every point it runs a region query for."""
+
+    def __init__(self, encodings):
+        super().__init__(encodings)
+        self.queried = []
+
+    def range_query(self, ids, eps):
+        self.queried.extend(ids)
+        return super().range_query(ids, eps)
+
+def blobs(seed, n=600, centers=8, dim=16):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(scale=1.0, size=(centers, dim))
+    points = means[rng.integers(centers, size=n)] + rng.normal(scale=0.15, size=(n, dim))
+    noise = rng.uniform(-2, 2, size=(n // 10, dim))
+    return np.vstack([points, noise]).astype(np.float32)
+
+def test_labels_match_reference_with_one_query_per_point():
+    for seed in range(3):
+        matrix = blobs(seed)
+        for eps, min_samples in ((0.6, 5), (0.7, 3), (0.9, 20)):
+            for batch_size in (1, 7, 1024):
+                index = CountingIndex(matrix)
+                cache = RegionQueryCache(index, eps, batch_size=batch_size)
+                labels, core = dbscan(index, eps, min_samples, region_cache=cache, return_core=True)
+                expected_labels, expected_core = reference_dbscan(matrix, eps, min_samples)
+
+                assert np.array_equal(labels, expected_labels), (seed, eps, min_samples, batch_size)
+                assert np.array_equal(core, expected_core)
+                assert len(index.queried) == len(set(index.queried)) == cache.query_count <= len(matrix)
@@ -0,0 +1,51 @@
+import os
+import sqlite3
+from drive_import import DriveClient, import_folder
+from fake_drive import FakeDrive
+
+FILES = {f"id{i:03d}": (f"photo{i}.jpg", os.urandom(1000 + 37 * i)) for i in range(7)}
+
+def run_import(drive, folder, db_name):
+    client = DriveClient(base_url=drive.base_url, backoff=0)
+    return sorted(import_folder(client, "root", str(folder), str(db_name), workers=2))
+
+def test_listing_follows_every_page():
+    with FakeDrive(FILES) as drive:
+        client = DriveClient(base_url=drive.base_url, backoff=0)
+        items = list(client.list_images("root", page_size=3))
+    assert [item["id"] for item in items] == sorted(FILES)
+    assert [query.get("pageToken") for path, query, _ in drive.requests if path == "/files"] == [None, "3", "6"]
+
+def test_interrupted_download_resumes_with_range(tmp_path):
+    with FakeDrive(FILES, cut_once={"id004"}) as drive:
+        paths = run_import(drive, tmp_path / "photos", tmp_path / "media.db")
+    title, content = FILES["id004"]
+    assert len(paths) == len(FILES)
+    assert (tmp_path / "photos" / title).read_bytes() == content
+    assert drive.media_requests("id004") == [("id004", None), ("id004", f"bytes={len(content) // 2}-")]
+    assert not any(name.endswith(".part") for name in os.listdir(tmp_path / "photos"))
+
+def test_present_files_are_skipped_by_size_and_md5(tmp_path):
+    folder = tmp_path / "photos"
+    with FakeDrive(FILES) as drive:
+        run_import(drive, folder, tmp_path / "media.db")
+        downloads = len(drive.media_requests())
+        run_import(drive, folder, tmp_path / "media.db")
+        assert len(drive.media_requests()) == downloads == len(FILES)
+
+        # Files already on disk but not in the manifest are adopted without downloading
+        run_import(drive, folder, tmp_path / "other.db")
+        assert len(drive.media_requests()) == downloads
+    conn = sqlite3.connect(tmp_path / "other.db")
+    assert conn.execute("SELECT COUNT(*) FROM drive_files").fetchone()[0] == len(FILES)
+    conn.close()
+
+def test_unrelated_local_file_is_not_overwritten(tmp_path):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    (folder / "photo2.jpg").write_bytes(b"someone else's photo")
+    with FakeDrive(FILES) as drive:
+        paths = run_import(drive, folder, tmp_path / "media.db")
+    assert (folder / "photo2.jpg").read_bytes() == b"someone else's photo"
+    assert str(folder / "photo2_id002.jpg") in paths
+    assert (folder / "photo2_id002.jpg").read_bytes() == FILES["id002"][1]
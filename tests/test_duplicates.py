@@ -0,0 +1,133 @@
+import random
+import sqlite3
+import numpy as np
+from PIL import Image
+import schema
+from image_hash import MultiIndexHash, hamming, to_signed, HASH_MASK
+from duplicates import hash_new_media, group_duplicates
+
+def test_search_matches_a_linear_scan():
+    rng = random.Random(0)
+    centers = [rng.getrandbits(64) for _ in range(40)]
+    hashes = []
+    for center in centers:  # Clusters of near hashes, so every radius finds something
+        for _ in range(25):
+            value = center
+            for bit in rng.sample(range(64), rng.randint(0, 12)):
+                value ^= 1 << bit
+            hashes.append(value)
+    hashes += [rng.getrandbits(64) for _ in range(200)]
+
+    # Each radius crosses a multiple of `chunks`, where the bits flipped per chunk step up
+    for chunks, radii in ((2, (0, 1, 2, 3)), (4, (0, 3, 4, 7, 8, 11)), (8, (7, 8, 15, 16))):
+        index = MultiIndexHash(chunks)
+        for i, value in enumerate(hashes):
+            index.add(value, i)
+        assert len(index) == len(hashes)
+        for radius in radii:
+            for query in rng.sample(hashes, 30) + [rng.getrandbits(64) for _ in range(5)]:
+                expected = sorted((hamming(query, value), i) for i, value in enumerate(hashes)
+                                  if hamming(query, value) <= radius)
+                found = index.search(query, radius)
+                assert sorted(found) == expected, (chunks, radius)
+                assert [distance for distance, _ in found] == sorted(distance for distance, _ in found)
+
+def make_db(tmp_path, rows):
+    """rows: (id, dhash, phash, width, height)"""
+    db_name = str(tmp_path / "media.db")
+    schema.migrate(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.executemany(
+        "INSERT INTO media_metadata (id, file_path, dhash, phash, image_width, image_height) VALUES (?, ?, ?, ?, ?, ?)",
+        [(i, f"/photos/{i}.jpg", to_signed(d), to_signed(p), w, h) for i, d, p, w, h in rows],
+    )
+    conn.commit()
+    conn.close()
+    return db_name
+
+def groups(db_name):
+    conn = sqlite3.connect(db_name)
+    result = dict(conn.execute("SELECT id, duplicate_of FROM media_metadata ORDER BY id"))
+    conn.close()
+    return result
+
+def execute(db_name, sql):
+    conn = sqlite3.connect(db_name)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+A, B = 0x0123456789ABCDEF, 0xFEDCBA9876543210
+NEAR_A = A ^ 0b101  # 2 bits from A
+FAR_A = A ^ 0x3FF  # 10 bits from A
+
+def test_largest_copy_becomes_the_original(tmp_path):
+    db_name = make_db(tmp_path, [
+        (1, A, B, 640, 480), (2, NEAR_A, B, 4000, 3000), (3, A, B, 1024, 768), (4, B, A, 800, 600),
+    ])
+    assert group_duplicates(db_name) == (2, 2)
+    assert groups(db_name) == {1: 2, 2: 2, 3: 2, 4: 4}
+
+    # A rerun finds nothing new
+    assert group_duplicates(db_name) == (0, 0)
+
+def test_pHash_must_agree_as_well(tmp_path):
+    db_name = make_db(tmp_path, [(1, A, B, 640, 480), (2, A, B ^ HASH_MASK, 320, 240)])
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: 2}
+
+def test_members_are_released_when_their_original_goes(tmp_path):
+    db_name = make_db(tmp_path, [
+        (1, A, B, 4000, 3000), (2, A, B, 1024, 768), (3, NEAR_A, B, 640, 480), (4, B, A, 100, 100),
+    ])
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: 1, 3: 1, 4: 4}
+
+    # Deleted original: the largest remaining copy takes over
+    execute(db_name, "UPDATE media_metadata SET deleted_at = '2024-01-01 00:00:00' WHERE id = 1")
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: 2, 3: 2, 4: 4}
+
+    # Changed original (re-ingested, so it lost its hashes and group): its member is placed again
+    execute(db_name, "UPDATE media_metadata SET dhash = NULL, phash = NULL, duplicate_of = NULL WHERE id = 2")
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: None, 3: 3, 4: 4}
+
+def test_regroup_applies_new_distances_to_every_group(tmp_path):
+    db_name = make_db(tmp_path, [(1, A, B, 4000, 3000), (2, FAR_A, B, 1024, 768)])
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: 2}
+
+    # Without regroup, existing groups are kept
+    group_duplicates(db_name, max_distance=11)
+    assert groups(db_name) == {1: 1, 2: 2}
+    group_duplicates(db_name, max_distance=11, regroup=True)
+    assert groups(db_name) == {1: 1, 2: 1}
+    group_duplicates(db_name, regroup=True)
+    assert groups(db_name) == {1: 1, 2: 2}
+
+def test_flat_frames_are_grouped_alone(tmp_path):
+    paths = []
+    for i, pixels in enumerate([
+        np.full((64, 64, 3), 30, np.uint8),
+        np.full((64, 64, 3), 200, np.uint8),
+        np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8),
+    ]):
+        paths.append(str(tmp_path / f"{i}.png"))
+        Image.fromarray(pixels).save(paths[-1])
+    db_name = str(tmp_path / "media.db")
+    schema.migrate(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.executemany("INSERT INTO media_metadata (id, file_path) VALUES (?, ?)", enumerate(paths, 1))
+    conn.commit()
+    conn.close()
+
+    assert hash_new_media(db_name, workers=1) == 3
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute("SELECT id, dhash IS NULL, duplicate_of FROM media_metadata ORDER BY id").fetchall()
+    conn.close()
+    assert rows == [(1, 1, 1), (2, 1, 2), (3, 0, None)]
+    # Nothing is left to hash, and the flat frames are never compared
+    assert hash_new_media(db_name, workers=1) == 0
+    group_duplicates(db_name)
+    assert groups(db_name) == {1: 1, 2: 2, 3: 3}
@@ -0,0 +1,88 @@
+import os
+import csv
+import sqlite3
+import pytest
+import schema
+import export_to_excel
+from export_to_excel import export_table
+
+def make_db(tmp_path, count=7):
+    db_name = str(tmp_path / "media.db")
+    schema.migrate(db_name)
+    conn = sqlite3.connect(db_name)
+    conn.executemany(
+        "INSERT INTO media_metadata (id, file_path, filename, make, file_size, image_width) VALUES (?, ?, ?, ?, ?, ?)",
+        [(i, f"/photos/{i}.jpg", f"{i}.jpg", "Apple" if i % 2 else "Canon", 1000 + i, 640) for i in range(1, count + 1)],
+    )
+    conn.commit()
+    conn.close()
+    return db_name
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+def test_integer_column_with_real_and_text_values_to_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    db_name = make_db(tmp_path)
+    conn = sqlite3.connect(db_name)
+    conn.execute("UPDATE media_metadata SET file_size = 1234.5 WHERE id = 6")
+    conn.execute("UPDATE media_metadata SET image_width = 'wide' WHERE id = 7")
+    conn.commit()
+    conn.close()
+
+    output = str(tmp_path / "media.parquet")
+    assert export_table(db_name, output, ["id", "file_size", "image_width", "make"], chunk_rows=2) == 7
+    table = pq.read_table(output)
+    assert str(table.schema.field("id").type) == "int64"
+    assert str(table.schema.field("file_size").type) == "double"
+    assert str(table.schema.field("image_width").type) == "string"
+    assert table.column("file_size").to_pylist() == [1001, 1002, 1003, 1004, 1005, 1234.5, 1007]
+    assert table.column("image_width").to_pylist() == ["640"] * 6 + ["wide"]
+
+    # The declared types are kept when the selected rows all match them
+    export_table(db_name, output, ["file_size", "image_width"], where="m.id <= ?", params=(5,))
+    table = pq.read_table(output)
+    assert [str(field.type) for field in table.schema] == ["int64", "int64"]
+
+def test_unknown_column_is_rejected(tmp_path):
+    db_name = make_db(tmp_path)
+    with pytest.raises(ValueError, match="nope"):
+        export_table(db_name, str(tmp_path / "media.csv"), ["id", "nope"])
+    assert not os.path.exists(tmp_path / "media.csv")
+
+def test_where_and_params_filter_rows(tmp_path):
+    db_name = make_db(tmp_path)
+    output = str(tmp_path / "media.csv")
+    assert export_table(db_name, output, ["id", "make"], where="m.make = ? AND m.id > ?", params=("Apple", 2)) == 3
+    assert read_csv(output) == [["id", "make"], ["3", "Apple"], ["5", "Apple"], ["7", "Apple"]]
+
+def test_no_temporary_file_is_left_when_the_writer_fails(tmp_path, monkeypatch):
+    def failing_writer(f, header, chunks):
+        f.write("partial")
+        raise OSError("disk full")
+
+    db_name = make_db(tmp_path)
+    output = str(tmp_path / "media.csv")
+    with open(output, "w") as f:
+        f.write("previous export")
+    monkeypatch.setattr(export_to_excel, "_write_csv", failing_writer)
+    with pytest.raises(OSError):
+        export_table(db_name, output)
+    assert sorted(os.listdir(tmp_path)) == ["media.csv", "media.db"]
+    with open(output) as f:
+        assert f.read() == "previous export"
+
+def test_xlsx_continues_on_a_new_sheet(tmp_path, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(export_to_excel, "XLSX_SHEET_ROWS", 3)
+    db_name = make_db(tmp_path)
+    output = str(tmp_path / "media.xlsx")
+    assert export_table(db_name, output, ["id", "make"], chunk_rows=2) == 7
+
+    workbook = openpyxl.load_workbook(output, read_only=True)
+    assert workbook.sheetnames == ["media_metadata", "media_metadata_2", "media_metadata_3"]
+    sheets = [[list(row) for row in workbook[name].iter_rows(values_only=True)] for name in workbook.sheetnames]
+    assert all(sheet[0] == ["id", "make"] for sheet in sheets)
+    assert [row[0] for sheet in sheets for row in sheet[1:]] == list(range(1, 8))
+    assert [len(sheet) - 1 for sheet in sheets] == [3, 3, 1]